@@ -1,3 +1,4 @@
+from collections import deque
 from datetime import datetime
 
 
@@ -16,6 +17,12 @@ class PID:
       previous_error = error
       wait(dt)
       goto start
+
+    With `max_age` set the integral only covers the errors of the last
+    `max_age` seconds. The history is a deque of [error, interval, time]
+    entries, where time is the sum of all intervals when the entry was added,
+    and the integral is kept as a running sum, so each recalculation only
+    touches the entries that expire.
     '''
 
     def __init__(self, Kp=2., Ki=0., Kd=1.,
@@ -32,8 +39,11 @@ class PID:
         if set_point:
             self.set_point = set_point
         self.output_limits = output_limits
-        self.history = []
+        self.history = deque()
         self.max_age = max_age
+        self.elapsed = 0.
+        self._integral = 0.
+        self._updates = 0
         self.last_recalc_time = None
         self.last_interval = 0.
 
@@ -43,7 +53,9 @@ class PID:
         if new_set_point:
             self.set_point = float(new_set_point)
         if reset_integral:
-            self.history = []
+            self.history.clear()
+            self._integral = 0.
+            self._updates = 0
         if not interval:
             if self.last_recalc_time:
                 now = datetime.utcnow()
@@ -56,17 +68,20 @@ class PID:
         self.Pval = error
 
         # Ival
-        for entry in self.history:
-            entry[2] += interval
-        for entry in self.history:
-            if self.max_age:
-                if entry[2] > self.max_age:
-                    self.history.remove(entry)
-        self.history.append([error, interval, 0])
-        new_Ival = 0
-        for entry in self.history:
-            new_Ival += entry[0] * entry[1]
-        self.Ival = new_Ival
+        self.elapsed += interval
+        if self.max_age:
+            while self.history and self.elapsed - self.history[0][2] > self.max_age:
+                old_error, old_interval, _ = self.history.popleft()
+                self._integral -= old_error * old_interval
+        self.history.append([error, interval, self.elapsed])
+        self._integral += error * interval
+        self._updates += 1
+        if self._updates > len(self.history):
+            # Resum now and then so rounding errors don't build up, still O(1)
+            # per recalculation on average
+            self._integral = sum(entry[0] * entry[1] for entry in self.history)
+            self._updates = 0
+        self.Ival = self._integral
 
         # Dval
         if self.previous_error:
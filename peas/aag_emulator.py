@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from .aag_serial import HANDSHAKE
+
+# Sky, ambient, rain frequency and wind speed for the scripted weather
+SCENARIOS = {
+    'clear': {'sky_temp': -22., 'ambient_temp': 12., 'rain_frequency': 2600., 'wind_speed': 8.},
+    'cloudy': {'sky_temp': 2., 'ambient_temp': 12., 'rain_frequency': 2600., 'wind_speed': 12.},
+    'rain': {'sky_temp': 8., 'ambient_temp': 10., 'rain_frequency': 1500., 'wind_speed': 20.},
+    'wind': {'sky_temp': -20., 'ambient_temp': 14., 'rain_frequency': 2600., 'wind_speed': 90.},
+}
+
+
+def block(code, value=''):
+    """ Formats a 15 byte reply block, e.g. block('1 ', -1234) """
+    return '!{:2s}{:>12s}'.format(code, str(value)).encode('utf-8')
+
+
+class AAGEmulator(object):
+
+    """
+    Emulates an AAG CloudWatcher on a pseudo-terminal.
+
+    The emulator speaks the RS232 protocol described in the `AAGCloudSensor`
+    docstring, so `AAGCloudSensor(serial_address=emulator.port)` works without
+    any hardware attached. Replies can be delayed, jittered and have bytes
+    dropped to exercise the timeout and retry paths, and the weather can be
+    scripted as a sequence of scenarios.
+
+    Attributes:
+        self.port: Path of the slave side of the pty to connect to.
+        self.latency: Seconds before the device starts replying.
+        self.jitter: Maximum random variation added to the latency.
+        self.latencies: Dict of command to extra time taken by that command.
+        self.drop_rate: Probability of dropping each byte of a reply.
+        self.baudrate: If set, replies are throttled to this line speed.
+        self.script: List of (seconds, scenario) steps played in order. The
+            last scenario is held once the script runs out.
+        self.received: Dict of command to number of times it was received.
+    """
+
+    def __init__(self, scenario='clear', script=None, latency=0.010, jitter=0.,
+                 latencies=None, drop_rate=0., baudrate=None, seed=None,
+                 name='CloudWatcher', firmware_version='5.88', serial_number='1234',
+                 anemometer=True):
+        self.logger = logging.getLogger('aag-emulator')
+
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = {'!E': 0.280, 'P': 0.050} if latencies is None else latencies
+        self.drop_rate = drop_rate
+        self.baudrate = baudrate
+        self.random = random.Random(seed)
+
+        self.name = name
+        self.firmware_version = firmware_version
+        self.serial_number = serial_number
+        self.anemometer = anemometer
+
+        self.script = script or [(0., scenario)]
+        self.pwm = 0
+        self.switch_open = True
+        self.received = dict()
+
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_time = None
+        self.port = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """ Opens the pty and starts answering commands """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._start_time = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='aag-emulator', daemon=True)
+        self._thread.start()
+
+        self.logger.info('AAG emulator listening on {}'.format(self.port))
+        return self.port
+
+    def stop(self):
+        """ Stops the emulator and closes the pty """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = None
+        self._slave = None
+
+    @property
+    def weather(self):
+        """ The scenario values for the current point in the script """
+        elapsed = time.monotonic() - (self._start_time or time.monotonic())
+        scenario = self.script[-1][1]
+        for duration, name in self.script:
+            if elapsed < duration:
+                scenario = name
+                break
+            elapsed -= duration
+        return SCENARIOS[scenario] if isinstance(scenario, str) else scenario
+
+    def reply(self, command):
+        """
+        Builds the reply to a single command.
+
+        Returns:
+            The reply bytes including the handshake block, or None if the
+            command is not understood.
+        """
+        weather = self.weather
+        ambient = weather['ambient_temp']
+        # Simple thermal model of the heated rain sensor
+        rain_sensor_temp = ambient + 0.15 * self.pwm * 100. / 1023.
+
+        if command == '!A':
+            blocks = [block('N ', self.name)]
+        elif command == '!B':
+            blocks = [block('V ', self.firmware_version)]
+        elif command == '!K':
+            blocks = ['!K{:12s}\x00'.format(self.serial_number).encode('utf-8')]
+        elif command == '!C':
+            blocks = [block('6 ', int(round(1023 * 3. / 5.))),
+                      block('4 ', self._counts(20., 56.)),
+                      block('5 ', self._ntc_counts(rain_sensor_temp))]
+        elif command == '!D':
+            blocks = [block('E1', 0), block('E2', 0), block('E3', 0), block('E4', 0)]
+        elif command == '!E':
+            blocks = [block('R ', int(weather['rain_frequency']))]
+        elif command == '!F':
+            blocks = [block('Y ' if self.switch_open else 'X ', 1)]
+        elif command in ('!G', '!H'):
+            self.switch_open = command == '!G'
+            blocks = [block('Y ' if self.switch_open else 'X ', 1)]
+        elif command == '!Q' or command.startswith('P'):
+            if command.startswith('P'):
+                self.pwm = int(command[1:5])
+            blocks = [block('Q ', self.pwm)]
+        elif command == '!S':
+            blocks = [block('1 ', int(round(weather['sky_temp'] * 100)))]
+        elif command == '!T':
+            blocks = [block('2 ', int(round(ambient * 100)))]
+        elif command == '!z':
+            blocks = []
+        elif command == 'v!':
+            blocks = [block('v ', int(self.anemometer))]
+        elif command == 'V!':
+            blocks = [block('w ', int(round(weather['wind_speed'])))]
+        elif command == 'M!':
+            # Zener voltage, LDR max, LDR pull up, rain beta, rain R at 25 C and
+            # rain pull up, each as a 16 bit value.
+            constants = [300, 10000, 560, 3450, 10, 10]
+            blocks = [b'!M' + bytes(b for c in constants for b in divmod(c, 256)) + b' ']
+        else:
+            return None
+
+        return b''.join(blocks) + b'!' + HANDSHAKE
+
+    def _counts(self, resistance, pull_up):
+        return int(round(1023. * resistance / (resistance + pull_up)))
+
+    def _ntc_counts(self, temp, beta=3450., pull_up=1., res_at_25=1.):
+        r = beta * (1. / (temp + 273.15) - 1. / 298.15)
+        return self._counts(res_at_25 * math.exp(r), pull_up)
+
+    def _parse(self, buf):
+        """ Splits complete commands off the front of the input buffer """
+        commands = []
+        while buf:
+            if buf.startswith('!'):
+                size = 2
+            elif buf.startswith('P'):
+                size = 6
+            elif buf[0] in 'vVM':
+                size = 2
+            else:
+                buf = buf[1:]
+                continue
+            if len(buf) < size:
+                break
+            commands.append(buf[:size])
+            buf = buf[size:]
+        return commands, buf
+
+    def _run(self):
+        buf = ''
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                buf += os.read(self._master, 64).decode('utf-8', 'replace')
+            except OSError:
+                break
+
+            commands, buf = self._parse(buf)
+            for command in commands:
+                key = 'P' if command.startswith('P') else command
+                self.received[key] = self.received.get(key, 0) + 1
+
+                response = self.reply(command)
+                if response is None:
+                    self.logger.debug('Unknown command: "{}"'.format(command))
+                    continue
+
+                delay = self.latency + self.latencies.get(key, 0.)
+                if self.jitter:
+                    delay += self.random.uniform(0., self.jitter)
+                time.sleep(delay)
+
+                if self.drop_rate:
+                    response = bytes(b for b in response
+                                     if self.random.random() >= self.drop_rate)
+                if self.baudrate:
+                    # 10 bits per byte on the line
+                    time.sleep(len(response) * 10. / self.baudrate)
+
+                os.write(self._master, response)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Emulate an AAG CloudWatcher on a pty.")
+    parser.add_argument('--scenario', default='clear', choices=sorted(SCENARIOS.keys()),
+                        help="Weather to report")
+    parser.add_argument('--latency', default=0.010, type=float, help="Reply latency in seconds")
+    parser.add_argument('--jitter', default=0., type=float, help="Maximum extra latency in seconds")
+    parser.add_argument('--drop-rate', default=0., type=float, help="Probability of dropping a byte")
+    parser.add_argument('--baudrate', default=None, type=int, help="Throttle replies to this baud rate")
+    args = parser.parse_args()
+
+    emulator = AAGEmulator(scenario=args.scenario, latency=args.latency, jitter=args.jitter,
+                           drop_rate=args.drop_rate, baudrate=args.baudrate)
+    print("Emulating AAG CloudWatcher on {}".format(emulator.start()))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import warnings
+
+# Electrical constants used to convert the analog readings, see the
+# "Converting values sent by the device to meaningful units" section of
+# Rs232_Comms_v100.pdf
+DEFAULT_CONSTANTS = {
+    'zener_constant': 3.,
+    'ldr_pull_up': 56.,  # kohm
+    'rain_pull_up': 1.,
+    'rain_res_at_25': 1.,
+    'rain_beta': 3450.,
+    'abs_zero': 273.15,
+}
+
+# Raw fields kept for every read cycle: name -> (command, reply group, dtype)
+RAW_FIELDS = {
+    'sky': ('!S', 0, np.int16),  # hundredths of deg C
+    'ambient': ('!T', 0, np.int16),  # hundredths of deg C
+    'zener': ('!C', 0, np.uint16),  # 0-1023
+    'ldr': ('!C', 1, np.uint16),  # 0-1023
+    'rain_ntc': ('!C', 2, np.uint16),  # 0-1023
+    'rain_frequency': ('!E', 0, np.uint16),
+    'pwm': ('!Q', 0, np.uint16),  # 0-1023
+    'wind_speed': ('V!', 0, np.uint16),  # km/h
+}
+
+
+def constants_from_reply(reply):
+    """
+    Decodes the 12 bytes returned by the M! command (Rs232_Comms_v120.pdf)
+    into electrical constants, as six big endian 16 bit values.
+    """
+    data = reply.encode('latin-1')
+    values = [256 * data[i] + data[i + 1] for i in range(0, 12, 2)]
+    return {
+        'zener_constant': values[0] / 100.,
+        'ldr_max_resistance': values[1] / 1.,
+        'ldr_pull_up': values[2] / 10.,
+        'rain_beta': values[3] / 1.,
+        'rain_res_at_25': values[4] / 10.,
+        'rain_pull_up': values[5] / 10.,
+    }
+
+
+def parse_counts(replies, ncols=1):
+    """
+    Turns reply groups into a float array of shape (readings, ncols).
+    Failed or unparsable replies are dropped.
+    """
+    rows = list()
+    for groups in replies:
+        try:
+            rows.append([float(g) for g in groups[:ncols]])
+        except (TypeError, ValueError, IndexError):
+            pass
+    return np.array(rows, dtype=float).reshape(-1, ncols)
+
+
+def raw_from_cycle(cycle):
+    """
+    Keeps the raw readings of an `AAGCycleResult` as compact arrays.
+
+    Returns:
+        Dict of field name to a 1-d array with one entry per good reading.
+    """
+    raw = dict()
+    for name, (command, group, dtype) in RAW_FIELDS.items():
+        counts = parse_counts(cycle[command], ncols=group + 1)[:, group]
+        raw[name] = counts.astype(dtype)
+    return raw
+
+
+def internal_voltage(zener, constants=DEFAULT_CONSTANTS):
+    """ Internal supply voltage from the zener reference counts (item 4) """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1023. * constants['zener_constant'] / np.asarray(zener, dtype=float)
+
+
+def ldr_resistance(ldr, constants=DEFAULT_CONSTANTS):
+    """ LDR resistance in kohm from the ambient light counts (item 6) """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return constants['ldr_pull_up'] / ((1023. / np.asarray(ldr, dtype=float)) - 1.)
+
+
+def rain_sensor_temp(rain_ntc, constants=DEFAULT_CONSTANTS):
+    """ Rain sensor temperature in deg C from the NTC counts (item 7) """
+    abs_zero = constants['abs_zero']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        resistance = constants['rain_pull_up'] / ((1023. / np.asarray(rain_ntc, dtype=float)) - 1.)
+        r = np.log(resistance / constants['rain_res_at_25'])
+        return 1. / ((r / constants['rain_beta']) + (1. / (abs_zero + 25.))) - abs_zero
+
+
+def convert(raw, constants=None):
+    """
+    Converts raw readings to physical units in one vectorized pass.
+
+    Args:
+        raw: Dict of field name to array of raw readings, of any shape.
+        constants: Electrical constants, defaults to `DEFAULT_CONSTANTS`.
+
+    Returns:
+        Dict with 'sky_temp_C', 'ambient_temp_C', 'internal_voltage_V',
+        'ldr_resistance_Ohm', 'rain_sensor_temp_C', 'rain_frequency',
+        'pwm_value' and 'wind_speed_KPH' arrays for the fields present in
+        `raw`. Readings that can't be converted are NaN.
+    """
+    if constants is None:
+        constants = DEFAULT_CONSTANTS
+
+    converted = dict()
+    if 'sky' in raw:
+        converted['sky_temp_C'] = np.asarray(raw['sky'], dtype=float) / 100.
+    if 'ambient' in raw:
+        converted['ambient_temp_C'] = np.asarray(raw['ambient'], dtype=float) / 100.
+    if 'zener' in raw:
+        converted['internal_voltage_V'] = internal_voltage(raw['zener'], constants)
+    if 'ldr' in raw:
+        converted['ldr_resistance_Ohm'] = ldr_resistance(raw['ldr'], constants)
+    if 'rain_ntc' in raw:
+        converted['rain_sensor_temp_C'] = rain_sensor_temp(raw['rain_ntc'], constants)
+    if 'rain_frequency' in raw:
+        converted['rain_frequency'] = np.asarray(raw['rain_frequency'], dtype=float)
+    if 'pwm' in raw:
+        converted['pwm_value'] = np.asarray(raw['pwm'], dtype=float) * 100. / 1023.
+    if 'wind_speed' in raw:
+        converted['wind_speed_KPH'] = np.asarray(raw['wind_speed'], dtype=float)
+
+    for name, values in converted.items():
+        values[~np.isfinite(values)] = np.nan
+
+    return converted
+
+
+def stack(raws):
+    """
+    Stacks the raw readings of many cycles, e.g. the 'raw' entries of stored
+    weather documents, into NaN padded 2-d arrays of shape (cycles, readings).
+    """
+    stacked = dict()
+    for name in RAW_FIELDS:
+        rows = [np.asarray(raw.get(name, []), dtype=float).ravel() for raw in raws]
+        lengths = np.array([len(row) for row in rows], dtype=int)
+        width = lengths.max() if len(rows) else 0
+        array = np.full((len(rows), width), np.nan)
+        if width:
+            array[np.arange(width) < lengths[:, None]] = np.concatenate(rows)
+        stacked[name] = array
+    return stacked
+
+
+def reprocess(raws, constants=None):
+    """
+    Recomputes the median value of every cycle from stored raw readings,
+    e.g. with corrected electrical constants, without querying the device.
+
+    Returns:
+        Dict of converted field name to an array with one median per cycle.
+    """
+    converted = convert(stack(raws), constants=constants)
+    with warnings.catch_warnings():
+        # Cycles without any good reading give NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return {name: np.nanmedian(values, axis=1) for name, values in converted.items()}
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import logging
+import numpy as np
+import re
+import threading
+import time
+
+# Every reply from the CloudWatcher is made of fixed length blocks of the form
+# '!' + 2 character code + 12 character value, and is terminated by the
+# handshake block '!' + XON + 12 spaces + '0'.
+BLOCK_SIZE = 15
+HANDSHAKE = b'\x11' + b' ' * 12 + b'0'
+
+
+class AAGSerialTransport(object):
+
+    """
+    Response-framed serial transport for the AAG CloudWatcher.
+
+    Instead of sleeping for a fixed delay after each command and reading
+    whatever happens to be waiting, the reply is read one 15 byte block at a
+    time until the handshake block arrives or the per-command deadline is
+    reached. A command therefore only takes as long as the device needs to
+    answer it.
+
+    Attributes:
+        self.port: An open `serial.Serial` (or compatible) instance.
+        self.poll_interval: Read timeout of the port, i.e. how often the
+            deadline is checked while waiting for bytes.
+        self.last_elapsed: Seconds taken by the last transaction.
+        self.last_framed: Whether the last transaction saw the handshake.
+        self.missed_deadlines: Number of transactions that hit their deadline.
+        self.malformed: Number of replies that were not a whole number of blocks.
+        self.lock: Held for every transaction, so commands sent from another
+            thread, e.g. a heater update, never interleave with a reply.
+    """
+
+    def __init__(self, port, poll_interval=0.05, logger=None):
+        self.logger = logger or logging.getLogger('aag-transport')
+
+        self.port = port
+        self.poll_interval = poll_interval
+        self.port.timeout = poll_interval
+
+        self.last_elapsed = None
+        self.last_framed = None
+        self.missed_deadlines = 0
+        self.malformed = 0
+
+        self.lock = threading.Lock()
+
+    def clear(self):
+        """ Discard anything left over in the input buffer """
+        cleared = self.port.read(self.port.inWaiting())
+        if len(cleared) > 0:
+            self.logger.debug('  Cleared: "{}"'.format(cleared.decode('utf-8', 'replace')))
+        return cleared
+
+    def read_reply(self, deadline=1.0):
+        """
+        Reads blocks until the handshake block is seen or `deadline` seconds
+        have passed.
+
+        Returns:
+            The raw bytes read, including the handshake if it was received.
+        """
+        start = time.monotonic()
+        buf = b''
+        while not buf.endswith(HANDSHAKE):
+            if time.monotonic() - start > deadline:
+                break
+            # Ask for the rest of the current block so reads stay aligned
+            buf += self.port.read(BLOCK_SIZE - len(buf) % BLOCK_SIZE)
+        return buf
+
+    def transact(self, command, deadline=1.0):
+        """
+        Sends `command` and waits for the framed reply.
+
+        Args:
+            command: The command string, e.g. '!S' or 'P0512!'.
+            deadline: Maximum number of seconds to wait for the handshake.
+
+        Returns:
+            The reply with the handshake stripped, or whatever was received
+            before the deadline if the handshake never arrived. None if the
+            reply lost bytes on the way.
+        """
+        with self.lock:
+            self.clear()
+
+            start = time.monotonic()
+            self.port.write(command.encode('utf-8'))
+            raw = self.read_reply(deadline=deadline)
+
+            return self.unframe(command, raw, time.monotonic() - start)
+
+    def unframe(self, command, raw, elapsed):
+        """ Checks and strips the framing of a raw reply, see `transact` """
+        self.last_elapsed = elapsed
+        self.last_framed = raw.endswith(HANDSHAKE)
+        if not self.last_framed:
+            self.missed_deadlines += 1
+            self.logger.debug('  No handshake for "{}" after {:.3f} s'.format(
+                command, self.last_elapsed))
+
+        if len(raw) % BLOCK_SIZE:
+            # Check the number of characters received, as the manual advises
+            self.malformed += 1
+            self.logger.debug('  Reply to "{}" is {} bytes, not whole blocks'.format(
+                command, len(raw)))
+            return None
+
+        if self.last_framed:
+            raw = raw[:-len(HANDSHAKE)]
+
+        # Some replies, e.g. to M!, carry binary values
+        response = raw.decode('latin-1')
+
+        self.logger.debug('  Response: "{}" ({:.3f} s)'.format(response, self.last_elapsed))
+        return response
+
+
+class AdaptiveSampler(object):
+
+    """
+    Decides when repeated readings of a value agree well enough to stop.
+
+    The manual advises several readings of each value and a median to reject
+    outliers. On a stable night the first few readings already agree, so the
+    rest can be skipped. The number of readings in the plan stays the upper
+    bound.
+
+    Attributes:
+        self.tolerance: Largest spread accepted, in the units of the raw reply.
+            Either a single value or one per reply group.
+        self.min_samples: Readings always taken before checking the spread.
+        self.method: 'mad' for the median absolute deviation, 'range' for
+            the full spread of the readings.
+    """
+
+    def __init__(self, tolerance, min_samples=3, method='mad'):
+        if method not in ('mad', 'range'):
+            raise ValueError("Unknown sampling method: {}".format(method))
+
+        self.tolerance = np.asarray(tolerance, dtype=float)
+        self.min_samples = min_samples
+        self.method = method
+
+    def spread(self, values):
+        """ The spread of each column of `values` """
+        values = np.asarray(values, dtype=float)
+        if self.method == 'mad':
+            return np.median(np.abs(values - np.median(values, axis=0)), axis=0)
+        return np.ptp(values, axis=0)
+
+    def done(self, values):
+        """ Whether `values`, a list of readings, agree within the tolerance """
+        if len(values) < self.min_samples:
+            return False
+        return bool(np.all(self.spread(values) <= self.tolerance))
+
+
+class AAGCycleResult(object):
+
+    """
+    Result of running a command plan with `AAGReadCycle`.
+
+    Attributes:
+        self.replies: Dict of command to a list of matched reply groups, one
+            entry per time the command appears in the plan (None on failure).
+        self.timings: List of dicts with the command, elapsed seconds, number
+            of tries and whether the handshake was seen for every step.
+        self.elapsed: Total seconds taken by the cycle.
+    """
+
+    def __init__(self):
+        self.replies = dict()
+        self.timings = list()
+        self.elapsed = 0.
+
+    def __getitem__(self, command):
+        return self.replies.get(command, [])
+
+    def __contains__(self, command):
+        return command in self.replies
+
+    def values(self, command):
+        """ Successful replies to `command` as a list of tuples of floats """
+        values = list()
+        for groups in self.replies.get(command, []):
+            try:
+                values.append(tuple(float(g) for g in groups))
+            except (TypeError, ValueError):
+                pass
+        return values
+
+    def count(self, command):
+        """ Number of successful replies to `command` """
+        return len(self.values(command))
+
+    def add(self, command, groups, elapsed, tries, framed):
+        self.replies.setdefault(command, []).append(groups)
+        self.timings.append({'command': command,
+                             'elapsed': elapsed,
+                             'tries': tries,
+                             'framed': framed})
+
+
+class AAGReadCycle(object):
+
+    """
+    Compiles a CloudWatcher read cycle into a single command plan and runs it
+    back to back over an `AAGSerialTransport`.
+
+    Reply patterns are compiled once and every step of the plan carries its
+    own deadline, so running a cycle involves no command lookup, no sleeps
+    and a single retry loop.
+
+    Attributes:
+        self.transport: The `AAGSerialTransport` used to talk to the device.
+        self.expects: Dict of command to compiled reply pattern.
+        self.deadlines: Dict of command to deadline in seconds.
+        self.maxtries: Number of attempts per step before giving up.
+    """
+
+    def __init__(self, transport, expects, deadlines=None, default_deadline=0.500,
+                 maxtries=3, logger=None):
+        self.logger = logger or logging.getLogger('aag-cycle')
+
+        self.transport = transport
+        self.expects = {cmd: re.compile(pattern) for cmd, pattern in expects.items()}
+        self.deadlines = deadlines or dict()
+        self.default_deadline = default_deadline
+        self.maxtries = maxtries
+
+    def compile(self, counts):
+        """
+        Builds a command plan.
+
+        Commands are interleaved round by round, as recommended by the
+        "Communication operational recommendations" section of
+        Rs232_Comms_v100.pdf, i.e. !S, !T, !C, !E, !S, !T, ...
+
+        Args:
+            counts: List of (command, number of times) tuples.
+
+        Returns:
+            List of (command, compiled pattern, deadline) steps.
+        """
+        plan = list()
+        rounds = max([n for cmd, n in counts] or [0])
+        for i in range(rounds):
+            for cmd, n in counts:
+                if i < n:
+                    plan.append((cmd,
+                                 self.expects[cmd],
+                                 self.deadlines.get(cmd, self.default_deadline)))
+        return plan
+
+    def new_result(self):
+        return AAGCycleResult()
+
+    def match(self, expect, response):
+        """ Returns the groups of `expect` in `response`, or None """
+        match = expect.match(response or '')
+        if match is None:
+            self.logger.debug('Did not find {} in response "{}"'.format(expect.pattern, response))
+            return None
+        return match.groups()
+
+    def converged(self, result, command, samplers):
+        """ Whether the sampler of `command` says no more readings are needed """
+        if not samplers or command not in samplers or command not in result:
+            return False
+        return samplers[command].done(result.values(command))
+
+    def steps(self, plan, samplers=None):
+        """
+        Works through a compiled command plan without talking to the device.
+
+        A generator yielding a (command, deadline) tuple for every
+        transaction and expecting the response to be sent back, so `run` and
+        its asyncio version share the retries and adaptive sampling.
+
+        Args:
+            plan: Steps from `compile`.
+            samplers: Optional dict of command to `AdaptiveSampler`. Remaining
+                steps for a command are skipped once its sampler is done.
+
+        Returns:
+            An `AAGCycleResult`, as the value of the final StopIteration.
+        """
+        result = self.new_result()
+        start = time.monotonic()
+
+        for cmd, expect, deadline in plan:
+            if self.converged(result, cmd, samplers):
+                continue
+
+            step_start = time.monotonic()
+            groups = None
+            tries = 0
+            while groups is None and tries < self.maxtries:
+                tries += 1
+                response = yield cmd, deadline
+                groups = self.match(expect, response)
+
+            result.add(cmd, groups, time.monotonic() - step_start, tries,
+                       self.transport.last_framed)
+
+        result.elapsed = time.monotonic() - start
+        self.logger.debug('Read cycle of {} commands took {:.3f} s'.format(
+            len(plan), result.elapsed))
+
+        return result
+
+    def run(self, plan, samplers=None):
+        """
+        Runs a compiled command plan, see `steps`.
+
+        Returns:
+            An `AAGCycleResult` with the matched groups and timing of every step.
+        """
+        steps = self.steps(plan, samplers=samplers)
+        try:
+            cmd, deadline = next(steps)
+            while True:
+                cmd, deadline = steps.send(self.transport.transact(cmd, deadline=deadline))
+        except StopIteration as stop:
+            return stop.value
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import threading
+import time
+
+
+class Acquisition(object):
+
+    """
+    Keeps polling a read function on a dedicated thread.
+
+    Every complete reading is published as a `(timestamp, data)` snapshot,
+    where the timestamp comes from `time.monotonic()`. Publishing is a single
+    attribute assignment and the history is a bounded `collections.deque`, so
+    readers never take a lock and never wait on the device.
+
+    Attributes:
+        self.read: Callable returning the next reading.
+        self.interval: Seconds to wait between the end of one read and the
+            start of the next.
+        self.history: Ring buffer of the most recent snapshots.
+        self.errors: Number of reads that raised an exception.
+    """
+
+    def __init__(self, read, interval=0., history=100, name='acquisition', logger=None):
+        self.logger = logger or logging.getLogger(name)
+
+        self.read = read
+        self.interval = interval
+        self.name = name
+        self.history = collections.deque(maxlen=history)
+        self.errors = 0
+
+        self._latest = None
+        self._first = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def latest(self):
+        """ The most recent `(timestamp, data)` snapshot, or None """
+        return self._latest
+
+    @property
+    def age(self):
+        """ Seconds since the most recent snapshot was taken, or None """
+        latest = self._latest
+        if latest is None:
+            return None
+        return time.monotonic() - latest[0]
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self.logger.info('Started {} thread'.format(self.name))
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.logger.info('Stopped {} thread'.format(self.name))
+
+    def wait(self, timeout=None):
+        """ Blocks until the first snapshot is available, returns it """
+        self._first.wait(timeout)
+        return self._latest
+
+    def publish(self, data):
+        snapshot = (time.monotonic(), data)
+        self.history.append(snapshot)
+        self._latest = snapshot
+        self._first.set()
+        return snapshot
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self.interval
+            try:
+                data = self.read()
+            except Exception as e:
+                self.errors += 1
+                self.logger.warning('Problem reading in {} thread: {}'.format(self.name, e))
+                # Don't spin on a device that keeps failing
+                delay = max(delay, 1.)
+            else:
+                if data is not None:
+                    self.publish(data)
+            self._stop.wait(delay)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .stats import WindowedMax
+from .stats import WindowedMean
+from .thresholds import ThresholdClassifier
+from .thresholds import _as_float
+
+# Statuses the `_get_*_safety` methods of the met data sources count as safe
+SAFE_STATUSES = {
+    'sky-ambient': ['Clear'],
+    'wind_speed': ['Calm'],
+    'wind_gust': ['Calm'],
+    'rain_sensor': ['No rain'],
+    'int_rain_sensor': ['No rain'],
+    'boltwood_rain_flag': ['No rain'],
+    'boltwood_wet_flag': ['Dry'],
+}
+
+# Seconds of the running mean of the AAG wind speed, see `AAGCloudSensor`
+WIND_MAVG = 120.
+
+
+def aag_decisions(times, columns, cfg):
+    """
+    Safety decisions of `AAGCloudSensor.make_safety_decision` for every
+    stored reading, as if each had been the live one.
+
+    The live decision is made before the reading joins the safety history,
+    so the window of each reading holds the earlier readings only, and the
+    first reading is 'Unknown' and unsafe. The windows are worked out in one
+    go for all of them with the batch mode of the `stats` classes.
+
+    Args:
+        times: Epoch seconds of the readings, in order.
+        columns: Dict of arrays with 'sky_temp_C', 'ambient_temp_C',
+            'wind_speed_KPH' and 'rain_frequency', NaN where missing.
+        cfg: The `aag_cloud` config, or just its threshold_* and
+            safety_delay entries.
+
+    Returns:
+        Dict of 'safe' and the 'Sky', 'Wind', 'Gust' and 'Rain' conditions,
+        an array each.
+    """
+    threshold_cloudy = cfg.get('threshold_cloudy', -22.5)
+    threshold_very_cloudy = cfg.get('threshold_very_cloudy', -15.)
+    threshold_windy = cfg.get('threshold_windy', 20.)
+    threshold_very_windy = cfg.get('threshold_very_windy', 30)
+    threshold_gusty = cfg.get('threshold_gusty', 40.)
+    threshold_very_gusty = cfg.get('threshold_very_gusty', 50.)
+    threshold_wet = cfg.get('threshold_wet', 2000.)
+    threshold_rain = cfg.get('threshold_rainy', 1700.)
+    window = 60. * cfg.get('safety_delay', 15.)
+
+    sky_diff = _column(columns, 'sky_temp_C') - _column(columns, 'ambient_temp_C')
+    wind = _column(columns, 'wind_speed_KPH')
+    rain = _column(columns, 'rain_frequency')
+
+    # Statistics of the history after each reading, shifted to the next one
+    wind_mavg = WindowedMean(WIND_MAVG).batch(times, wind)
+    max_sky_diff = _previous(WindowedMax(window).batch(times, sky_diff))
+    max_wind_mavg = _previous(WindowedMax(window).batch(times, wind_mavg))
+    max_wind_speed = _previous(WindowedMax(window).batch(times, wind))
+    min_rain_frequency = _previous(WindowedMax(window, lowest=True).batch(times, rain))
+    wind_mavg = _previous(wind_mavg)
+
+    no_sky = np.isnan(max_sky_diff)
+    no_wind = np.isnan(max_wind_speed)
+    no_rain = np.isnan(min_rain_frequency)
+
+    # Comparisons with NaN are False, as in the live checks
+    with np.errstate(invalid='ignore'):
+        sky_safe = ~no_sky & ~(max_sky_diff > threshold_cloudy)
+        wind_safe = ~no_wind & ~(max_wind_mavg > threshold_very_windy)
+        gust_safe = ~no_wind & ~(max_wind_speed > threshold_very_gusty)
+        rain_safe = ~no_rain & ~(rain <= threshold_wet) & ~(min_rain_frequency <= threshold_wet)
+
+        decisions = {
+            'safe': sky_safe & wind_safe & gust_safe & rain_safe,
+            'Sky': np.select([no_sky, sky_diff > threshold_very_cloudy, sky_diff > threshold_cloudy],
+                             ['Unknown', 'Very Cloudy', 'Cloudy'], 'Clear'),
+            'Wind': np.select([no_wind, wind_mavg > threshold_very_windy, wind_mavg > threshold_windy],
+                              ['Unknown', 'Very Windy', 'Windy'], 'Calm'),
+            'Gust': np.select([no_wind, wind > threshold_very_gusty, wind > threshold_gusty],
+                              ['Unknown', 'Very Gusty', 'Gusty'], 'Calm'),
+            'Rain': np.select([no_rain, rain <= threshold_rain, rain <= threshold_wet],
+                              ['Unknown', 'Rain', 'Wet'], 'Dry'),
+        }
+    return decisions
+
+
+def remote_decisions(times, columns, thresholds):
+    """
+    Safety decisions of a met data source, e.g. `Met23Weather`, for every
+    stored reading.
+
+    Args:
+        times: Epoch seconds of the readings.
+        columns: Dict of column to array of values.
+        thresholds: The `thresholds` config of the source.
+
+    Returns:
+        Dict of 'safe' and the status of every column with thresholds.
+    """
+    classifier = ThresholdClassifier(thresholds)
+    decisions = {'safe': np.ones(len(times), dtype=bool)}
+    for column in thresholds:
+        decisions[column] = classifier.classify(column, _column(columns, column, len(times)))
+        if column in SAFE_STATUSES:
+            decisions['safe'] &= np.isin(decisions[column], SAFE_STATUSES[column])
+    return decisions
+
+
+def summarise(times, safe, max_gap=600.):
+    """
+    Sums up a run of safety decisions.
+
+    Each decision holds until the next reading, or for at most `max_gap`
+    seconds, so gaps in the data don't count towards either.
+
+    Returns:
+        Dict of the number of 'readings', the 'unsafe_fraction' of the time,
+        the number of 'flips' between safe and unsafe and how many of those
+        went 'to_unsafe'.
+    """
+    times = np.asarray(times, dtype=float)
+    safe = np.asarray(safe, dtype=bool)
+    if not len(times):
+        return {'readings': 0, 'unsafe_fraction': np.nan, 'flips': 0, 'to_unsafe': 0}
+
+    durations = np.minimum(np.diff(times, append=times[-1]), max_gap)
+    total = durations.sum()
+    if total > 0:
+        unsafe_fraction = durations[~safe].sum() / total
+    else:
+        unsafe_fraction = np.mean(~safe)
+
+    return {
+        'readings': len(times),
+        'unsafe_fraction': float(unsafe_fraction),
+        'flips': int(np.count_nonzero(safe[1:] != safe[:-1])),
+        'to_unsafe': int(np.count_nonzero(safe[:-1] & ~safe[1:])),
+    }
+
+
+def backtest(times, columns, settings, source='aag', processes=None, shard_seconds=86400.,
+             max_gap=600.):
+    """
+    Replays stored weather through several sets of thresholds.
+
+    The readings are split into shards of `shard_seconds`, each with enough
+    earlier readings to fill its safety window, and every shard of every
+    set runs on a pool of worker processes.
+
+    Args:
+        times: Epoch seconds of the readings.
+        columns: Dict of column to array of values, see `aag_decisions`.
+        settings: List of threshold sets. For the AAG each is a config dict
+            like `aag_cloud`, for the other sources a `thresholds` dict.
+        source: 'aag' or the name of another source, e.g. 'met23'.
+        processes: Number of worker processes, defaults to the number of
+            cores. With 1 everything runs in this process.
+        shard_seconds: Length of the shards.
+        max_gap: See `summarise`.
+
+    Returns:
+        List with the `summarise` results of each set, in order.
+    """
+    times = np.asarray(times, dtype=float)
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+
+    tasks = list()
+    for index, cfg in enumerate(settings):
+        context = 0.
+        if source == 'aag':
+            context = 60. * cfg.get('safety_delay', 15.) + WIND_MAVG
+        for first, start, end in _shards(times, shard_seconds, context):
+            tasks.append((index, (source, cfg, times[first:end],
+                                  {name: values[first:end] for name, values in columns.items()},
+                                  start - first)))
+
+    if processes == 1 or len(tasks) <= 1:
+        results = [_decide(*task) for _, task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_decide_task, [task for _, task in tasks]))
+
+    safe = [list() for _ in settings]
+    for (index, _), shard_safe in zip(tasks, results):
+        safe[index].append(shard_safe)
+
+    return [summarise(times, np.concatenate(s) if s else np.array([], dtype=bool), max_gap=max_gap)
+            for s in safe]
+
+
+def _decide(source, cfg, times, columns, skip):
+    """ Safe flags of the readings of a shard after its first `skip` """
+    if source == 'aag':
+        decisions = aag_decisions(times, columns, cfg)
+    else:
+        decisions = remote_decisions(times, columns, cfg)
+    return decisions['safe'][skip:]
+
+
+def _decide_task(task):
+    return _decide(*task)
+
+
+def _shards(times, shard_seconds, context):
+    """
+    Yields (first, start, end) indices, readings before `start` only fill the
+    window. The first reading of a shard is decided on the window of the one
+    before it, so the context reaches back from that one.
+    """
+    if not len(times):
+        return
+    for shard_start in np.arange(times[0], times[-1] + shard_seconds, shard_seconds):
+        start, end = np.searchsorted(times, [shard_start, shard_start + shard_seconds], side='left')
+        if end > start:
+            anchor = times[start - 1] if start else shard_start
+            yield np.searchsorted(times, anchor - context, side='left'), start, end
+
+
+def _previous(values):
+    """ Values shifted on by one reading, NaN for the first """
+    if not len(values):
+        return values
+    return np.concatenate([[np.nan], values[:-1]])
+
+
+def _column(columns, name, size=None):
+    """ Values of a column as floats, all NaN if it wasn't stored """
+    if name not in columns:
+        if size is None:
+            size = len(next(iter(columns.values())))
+        return np.full(size, np.nan)
+    return _as_float(columns[name])
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import email.utils
+import glob
+import hashlib
+import logging
+import os
+import random
+import socket
+import socketserver
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+# Sample snapshots of the feeds, in the format of the real ones
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), 'tests', 'data', 'feeds')
+
+# Config section and file of each feed, the AAT one is served over FTP
+FEEDS = {
+    'aat_metdata': ('ftp', 'metdata1.dat'),
+    'met23': ('http', 'met23.xml'),
+    'skymap': ('http', 'skymap.xml'),
+}
+
+
+class FeedServer(object):
+
+    """
+    Local stand-in for the remote met data feeds, serving snapshots of
+    `metdata1.dat` over FTP and of `met23.xml` and `skymap.xml` over HTTP
+    so the sources can be exercised and benchmarked offline.
+
+    Every file in `snapshot_dir` is served under its own name. Extra
+    versions of a file, e.g. `met23.xml.1`, `met23.xml.2`, are served in
+    turn, one every `cadence` seconds, as if the feed was updated upstream.
+
+    Attributes:
+        self.latency: Seconds to wait before answering each request.
+        self.cadence: Seconds between versions of a snapshot, None to keep
+            serving the first one.
+        self.conditional: Whether HTTP requests are answered with ETag and
+            Last-Modified headers, and 304 Not Modified where they match.
+        self.failure_rate: Fraction of requests that fail.
+        self.failure: How requests fail, 'error' to answer with an error
+            or 'hang' to answer only after `hang` seconds.
+        self.stats: Dict of counters: 'requests', 'not_modified', 'failures'
+            and 'bytes' sent.
+    """
+
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, host='127.0.0.1', http_port=0, ftp_port=0,
+                 latency=0., cadence=None, conditional=True, failure_rate=0., failure='error',
+                 hang=60., seed=None):
+        self.logger = logging.getLogger('feed-server')
+
+        self.host = host
+        self.latency = latency
+        self.cadence = cadence
+        self.conditional = conditional
+        self.failure_rate = failure_rate
+        self.failure = failure
+        self.hang = hang
+
+        self.snapshots = self._load(snapshot_dir)
+        self.stats = {'requests': 0, 'not_modified': 0, 'failures': 0, 'bytes': 0}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+        self.http = ThreadingHTTPServer((host, http_port), _HTTPHandler)
+        self.ftp = _FTPServer((host, ftp_port), _FTPHandler)
+        for server in (self.http, self.ftp):
+            server.daemon_threads = True
+            server.feeds = self
+        self._threads = list()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        for server in (self.http, self.ftp):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info('Serving {} on {} and {}'.format(
+            ', '.join(sorted(self.snapshots)), self.url('', 'http'), self.url('', 'ftp')))
+
+    def stop(self):
+        for server in (self.http, self.ftp):
+            server.shutdown()
+            server.server_close()
+        self._threads = list()
+
+    def url(self, name, scheme='http'):
+        server = self.http if scheme == 'http' else self.ftp
+        return '{}://{}:{}/{}'.format(scheme, self.host, server.server_address[1], name)
+
+    def links(self):
+        """ Dict of config section to the `link` of each feed on this server """
+        return {section: self.url(name, scheme) for section, (scheme, name) in FEEDS.items()
+                if name in self.snapshots}
+
+    def snapshot(self, name):
+        """
+        The version of a snapshot being served now.
+
+        Returns:
+            Tuple of the content and the epoch time it was "updated", or None
+            if there is no such snapshot.
+        """
+        versions = self.snapshots.get(name)
+        if not versions:
+            return None
+        if not self.cadence:
+            return versions[0], self._start
+        index = int((time.time() - self._start) // self.cadence)
+        return versions[index % len(versions)], self._start + index * self.cadence
+
+    def _request(self):
+        """ Counts a request and waits, returns whether it should fail """
+        with self._lock:
+            self.stats['requests'] += 1
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.stats['failures'] += 1
+        time.sleep(self.latency)
+        if fail and self.failure == 'hang':
+            time.sleep(self.hang)
+        return fail
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _load(self, snapshot_dir):
+        snapshots = dict()
+        for path in sorted(glob.glob(os.path.join(snapshot_dir, '*'))):
+            name, _, version = os.path.basename(path).rpartition('.')
+            if not version.isdigit():
+                name, version = os.path.basename(path), '0'
+            with open(path, 'rb') as f:
+                snapshots.setdefault(name, list()).append((int(version), f.read()))
+        return {name: [content for _, content in sorted(versions)]
+                for name, versions in snapshots.items()}
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        feeds = self.server.feeds
+        fail = feeds._request()
+
+        snapshot = feeds.snapshot(os.path.basename(self.path))
+        if snapshot is None:
+            self._reply(404)
+            return
+        if fail:
+            self._reply(503)
+            return
+
+        content, modified = snapshot
+        headers = dict()
+        if feeds.conditional:
+            headers['ETag'] = '"{}"'.format(hashlib.sha1(content).hexdigest())
+            headers['Last-Modified'] = email.utils.formatdate(modified, usegmt=True)
+            if 'If-None-Match' in self.headers:
+                not_modified = self.headers['If-None-Match'] == headers['ETag']
+            else:
+                not_modified = self.headers.get('If-Modified-Since') == headers['Last-Modified']
+            if not_modified:
+                feeds._count('not_modified')
+                self._reply(304, headers=headers)
+                return
+
+        headers['Content-Type'] = 'text/xml' if self.path.endswith('.xml') else 'text/plain'
+        self._reply(200, content, headers)
+        feeds._count('bytes', len(content))
+
+    def _reply(self, status, content=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class _FTPServer(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+
+
+class _FTPHandler(socketserver.StreamRequestHandler):
+
+    """ Just enough of a passive mode FTP server for `ftplib` and `urllib` """
+
+    def handle(self):
+        self.rest = 0
+        self.passive = None
+        self._reply('220 PEAS feed server')
+        try:
+            for line in self.rfile:
+                command, _, arg = line.decode('latin-1').strip().partition(' ')
+                method = getattr(self, 'ftp_{}'.format(command.upper()), None)
+                if method is None:
+                    self._reply('502 Command not implemented')
+                elif method(arg) is False:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._close_passive()
+
+    def ftp_USER(self, arg):
+        self._reply('331 Any password will do')
+
+    def ftp_PASS(self, arg):
+        self._reply('230 Logged in')
+
+    def ftp_SYST(self, arg):
+        self._reply('215 UNIX Type: L8')
+
+    def ftp_TYPE(self, arg):
+        self._reply('200 Type set to {}'.format(arg))
+
+    def ftp_PWD(self, arg):
+        self._reply('257 "/"')
+
+    def ftp_CWD(self, arg):
+        self._reply('250 Directory changed')
+
+    def ftp_NOOP(self, arg):
+        self._reply('200 OK')
+
+    def ftp_SIZE(self, arg):
+        snapshot = self.server.feeds.snapshot(os.path.basename(arg))
+        if snapshot is None:
+            self._reply('550 No such file')
+        else:
+            self._reply('213 {}'.format(len(snapshot[0])))
+
+    def ftp_REST(self, arg):
+        self.rest = int(arg)
+        self._reply('350 Restarting at {}'.format(self.rest))
+
+    def ftp_PASV(self, arg):
+        host, port = self._open_passive()
+        self._reply('227 Entering Passive Mode ({},{},{})'.format(
+            host.replace('.', ','), port // 256, port % 256))
+
+    def ftp_EPSV(self, arg):
+        _, port = self._open_passive()
+        self._reply('229 Entering Extended Passive Mode (|||{}|)'.format(port))
+
+    def ftp_RETR(self, arg):
+        feeds = self.server.feeds
+        fail = feeds._request()
+
+        snapshot = feeds.snapshot(os.path.basename(arg))
+        if snapshot is None or fail or self.passive is None:
+            self._close_passive()
+            self._reply('550 No such file' if snapshot is None else '451 Transfer failed')
+            return
+
+        content = snapshot[0][self.rest:]
+        self.rest = 0
+        self._reply('150 Opening data connection')
+        try:
+            conn, _ = self.passive.accept()
+            with conn:
+                conn.sendall(content)
+            feeds._count('bytes', len(content))
+            self._reply('226 Transfer complete')
+        except (ConnectionError, OSError):
+            self._reply('426 Transfer aborted')
+        finally:
+            self._close_passive()
+
+    def ftp_ABOR(self, arg):
+        self._close_passive()
+        self._reply('226 Aborted')
+
+    def ftp_QUIT(self, arg):
+        self._reply('221 Bye')
+        return False
+
+    def _open_passive(self):
+        self._close_passive()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind((self.server.server_address[0], 0))
+        self.passive.listen(1)
+        self.passive.settimeout(10.)
+        return self.passive.getsockname()
+
+    def _close_passive(self):
+        if self.passive is not None:
+            self.passive.close()
+            self.passive = None
+
+    def _reply(self, message):
+        self.wfile.write('{}\r\n'.format(message).encode('latin-1'))
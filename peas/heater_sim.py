@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import functools
+import itertools
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Same defaults as AAGCloudSensor uses when the config has no heater section
+DEFAULT_HEATER = {
+    'low_temp': 0,
+    'low_delta': 6,
+    'high_temp': 20,
+    'high_delta': 4,
+    'min_power': 10,
+    'impulse_temp': 10,
+    'impulse_duration': 60,
+    'impulse_cycle': 600,
+}
+
+# Steps of RainSensorHeaterAlgorithm.pdf: above each temperature difference
+# the PWM is lowered by the matching amount, below its negative raised by it.
+AAG_STEPS = [(8., 40), (4., 20), (3., 10), (2., 6), (1., 4), (0.5, 2), (0.3, 1)]
+
+
+def target_temperature(ambient, heater_cfg=DEFAULT_HEATER):
+    """
+    Rain sensor set point for the normal heating mode: the ambient
+    temperature plus a difference interpolated between low_delta at
+    low_temp and high_delta at high_temp.
+    """
+    ambient = np.asarray(ambient, dtype=float)
+    deltaT = np.interp(ambient,
+                       [heater_cfg['low_temp'], heater_cfg['high_temp']],
+                       [heater_cfg['low_delta'], heater_cfg['high_delta']])
+    return ambient + deltaT
+
+
+def aag_delta_PWM(deltaT, scaling=0.5):
+    """
+    PWM change of the AAG heater algorithm for the difference between the
+    rain sensor temperature and its target, for scalars or arrays.
+    """
+    deltaT = np.asarray(deltaT, dtype=float)
+    conditions = [deltaT > step for step, _ in AAG_STEPS] + \
+                 [deltaT < -step for step, _ in AAG_STEPS]
+    choices = [-change for _, change in AAG_STEPS] + [change for _, change in AAG_STEPS]
+    return np.trunc(np.select(conditions, choices, default=0) * scaling).astype(int)
+
+
+def update_schedule(times, interval=0.):
+    """
+    Steps at which the heater controller runs, at most once every `interval`
+    seconds as in `AAGCloudSensor.update_heater`.
+    """
+    updates = np.zeros(len(times), dtype=bool)
+    last = None
+    for i, t in enumerate(times):
+        if last is None or t - last >= interval:
+            updates[i] = True
+            last = t
+    return updates
+
+
+def impulse_schedule(times, wet, duration=60., window=15, updates=None):
+    """
+    Steps at which the impulse heating mode is on.
+
+    The mode starts once more than three entries are in the history and all
+    of the last `window` ones are wet, and is switched off for one step after
+    `duration` seconds, as in `AAGCloudSensor.calculate_and_set_PWM`. It does
+    not depend on the controller gains, so it is computed once per series.
+    With `updates`, from `update_schedule`, the mode only changes at the
+    steps the controller runs.
+    """
+    wet = np.asarray(wet, dtype=bool)
+    dry_count = np.concatenate([[0], np.cumsum(~wet)])
+    impulse = np.zeros(len(wet), dtype=bool)
+    heating = False
+    start = None
+    for i, t in enumerate(times):
+        if updates is not None and not updates[i]:
+            impulse[i] = heating
+            continue
+        first = max(0, i + 1 - window)
+        if i + 1 - first > 3 and dry_count[i + 1] == dry_count[first]:
+            if heating and t - start > duration:
+                heating = False
+            elif not heating:
+                heating = True
+                start = t
+        else:
+            heating = False
+        impulse[i] = heating
+    return impulse
+
+
+def fit_plant(times, ambient, sensor_temp, pwm):
+    """
+    Fits the first order thermal model used by `simulate`,
+
+        dT/dt = (ambient + heating * pwm - T) / tau
+
+    to a recorded series by linear least squares.
+
+    Returns:
+        Tuple of tau in seconds and heating in deg C per percent of PWM.
+    """
+    times, ambient, sensor_temp, pwm = (np.asarray(a, dtype=float)
+                                        for a in (times, ambient, sensor_temp, pwm))
+    dt = np.diff(times)
+    rate = np.diff(sensor_temp) / dt
+    design = np.column_stack([ambient[:-1] - sensor_temp[:-1], pwm[:-1]])
+    good = np.isfinite(rate) & np.all(np.isfinite(design), axis=1) & (dt > 0)
+    (inv_tau, heating_rate), *_ = np.linalg.lstsq(design[good], rate[good], rcond=None)
+    return 1. / inv_tau, heating_rate / inv_tau
+
+
+def simulate(times, ambient, gains, heater_cfg=DEFAULT_HEATER, wet=None, sensor_temp0=None,
+             tau=120., heating=0.15, max_age=300., dead_band=0., heater_interval=0.,
+             trace=False):
+    """
+    Replays an ambient temperature series through the heater controller for
+    many sets of PID gains at once.
+
+    Every array below has one column per set of gains, so a step of the
+    simulation is a handful of numpy operations however many gains are
+    tried. The rain sensor follows the thermal model of `fit_plant`.
+
+    Args:
+        times: Seconds of each reading, e.g. from the weather entry dates.
+        ambient: Ambient temperature of each reading in deg C.
+        gains: Array of shape (n, 3) with Kp, Ki and Kd for each controller.
+        heater_cfg: The heater section of the aag_cloud config.
+        wet: Optional boolean array of readings with a wet rain sensor, which
+            trigger the impulse heating mode.
+        sensor_temp0: Rain sensor temperature at the start, defaults to the
+            first ambient temperature.
+        tau: Time constant of the rain sensor in seconds.
+        heating: Steady state heating in deg C per percent of PWM.
+        max_age: Length of the PID integral window in seconds.
+        dead_band: PWM changes smaller than this are not applied.
+        heater_interval: Seconds between controller updates, the heater
+            interval of the config. The PWM is held in between.
+        trace: Also return the PWM and sensor temperature at every step.
+
+    Returns:
+        Dict with the gains and, for each of them, the 'rms_error' of the
+        sensor temperature against its target in normal heating mode, the
+        'mean_power' in percent and the number of PWM 'changes'.
+    """
+    times = np.asarray(times, dtype=float)
+    ambient = np.asarray(ambient, dtype=float)
+    gains = np.atleast_2d(np.asarray(gains, dtype=float))
+    Kp, Ki, Kd = gains[:, 0], gains[:, 1], gains[:, 2]
+    nsteps, ngains = len(times), len(gains)
+
+    min_power = float(heater_cfg['min_power'])
+    target = target_temperature(ambient, heater_cfg)
+    impulse_target = ambient + float(heater_cfg['impulse_temp'])
+    updates = update_schedule(times, heater_interval)
+    if wet is None:
+        impulse = np.zeros(nsteps, dtype=bool)
+    else:
+        impulse = impulse_schedule(times, wet, float(heater_cfg['impulse_duration']),
+                                   updates=updates)
+
+    temp = np.full(ngains, ambient[0] if sensor_temp0 is None else float(sensor_temp0))
+    pwm = np.zeros(ngains)
+
+    # PID state, with the integral window kept as in `PID`
+    contributions = np.zeros((nsteps, ngains))
+    entry_times = np.zeros(nsteps)
+    first = 0
+    last = 0
+    integral = np.zeros(ngains)
+    Dval = np.zeros(ngains)
+    previous_error = np.zeros(ngains)
+    last_time = None
+
+    squared_error = np.zeros(ngains)
+    normal_steps = 0
+    power = np.zeros(ngains)
+    changes = np.zeros(ngains, dtype=int)
+    if trace:
+        pwm_trace = np.zeros((nsteps, ngains))
+        temp_trace = np.zeros((nsteps, ngains))
+
+    for i in range(nsteps):
+        t = times[i]
+        if not impulse[i]:
+            squared_error += (target[i] - temp) ** 2
+            normal_steps += 1
+
+        if not updates[i]:
+            new_pwm = pwm
+        elif impulse[i]:
+            # The AAG table gives a change of the PWM applied now
+            stepped = np.clip(pwm + aag_delta_PWM(temp - impulse_target[i]), 0, 100)
+            new_pwm = np.where(temp < impulse_target[i], 100., stepped)
+        else:
+            interval = 0. if last_time is None else t - last_time
+            last_time = t
+
+            error = target[i] - temp
+            while first < last and t - entry_times[first] > max_age:
+                integral -= contributions[first]
+                first += 1
+            contributions[last] = error * interval
+            entry_times[last] = t
+            last += 1
+            integral += error * interval
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                Dval = np.where(previous_error != 0, (error - previous_error) / interval, Dval)
+            Dval[~np.isfinite(Dval)] = 0.
+            previous_error = error
+
+            output = np.clip(Kp * error + Ki * integral + Kd * Dval, min_power, 100.)
+            new_pwm = np.trunc(output)
+
+        if dead_band:
+            new_pwm = np.where(np.abs(new_pwm - pwm) < dead_band, pwm, new_pwm)
+        changes += new_pwm != pwm
+        pwm = new_pwm
+        power += pwm
+
+        if trace:
+            pwm_trace[i] = pwm
+            temp_trace[i] = temp
+
+        if i + 1 < nsteps:
+            equilibrium = ambient[i] + heating * pwm
+            temp = equilibrium + (temp - equilibrium) * np.exp(-(times[i + 1] - t) / tau)
+
+    results = {
+        'gains': gains,
+        'rms_error': np.sqrt(squared_error / max(normal_steps, 1)),
+        'mean_power': power / max(nsteps, 1),
+        'changes': changes,
+    }
+    if trace:
+        results['pwm'] = pwm_trace
+        results['sensor_temp'] = temp_trace
+    return results
+
+
+def gain_grid(Kp, Ki, Kd):
+    """ All combinations of the given Kp, Ki and Kd values as an (n, 3) array """
+    return np.array(list(itertools.product(Kp, Ki, Kd)), dtype=float).reshape(-1, 3)
+
+
+def sweep(times, ambient, gains, processes=None, chunk_size=256, **kwargs):
+    """
+    Runs `simulate` over a large set of gains, split in chunks across
+    worker processes.
+
+    Args:
+        gains: Array of shape (n, 3), e.g. from `gain_grid`.
+        processes: Number of worker processes, defaults to the number of
+            cores. With 1 everything runs in this process.
+        chunk_size: Number of gains simulated together by a worker.
+        kwargs: Passed on to `simulate`.
+
+    Returns:
+        Dict with the same keys as `simulate`, covering all the gains.
+    """
+    gains = np.atleast_2d(np.asarray(gains, dtype=float))
+    chunks = [gains[i:i + chunk_size] for i in range(0, len(gains), chunk_size)]
+    run = functools.partial(simulate, times, ambient, **kwargs)
+
+    if processes == 1 or len(chunks) == 1:
+        results = [run(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(run, chunks))
+
+    return {key: np.concatenate([r[key] for r in results], axis=-1 if key in ('pwm', 'sensor_temp') else 0)
+            for key in results[0]}
+
+
+def rank(results, power_weight=0.):
+    """
+    Indices of the simulated gains from best to worst, scored by the RMS
+    tracking error plus `power_weight` deg C per percent of mean power.
+    """
+    score = results['rms_error'] + power_weight * results['mean_power']
+    return np.argsort(score)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import ftplib
+import numpy as np
+
+from astropy.table import Table
+from astropy.time import Time, TimeISO
+
+from contextlib import closing
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+# Column of the record time, in AAT standard time in the file
+TIME_COLUMN = 'time_UTC'
+
+# AAT standard time is 10 hours ahead of UTC
+AAT_OFFSET = np.timedelta64(10, 'h')
+
+# Characters of a 'mm-dd-YYYY HH:MM:SS' date in the order of 'YYYY-mm-dd HH:MM:SS'
+_ISO_ORDER = [6, 7, 8, 9, 2, 0, 1, 5, 3, 4, 10, 11, 12, 13, 14, 15, 16, 17, 18]
+
+
+class MixedUpTime(TimeISO):
+    """Subclass the astropy.time.TimeISO time format to handle the mixed up
+    American style time format that the AAT met system uses.
+    """
+
+    name= 'mixed_up_time'
+    subfmts = (('date_hms',
+                '%m-%d-%Y %H:%M:%S',
+                '{mon:02d}-{day:02d}-{year:d} {hour:02d}:{min:02d}:{sec:02d}'),
+               ('date_hm',
+                '%m-%d-%Y %H:%M',
+                '{mon:02d}-{day:02d}-{year:d} {hour:02d}:{min:02d}'),
+               ('date',
+                '%m-%d-%Y',
+                '{mon:02d}-{day:02d}-{year:d}'))
+
+
+def normalise(text):
+    """ Joins the lines of a metdata1.dat record split after a '."' and drops quotes """
+    text = text.replace('\r\n', '\n')
+    text = text.replace('."\n', ' ')
+    return text.replace('" ', '')
+
+
+def parse_dates(dates):
+    """
+    Converts AAT met system dates to UTC.
+
+    Dates all in the 'mm-dd-YYYY HH:MM:SS' format are converted in one go by
+    reordering their characters into ISO dates for numpy, anything else
+    goes through the `MixedUpTime` astropy format.
+
+    Args:
+        dates: Sequence of date strings in AAT standard time.
+
+    Returns:
+        Array of numpy datetime64 UTC times with one second precision.
+    """
+    dates = np.asarray(dates, dtype='U')
+    if dates.size and np.all(np.char.str_len(dates) == 19):
+        chars = dates.astype('S19').view('S1').reshape(-1, 19)
+        if np.all(chars[:, [2, 5, 13, 16]] == [b'-', b'-', b':', b':']) and \
+                np.all(chars[:, 10] == b' '):
+            iso = np.ascontiguousarray(chars[:, _ISO_ORDER]).view('S19').ravel()
+            try:
+                return iso.astype('datetime64[s]').reshape(dates.shape) - AAT_OFFSET
+            except ValueError:
+                pass
+
+    times = Time(dates.ravel(), format='mixed_up_time').to_value('datetime64')
+    return times.astype('datetime64[s]').reshape(dates.shape) - AAT_OFFSET
+
+
+def parse_record(line, names):
+    """
+    Reads one tab delimited record.
+
+    Returns:
+        Dict of column name to value. Values are ints or floats where they can
+        be, the record time is a UTC `datetime`.
+    """
+    fields = line.split('\t')
+    if len(fields) != len(names):
+        raise ValueError('Expected {} columns in the met data record, got {}'.format(
+            len(names), len(fields)))
+
+    record = {name: _scalar(field.strip()) for name, field in zip(names, fields)}
+    if TIME_COLUMN in record:
+        record[TIME_COLUMN] = parse_dates([record[TIME_COLUMN]])[0].astype(object)
+    return record
+
+
+def read_newest(url, names, timeout=None, chunk_size=4096, max_bytes=65536):
+    """
+    Fetches and parses only the newest record of metdata1.dat.
+
+    The met system writes the newest record first, so the transfer is
+    stopped as soon as a complete record has arrived instead of downloading
+    the whole file.
+
+    Args:
+        url: ftp:// or http:// address of the file.
+        names: Column names, in the order of the file.
+        timeout: Seconds to wait for the server.
+        chunk_size: Bytes to read at a time.
+        max_bytes: Gives up if no complete record turned up in this many bytes.
+
+    Returns:
+        Dict of column name to value, see `parse_record`.
+    """
+    names = list(names)
+    raw = b''
+    with closing(_read(url, timeout, chunk_size)) as chunks:
+        for chunk in chunks:
+            raw += chunk
+            lines = normalise(raw.decode('latin-1')).split('\n')
+            # The last line might still be incomplete
+            for line in lines[:-1]:
+                if line.strip():
+                    return parse_record(line, names)
+            if len(raw) > max_bytes:
+                raise ValueError('No complete record in the first {} bytes of {}'.format(
+                    len(raw), url))
+
+    line = normalise(raw.decode('latin-1')).strip()
+    if not line:
+        raise ValueError('No met data in {}'.format(url))
+    return parse_record(line.split('\n')[0], names)
+
+
+def read_table(text, names):
+    """
+    Parses a whole metdata1.dat file, e.g. to backfill the database.
+
+    Returns:
+        Table of every record, newest first, with the record time as UTC `Time`.
+    """
+    t = Table.read(normalise(text), format='ascii.no_header', delimiter='\t',
+                   names=list(names))
+    t[TIME_COLUMN] = Time(parse_dates(t[TIME_COLUMN]), format='datetime64')
+    t[TIME_COLUMN].format = 'iso'
+    return t
+
+
+def fetch(url, timeout=None):
+    """ Downloads the whole file, returns its text """
+    with closing(urlopen(url, timeout=timeout)) as response:
+        return response.read().decode('latin-1')
+
+
+def _read(url, timeout, chunk_size):
+    """ Yields the file in chunks, stopping the transfer when closed """
+    parts = urlparse(url)
+    if parts.scheme != 'ftp':
+        with closing(urlopen(url, timeout=timeout)) as response:
+            chunk = response.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = response.read(chunk_size)
+        return
+
+    ftp = ftplib.FTP()
+    try:
+        ftp.connect(parts.hostname, parts.port or 21, timeout=timeout)
+        ftp.login(parts.username or 'anonymous', parts.password or '')
+        ftp.voidcmd('TYPE I')
+        with closing(ftp.transfercmd('RETR {}'.format(parts.path))) as conn:
+            chunk = conn.recv(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = conn.recv(chunk_size)
+    finally:
+        # Dropping the connection aborts a transfer that is still running
+        ftp.close()
+
+
+def _scalar(field):
+    for convert in (int, float):
+        try:
+            return convert(field)
+        except ValueError:
+            pass
+    return field
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import io
+
+import astropy.units as u
+from astropy.table import Table
+
+from xml.etree.ElementTree import iterparse
+
+# Tag of the columns holding the date and utc of the record
+DATE = 'date'
+
+
+def parse(content, fields=None):
+    """
+    Pulls the values out of a metsys XML document, e.g. met23.xml or
+    skymap.xml from mso.anu.edu.au, straight from the response body.
+
+    The document is read incrementally and parsing stops as soon as every
+    wanted field has been seen. Nothing is written to disk.
+
+    Args:
+        content: The document as bytes.
+        fields: Names of the metsys/data entries to keep, e.g. ['ws', 'rh'].
+            Defaults to all of them.
+
+    Returns:
+        Dict with the 'date' and 'utc' of the record and a 'data' dict of
+        field name to the text of its 'val' element.
+    """
+    wanted = None if fields is None else set(fields)
+    record = {'data': dict()}
+    path = list()
+
+    for event, element in iterparse(io.BytesIO(content), events=('start', 'end')):
+        if event == 'start':
+            path.append(element.tag)
+            continue
+
+        if len(path) == 2 and path[0] == 'metsys' and path[1] in ('date', 'utc'):
+            record[path[1]] = element.text
+        elif len(path) == 4 and path[:2] == ['metsys', 'data'] and path[3] == 'val':
+            if wanted is None or path[2] in wanted:
+                record['data'][path[2]] = element.text
+        path.pop()
+        element.clear()
+
+        if wanted is not None and 'date' in record and 'utc' in record and \
+                wanted.issubset(record['data']):
+            break
+
+    return record
+
+
+def parse_unit(unit):
+    """
+    Turns a unit of a `column_names` config entry, e.g. 'u.m / u.second',
+    into an astropy unit. Units astropy doesn't know are kept as
+    unrecognised units rather than raising.
+    """
+    if not isinstance(unit, str):
+        return u.Unit(unit)
+    unit = unit.replace('u.', '').replace('dimensionless_unscaled', '1')
+    return u.Unit(unit, parse_strict='silent')
+
+
+class Extractor(object):
+
+    """
+    Reads the columns of a met data source straight out of its metsys
+    documents.
+
+    The column names and units come from the `column_names` config of the
+    source and are worked out once, so every poll only converts the wanted
+    values to plain scalars. A `Table` with units is only built when
+    `table` is called.
+
+    Attributes:
+        self.names: Column names, in the order of the config.
+        self.units: Dict of column name to astropy unit.
+        self.fields: Metsys data tags read from each document.
+    """
+
+    def __init__(self, column_names, tags, converters=None):
+        """
+        Args:
+            column_names: Dict of column name to unit, from the config.
+            tags: Dict of column name to metsys tag, e.g. {'wind_speed': 'ws'}.
+                The `DATE` tag gives the date and utc of the record.
+            converters: Dict of column name to a function turning the text of
+                the value into a scalar. Defaults to float.
+        """
+        converters = converters or dict()
+
+        self.names = list(column_names.keys())
+        self.units = {name: parse_unit(unit) for name, unit in column_names.items()}
+
+        self._columns = [(name, tags[name], converters.get(name, float)) for name in self.names]
+        self.fields = [tag for _, tag, _ in self._columns if tag != DATE]
+
+    def extract(self, content):
+        """ Values of the columns in a metsys document, as a dict of name to scalar """
+        doc = parse(content, fields=self.fields)
+
+        values = dict()
+        for name, tag, convert in self._columns:
+            if tag == DATE:
+                values[name] = doc['date'] + ' ' + doc['utc']
+            else:
+                values[name] = convert(doc['data'][tag])
+        return values
+
+    def table(self, values):
+        """ One row `Table` of extracted values, with the units of the columns """
+        table = Table(rows=[tuple(values[name] for name in self.names)], names=self.names)
+        for name in self.names:
+            table[name].unit = self.units[name]
+        return table
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import abc
+import collections
+import math
+import numpy as np
+
+
+class StreamingStat(abc.ABC):
+
+    """
+    Base class of statistics updated one sample at a time.
+
+    Samples are (time, value) pairs with times in seconds, e.g. epoch
+    timestamps, that never decrease. NaN values are ignored. Every
+    statistic also has a `batch` mode that returns the value after each
+    sample of an array, for plotting.
+
+    Attributes:
+        self.value: Current value of the statistic, NaN before any sample.
+    """
+
+    def __init__(self):
+        self.value = np.nan
+
+    @abc.abstractmethod
+    def update(self, t, value):
+        """ Adds a sample, returns the new value of the statistic """
+
+    def reset(self):
+        self.value = np.nan
+
+    def batch(self, times, values):
+        """
+        Runs the statistic over arrays of times and values from a fresh
+        start, returns the value after each sample. The instance is not
+        changed.
+        """
+        stat = self.copy()
+        return np.array([stat.update(t, value) for t, value in zip(times, values)], dtype=float)
+
+    @abc.abstractmethod
+    def copy(self):
+        """ Returns a fresh statistic with the same parameters """
+
+
+class WindowedMean(StreamingStat):
+
+    """ Mean of the samples of the last `seconds`, kept as a running sum """
+
+    def __init__(self, seconds):
+        super(WindowedMean, self).__init__()
+        self.seconds = float(seconds)
+        self._samples = collections.deque()
+        self._sum = 0.
+
+    def update(self, t, value):
+        if not np.isnan(value):
+            self._samples.append((t, value))
+            self._sum += value
+        while self._samples and self._samples[0][0] < t - self.seconds:
+            self._sum -= self._samples.popleft()[1]
+        if self._samples:
+            self.value = self._sum / len(self._samples)
+        else:
+            # Start afresh so rounding errors don't build up
+            self._sum = 0.
+            self.value = np.nan
+        return self.value
+
+    def reset(self):
+        super(WindowedMean, self).reset()
+        self._samples.clear()
+        self._sum = 0.
+
+    def batch(self, times, values):
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        good = ~np.isnan(values)
+        sums = np.concatenate([[0.], np.cumsum(np.where(good, values, 0.))])
+        counts = np.concatenate([[0], np.cumsum(good)])
+        first = np.searchsorted(times, times - self.seconds, side='left')
+        last = np.arange(1, len(times) + 1)
+        n = counts[last] - counts[first]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 0, (sums[last] - sums[first]) / n, np.nan)
+
+    def copy(self):
+        return WindowedMean(self.seconds)
+
+
+class WindowedMax(StreamingStat):
+
+    """
+    Largest sample of the last `seconds`, e.g. the wind gust, kept with a
+    monotonic deque. With `lowest=True` the smallest sample instead.
+    """
+
+    def __init__(self, seconds, lowest=False):
+        super(WindowedMax, self).__init__()
+        self.seconds = float(seconds)
+        self.lowest = lowest
+        self._samples = collections.deque()
+
+    def update(self, t, value):
+        if not np.isnan(value):
+            sign = -1. if self.lowest else 1.
+            while self._samples and sign * self._samples[-1][1] <= sign * value:
+                self._samples.pop()
+            self._samples.append((t, value))
+        while self._samples and self._samples[0][0] < t - self.seconds:
+            self._samples.popleft()
+        self.value = self._samples[0][1] if self._samples else np.nan
+        return self.value
+
+    def reset(self):
+        super(WindowedMax, self).reset()
+        self._samples.clear()
+
+    def batch(self, times, values):
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return np.array([])
+
+        # Sparse table, level k holds the largest of each run of 2**k samples
+        sign = -1. if self.lowest else 1.
+        good = ~np.isnan(values)
+        levels = [np.where(good, sign * values, -np.inf)]
+        while 2 ** len(levels) <= len(values):
+            width = 2 ** (len(levels) - 1)
+            levels.append(np.maximum(levels[-1][:-width], levels[-1][width:]))
+
+        # Each window is covered by two, possibly overlapping, runs of a level
+        last = np.arange(len(values))
+        first = np.searchsorted(times, times - self.seconds, side='left')
+        level = np.floor(np.log2(last - first + 1)).astype(int)
+        result = np.empty(len(values))
+        for k in np.unique(level):
+            rows = level == k
+            result[rows] = np.maximum(levels[k][first[rows]], levels[k][last[rows] - 2 ** k + 1])
+
+        counts = np.concatenate([[0], np.cumsum(good)])
+        return np.where(counts[last + 1] > counts[first], sign * result, np.nan)
+
+    def copy(self):
+        return WindowedMax(self.seconds, lowest=self.lowest)
+
+
+class EWMA(StreamingStat):
+
+    """
+    Exponentially weighted moving average with time constant `tau` seconds.
+    The weight of each sample depends on the time since the previous one,
+    so unevenly spaced samples are handled.
+    """
+
+    def __init__(self, tau):
+        super(EWMA, self).__init__()
+        self.tau = float(tau)
+        self._last_time = None
+
+    def update(self, t, value):
+        if np.isnan(value):
+            return self.value
+        if self._last_time is None or np.isnan(self.value):
+            self.value = float(value)
+        else:
+            alpha = 1. - math.exp(-(t - self._last_time) / self.tau)
+            self.value += alpha * (value - self.value)
+        self._last_time = t
+        return self.value
+
+    def reset(self):
+        super(EWMA, self).reset()
+        self._last_time = None
+
+    def copy(self):
+        return EWMA(self.tau)
+
+
+class RateOfChange(StreamingStat):
+
+    """
+    Change per second between the oldest and the newest sample of the last
+    `seconds`, NaN until two samples are in the window.
+    """
+
+    def __init__(self, seconds):
+        super(RateOfChange, self).__init__()
+        self.seconds = float(seconds)
+        self._samples = collections.deque()
+
+    def update(self, t, value):
+        if not np.isnan(value):
+            self._samples.append((t, value))
+        while self._samples and self._samples[0][0] < t - self.seconds:
+            self._samples.popleft()
+        if len(self._samples) > 1 and self._samples[-1][0] > self._samples[0][0]:
+            (t0, v0), (t1, v1) = self._samples[0], self._samples[-1]
+            self.value = (v1 - v0) / (t1 - t0)
+        else:
+            self.value = np.nan
+        return self.value
+
+    def reset(self):
+        super(RateOfChange, self).reset()
+        self._samples.clear()
+
+    def copy(self):
+        return RateOfChange(self.seconds)
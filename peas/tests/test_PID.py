@@ -0,0 +1,49 @@
+import pytest
+
+from peas.PID import PID
+
+
+def reference_Ival(errors, intervals, max_age):
+    """ Sum of error * interval over the entries younger than max_age """
+    Ival = 0.
+    for i, (error, interval) in enumerate(zip(errors, intervals)):
+        age = sum(intervals[i + 1:])
+        if age <= max_age:
+            Ival += error * interval
+    return Ival
+
+
+def test_values():
+    pid = PID(Kp=3.0, Ki=0.02, Kd=200.0, set_point=10.)
+    pid.recalculate(8., interval=10.)
+    assert pid.Pval == 2.
+    assert pid.Ival == 20.
+
+    pid.recalculate(9., interval=5.)
+    assert pid.Pval == 1.
+    assert pid.Ival == 25.
+    assert pid.Dval == pytest.approx(-0.2)
+
+
+def test_sliding_window():
+    pid = PID(set_point=20., max_age=300)
+    errors = []
+    intervals = []
+    for i in range(500):
+        value = (i % 17) - 8.
+        interval = 5. + (i % 7)
+        pid.recalculate(value, interval=interval)
+        errors.append(20. - value)
+        intervals.append(interval)
+        assert pid.Ival == pytest.approx(reference_Ival(errors, intervals, 300), abs=1e-9)
+
+    assert len(pid.history) < 70
+
+
+def test_reset_integral():
+    pid = PID(set_point=2., max_age=300)
+    for i in range(10):
+        pid.recalculate(1., interval=10.)
+    pid.recalculate(1., interval=10., reset_integral=True)
+    assert pid.Ival == 10.
+    assert len(pid.history) == 1
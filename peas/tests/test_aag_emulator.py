@@ -0,0 +1,84 @@
+import pytest
+import serial
+
+from peas.aag_emulator import AAGEmulator
+from peas.aag_serial import AAGReadCycle
+from peas.aag_serial import AAGSerialTransport
+from peas.aag_serial import AdaptiveSampler
+
+expects = {
+    '!S': r'!1\s+([\d\.\-]+)!',
+    '!T': r'!2\s+([\d\.\-]+)!',
+    '!E': r'!R\s+([\d\.\-]+)!',
+}
+
+
+@pytest.fixture
+def emulator():
+    with AAGEmulator(scenario='clear', latency=0.001) as emulator:
+        yield emulator
+
+
+@pytest.fixture
+def transport(emulator):
+    port = serial.Serial(emulator.port, 9600, timeout=2)
+    yield AAGSerialTransport(port)
+    port.close()
+
+
+def test_transact(transport):
+    response = transport.transact('!S')
+    assert transport.last_framed
+    assert response == '!1        -2200!'
+
+
+def test_unknown_command_hits_deadline(transport):
+    assert transport.transact('!Y', deadline=0.1) == ''
+    assert not transport.last_framed
+    assert transport.missed_deadlines == 1
+
+
+def test_read_cycle(emulator, transport):
+    cycle = AAGReadCycle(transport, expects)
+    result = cycle.run(cycle.compile([('!S', 3), ('!T', 2)]))
+
+    assert result['!S'] == [('-2200',)] * 3
+    assert result['!T'] == [('1200',)] * 2
+    assert [t['command'] for t in result.timings] == ['!S', '!T', '!S', '!T', '!S']
+    assert emulator.received == {'!S': 3, '!T': 2}
+
+
+def test_read_cycle_retries_dropped_bytes():
+    with AAGEmulator(latency=0.001, drop_rate=0.01, seed=1) as emulator:
+        port = serial.Serial(emulator.port, 9600, timeout=2)
+        cycle = AAGReadCycle(AAGSerialTransport(port), expects, default_deadline=0.2, maxtries=10)
+        result = cycle.run(cycle.compile([('!S', 10)]))
+        port.close()
+
+    assert result['!S'] == [('-2200',)] * 10
+    assert sum(t['tries'] for t in result.timings) == emulator.received['!S']
+
+
+def test_scripted_weather():
+    with AAGEmulator(script=[(60., 'clear'), (60., 'rain')], latency=0.001) as emulator:
+        assert emulator.weather['rain_frequency'] > 2000
+        emulator.script = [(0., 'clear'), (60., 'rain')]
+        assert emulator.weather['rain_frequency'] < 2000
+
+
+def test_adaptive_sampler():
+    sampler = AdaptiveSampler(5, min_samples=3)
+    assert not sampler.done([(100,), (100,)])
+    assert sampler.done([(100,), (102,), (98,)])
+    assert not sampler.done([(100,), (150,), (50,)])
+    assert not AdaptiveSampler([5, 1]).done([(100, 1), (100, 5), (100, 9)])
+
+
+def test_read_cycle_stops_early(emulator, transport):
+    cycle = AAGReadCycle(transport, expects)
+    samplers = {'!S': AdaptiveSampler(10, min_samples=3)}
+    result = cycle.run(cycle.compile([('!S', 9), ('!T', 5)]), samplers=samplers)
+
+    assert result.count('!S') == 3
+    assert result.count('!T') == 5
+    assert emulator.received == {'!S': 3, '!T': 5}
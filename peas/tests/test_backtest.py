@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from peas import backtest
+from peas.weather_history import WeatherHistory
+
+CFG = {
+    'threshold_cloudy': -25,
+    'threshold_very_cloudy': -15.,
+    'threshold_windy': 50.,
+    'threshold_very_windy': 75.,
+    'threshold_gusty': 100.,
+    'threshold_very_gusty': 125.,
+    'threshold_wet': 2200.,
+    'threshold_rainy': 1800.,
+    'safety_delay': 15,
+}
+
+
+@pytest.fixture(scope='module')
+def history():
+    """ A few hours of AAG readings with cloud, wind, rain and gaps """
+    rng = np.random.RandomState(2)
+    n = 2000
+    times = 1.5e9 + np.cumsum(rng.uniform(5., 40., n))
+    times[1200:] += 3600.
+    columns = {
+        'sky_temp_C': -30. + 12. * np.sin(np.arange(n) / 150.) + rng.normal(0., 1., n),
+        'ambient_temp_C': np.full(n, 10.),
+        'wind_speed_KPH': np.abs(60. + 40. * np.sin(np.arange(n) / 90.) + rng.normal(0., 15., n)),
+        'rain_frequency': 2500. - 900. * (np.sin(np.arange(n) / 200.) > 0.8),
+    }
+    for values in columns.values():
+        values[rng.uniform(size=n) < 0.03] = np.nan
+    return times, columns
+
+
+def live_safe(times, columns, cfg):
+    """
+    The checks of `AAGCloudSensor.make_safety_decision`, one reading at a
+    time, made before the reading is added to the history as in `process_cycle`
+    """
+    entries = WeatherHistory(['sky_diff', 'wind_speed_KPH', 'rain_frequency'],
+                             window=60 * cfg['safety_delay'],
+                             averages={'wind_mavg': ('wind_speed_KPH', 120.)})
+    safe = list()
+    for i, t in enumerate(times):
+        current = {name: values[i] for name, values in columns.items()}
+        current['sky_diff'] = current['sky_temp_C'] - current['ambient_temp_C']
+
+        sky = entries.count('sky_diff') > 0 and not entries.max('sky_diff') > cfg['threshold_cloudy']
+        wind = entries.count('wind_speed_KPH') > 0 and \
+            not entries.max('wind_mavg') > cfg['threshold_very_windy'] and \
+            not entries.max('wind_speed_KPH') > cfg['threshold_very_gusty']
+        rain = entries.count('rain_frequency') > 0 and \
+            not current['rain_frequency'] <= cfg['threshold_wet'] and \
+            not entries.min('rain_frequency') <= cfg['threshold_wet']
+        safe.append(sky and wind and rain)
+
+        entries.append(current, timestamp=t)
+    return np.array(safe)
+
+
+def test_aag_matches_live(history):
+    times, columns = history
+    decisions = backtest.aag_decisions(times, columns, CFG)
+    expected = live_safe(times, columns, CFG)
+    assert 0 < expected.sum() < len(expected)
+    assert np.array_equal(decisions['safe'], expected)
+    # Nothing in the history yet
+    assert not decisions['safe'][0]
+    assert decisions['Sky'][0] == decisions['Rain'][0] == 'Unknown'
+    assert set(decisions['Rain']) <= {'Unknown', 'Rain', 'Wet', 'Dry'}
+
+
+def test_shards_match(history):
+    times, columns = history
+    settings = [CFG, dict(CFG, threshold_cloudy=-20.), dict(CFG, safety_delay=5)]
+    whole = [backtest.summarise(times, backtest.aag_decisions(times, columns, cfg)['safe'])
+             for cfg in settings]
+
+    assert backtest.backtest(times, columns, settings, processes=1, shard_seconds=3600.) == whole
+    assert backtest.backtest(times, columns, settings, processes=2, shard_seconds=3600.) == whole
+    # Looser clouds are never less safe
+    assert whole[1]['unsafe_fraction'] <= whole[0]['unsafe_fraction']
+
+
+def test_remote():
+    times = np.arange(4) * 60.
+    columns = {'wind_speed': np.array([3., 16., 25., np.nan]),
+               'rain_sensor': np.array([0, 0, 1, 0])}
+    thresholds = {'wind_speed': {'Calm': [0.0, 14.0], 'Windy': [14.0, 21.0], 'Very Windy': [21.0, np.inf]},
+                  'rain_sensor': {'No data': [-1], 'No rain': [0], 'Rain': [1]}}
+    decisions = backtest.remote_decisions(times, columns, thresholds)
+    assert list(decisions['wind_speed']) == ['Calm', 'Windy', 'Very Windy', 'Invalid']
+    assert list(decisions['safe']) == [True, False, False, False]
+
+    summary = backtest.summarise(times, decisions['safe'])
+    assert summary == {'readings': 4, 'unsafe_fraction': 2. / 3., 'flips': 1, 'to_unsafe': 1}
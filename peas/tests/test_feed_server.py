@@ -0,0 +1,77 @@
+import pytest
+import requests
+import time
+
+from peas import metdata
+from peas import metsys
+from peas.feed_server import FeedServer
+from peas.weather_http import ConditionalFetcher
+
+NAMES = ['time_UTC', 'outside_air_temperature', 'AAT_dome_air_temperature',
+         'AAT_mirror_temperature', 'AAT_dome_dewpoint', 'outside_humidity',
+         'barometric_pressure', 'wind_speed', 'wind_gust', 'wind_direction',
+         'AAT_dome_door_status', 'rain_sensor', 'outside_dewpoint', 'sky-ambient',
+         'sky-ambient_uncertainty', 'boltwood_sky_brightness', 'boltwood_rain_flag',
+         'boltwood_wet_flag', 'rain_since_9am', 'SQM_sky_brightness']
+
+
+@pytest.fixture
+def feeds():
+    with FeedServer(seed=1) as server:
+        yield server
+
+
+def test_http_conditional(feeds):
+    fetcher = ConditionalFetcher(feeds.links()['met23'], timeout=5., session=requests.Session())
+
+    content, changed = fetcher.fetch()
+    assert changed
+    assert metsys.parse(content)['data']['ws'] == '3.2'
+
+    content, changed = fetcher.fetch()
+    assert not changed
+    assert fetcher.stats['not_modified'] == 1
+    assert feeds.stats['not_modified'] == 1
+
+
+def test_cadence(feeds):
+    feeds.cadence = 0.2
+    fetcher = ConditionalFetcher(feeds.url('skymap.xml'), timeout=5., session=requests.Session())
+    first = metsys.parse(fetcher.fetch()[0])['utc']
+    served = feeds.snapshot('skymap.xml')
+    while feeds.snapshot('skymap.xml') == served:
+        time.sleep(0.01)
+    content, changed = fetcher.fetch()
+    assert changed
+    assert metsys.parse(content)['utc'] != first
+
+
+def test_ftp(feeds):
+    record = metdata.read_newest(feeds.links()['aat_metdata'], NAMES, timeout=5., chunk_size=64)
+    assert record['time_UTC'].isoformat() == '2017-06-21T12:30:00'
+    assert record['sky-ambient'] == -31.5
+
+    # The whole file, through urllib
+    t = metdata.read_table(metdata.fetch(feeds.links()['aat_metdata'], timeout=5.), NAMES)
+    assert len(t) == 60
+
+
+def test_failures(feeds):
+    feeds.failure_rate = 1.
+    with pytest.raises(requests.HTTPError):
+        ConditionalFetcher(feeds.url('met23.xml'), timeout=5., session=requests.Session()).fetch()
+    with pytest.raises(Exception):
+        metdata.read_newest(feeds.links()['aat_metdata'], NAMES, timeout=5.)
+    assert feeds.stats['failures'] == 2
+
+    feeds.failure = 'hang'
+    feeds.hang = 2.
+    with pytest.raises(requests.Timeout):
+        ConditionalFetcher(feeds.url('met23.xml'), timeout=0.2, session=requests.Session()).fetch()
+
+
+def test_latency(feeds):
+    feeds.latency = 0.2
+    start = time.monotonic()
+    requests.get(feeds.url('met23.xml'), timeout=5.)
+    assert time.monotonic() - start >= 0.2
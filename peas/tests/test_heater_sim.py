@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from peas import heater_sim
+
+
+@pytest.fixture(scope='module')
+def night():
+    """ Ten hours of readings every 30 s with the ambient temperature dropping """
+    times = np.arange(0., 36000., 30.)
+    ambient = 15. - 10. * times / times[-1] + 0.3 * np.sin(times / 900.)
+    return times, ambient
+
+
+def test_aag_delta_PWM():
+    deltaT = [9., 5., 3.5, 2.5, 1.5, 0.7, 0.4, 0., -0.4, -0.7, -1.5, -2.5, -3.5, -5., -9.]
+    expected = [-20, -10, -5, -3, -2, -1, 0, 0, 0, 1, 2, 3, 5, 10, 20]
+    assert list(heater_sim.aag_delta_PWM(deltaT)) == expected
+
+
+def test_target_temperature():
+    target = heater_sim.target_temperature([-5., 0., 10., 20., 25.])
+    assert target == pytest.approx([1., 6., 15., 24., 29.])
+
+
+def test_simulate_tracks_target(night):
+    times, ambient = night
+    results = heater_sim.simulate(times, ambient, [[3.0, 0.02, 200.]], trace=True)
+    assert results['rms_error'][0] < 3.
+    assert results['pwm'].shape == (len(times), 1)
+
+    # No heating, the sensor sits at the ambient temperature
+    off = heater_sim.simulate(times, ambient, [[0., 0., 0.]], heater_cfg=dict(
+        heater_sim.DEFAULT_HEATER, min_power=0))
+    assert off['mean_power'][0] == 0.
+    assert off['rms_error'][0] > results['rms_error'][0]
+
+
+def test_impulse_schedule(night):
+    times, _ = night
+    wet = np.zeros(len(times), dtype=bool)
+    wet[100:200] = True
+    impulse = heater_sim.impulse_schedule(times, wet, duration=60.)
+    assert not impulse[:103].any()
+    assert impulse[103:200].mean() > 0.5
+    assert not impulse[200:].any()
+
+
+def test_fit_plant(night):
+    times, ambient = night
+    results = heater_sim.simulate(times, ambient, [[3.0, 0.02, 200.]], trace=True,
+                                  tau=200., heating=0.2)
+    tau, heating = heater_sim.fit_plant(times, ambient, results['sensor_temp'][:, 0],
+                                        results['pwm'][:, 0])
+    assert tau == pytest.approx(200., rel=0.2)
+    assert heating == pytest.approx(0.2, rel=0.1)
+
+
+def test_sweep(night):
+    times, ambient = night
+    gains = heater_sim.gain_grid([1., 3., 10.], [0., 0.02], [0., 200.])
+    assert gains.shape == (12, 3)
+
+    serial = heater_sim.sweep(times, ambient, gains, processes=1, chunk_size=5)
+    parallel = heater_sim.sweep(times, ambient, gains, processes=2, chunk_size=5)
+    assert np.array_equal(serial['rms_error'], parallel['rms_error'])
+    assert np.array_equal(serial['gains'], gains)
+
+    single = heater_sim.simulate(times, ambient, gains[7])
+    assert serial['rms_error'][7] == single['rms_error'][0]
+
+    best = heater_sim.rank(serial)[0]
+    assert serial['rms_error'][best] == serial['rms_error'].min()
+
+
+def test_heater_interval(night):
+    times, ambient = night
+    assert list(heater_sim.update_schedule([0., 10., 30., 40., 65.], 30.)) == \
+        [True, False, True, False, True]
+
+    results = heater_sim.simulate(times, ambient, [[3.0, 0.02, 200.]], trace=True,
+                                  heater_interval=300.)
+    pwm = results['pwm'][:, 0]
+    # Readings every 30 s, the PWM only changes on every tenth one
+    changed = np.flatnonzero(pwm[1:] != pwm[:-1]) + 1
+    assert len(changed) > 0
+    assert np.all(changed % 10 == 0)
+    assert results['rms_error'][0] < 5.
@@ -0,0 +1,56 @@
+import datetime
+import numpy as np
+import pytest
+
+from astropy.time import Time
+
+from peas import metdata
+
+NAMES = ['time_UTC', 'outside_air_temperature', 'rain_sensor', 'AAT_dome_door_status']
+
+RECORDS = ('06-21-2017 22:34:56\t12.5\t0\tClosed\n'
+           '06-21-2017 22:33:56\t12.6\t0\tClosed\n')
+
+
+def test_parse_dates():
+    dates = ['06-21-2017 22:34:56', '01-01-2018 05:00:00']
+    times = metdata.parse_dates(dates)
+    assert times.dtype == np.dtype('datetime64[s]')
+    assert list(times) == [np.datetime64('2017-06-21T12:34:56'),
+                           np.datetime64('2017-12-31T19:00:00')]
+
+    # Same answer as the astropy format
+    slow = Time(dates, format='mixed_up_time').to_value('datetime64').astype('datetime64[s]')
+    assert np.all(times == slow - metdata.AAT_OFFSET)
+
+
+def test_parse_dates_other_formats():
+    times = metdata.parse_dates(['06-21-2017 22:34', '06-21-2017'])
+    assert list(times) == [np.datetime64('2017-06-21T12:34:00'),
+                           np.datetime64('2017-06-20T14:00:00')]
+
+
+def test_read_newest(tmpdir):
+    f = tmpdir.join('metdata1.dat')
+    # Only the first record is ever looked at
+    f.write(RECORDS + 'not\ta\trecord\n' * 10000)
+
+    record = metdata.read_newest('file://{}'.format(f), NAMES, chunk_size=16)
+    assert record == {'time_UTC': datetime.datetime(2017, 6, 21, 12, 34, 56),
+                      'outside_air_temperature': 12.5,
+                      'rain_sensor': 0,
+                      'AAT_dome_door_status': 'Closed'}
+
+
+def test_read_newest_gives_up(tmpdir):
+    f = tmpdir.join('metdata1.dat')
+    f.write('x' * 1000)
+    with pytest.raises(ValueError):
+        metdata.read_newest('file://{}'.format(f), NAMES, chunk_size=100, max_bytes=500)
+
+
+def test_read_table():
+    t = metdata.read_table(RECORDS, NAMES)
+    assert len(t) == 2
+    assert t['time_UTC'][0].iso == '2017-06-21 12:34:56.000'
+    assert list(t['outside_air_temperature']) == [12.5, 12.6]
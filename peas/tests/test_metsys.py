@@ -0,0 +1,54 @@
+from peas import metsys
+
+MET23 = b"""<?xml version="1.0" encoding="UTF-8"?>
+<metsys>
+  <date>2017-06-21</date>
+  <utc>12:34:56</utc>
+  <data>
+    <ws><val>3.2</val><unit>m/s</unit></ws>
+    <wgust><val>5.1</val><unit>m/s</unit></wgust>
+    <rh><val>45</val><unit>%</unit></rh>
+    <rsens><val>NOT_RAINING</val></rsens>
+  </data>
+</metsys>
+"""
+
+
+def test_parse_all():
+    doc = metsys.parse(MET23)
+    assert doc['date'] == '2017-06-21'
+    assert doc['utc'] == '12:34:56'
+    assert doc['data'] == {'ws': '3.2', 'wgust': '5.1', 'rh': '45', 'rsens': 'NOT_RAINING'}
+
+
+def test_parse_fields():
+    doc = metsys.parse(MET23, fields=['ws', 'rsens'])
+    assert doc['data'] == {'ws': '3.2', 'rsens': 'NOT_RAINING'}
+    assert doc['date'] + ' ' + doc['utc'] == '2017-06-21 12:34:56'
+
+
+def test_parse_stops_early():
+    # Anything after the wanted fields is never read
+    doc = metsys.parse(MET23.replace(b'</data>', b'<broken></data>'), fields=['ws'])
+    assert doc['data'] == {'ws': '3.2'}
+
+
+def test_extractor():
+    column_names = {'date': 'u.dimensionless_unscaled',
+                    'wind_speed': 'u.m / u.second',
+                    'rel_humidity': 'u.percent',
+                    'rain_sensor': 'u.dimensionless_unscaled'}
+    tags = {'date': metsys.DATE, 'wind_speed': 'ws', 'rel_humidity': 'rh', 'rain_sensor': 'rsens'}
+    extractor = metsys.Extractor(column_names, tags,
+                                 converters={'rain_sensor': lambda text: int(text == 'RAINING')})
+
+    assert extractor.fields == ['ws', 'rh', 'rsens']
+    values = extractor.extract(MET23)
+    assert values == {'date': '2017-06-21 12:34:56', 'wind_speed': 3.2,
+                      'rel_humidity': 45., 'rain_sensor': 0}
+
+    table = extractor.table(values)
+    assert table.colnames == list(column_names)
+    assert table['wind_speed'].unit == metsys.u.m / metsys.u.second
+    assert table['rel_humidity'].unit == metsys.u.percent
+    assert table['wind_speed'][0] == 3.2
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from peas import stats
+
+
+@pytest.fixture(scope='module')
+def series():
+    """ Unevenly spaced wind speeds with a few missing values """
+    rng = np.random.RandomState(1)
+    times = np.cumsum(rng.uniform(5., 60., 500))
+    values = np.abs(rng.normal(15., 8., 500))
+    values[rng.uniform(size=500) < 0.05] = np.nan
+    return times, values
+
+
+def brute_force(times, values, seconds, func):
+    out = []
+    for t in times:
+        window = values[(times >= t - seconds) & (times <= t)]
+        window = window[~np.isnan(window)]
+        out.append(func(window) if len(window) else np.nan)
+    return np.array(out)
+
+
+@pytest.mark.parametrize('stat,func', [
+    (stats.WindowedMean(120.), np.mean),
+    (stats.WindowedMax(600.), np.max),
+    (stats.WindowedMax(600., lowest=True), np.min),
+])
+def test_windowed(series, stat, func):
+    times, values = series
+    expected = brute_force(times, values, stat.seconds, func)
+
+    streamed = np.array([stat.update(t, v) for t, v in zip(times, values)])
+    assert np.allclose(streamed, expected, equal_nan=True)
+    assert np.allclose(stat.batch(times, values), expected, equal_nan=True)
+
+    # Batch mode leaves the streaming state alone
+    assert stat.value == streamed[-1]
+
+
+def test_ewma():
+    ewma = stats.EWMA(60.)
+    assert ewma.update(0., 10.) == 10.
+    assert ewma.update(60., 20.) == pytest.approx(20. - 10. * np.exp(-1.))
+    assert ewma.update(70., np.nan) == pytest.approx(20. - 10. * np.exp(-1.))
+
+    batch = stats.EWMA(60.).batch([0., 60., 70.], [10., 20., np.nan])
+    assert batch[-1] == ewma.value
+
+
+def test_rate_of_change():
+    roc = stats.RateOfChange(600.)
+    assert np.isnan(roc.update(0., 10.))
+    assert roc.update(300., 13.) == pytest.approx(0.01)
+    assert roc.update(900., 10.) == pytest.approx(-0.005)
+
+    roc.reset()
+    assert np.isnan(roc.value)
+    assert np.isnan(roc.update(1000., 1.))
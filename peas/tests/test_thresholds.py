@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from peas import load_config
+from peas.thresholds import ThresholdClassifier
+
+
+def reference_status(value, thresholds):
+    """ One value at a time, the last matching status wins """
+    status = 'Invalid'
+    for name, threshold in thresholds.items():
+        if len(threshold) == 1:
+            if value == threshold[0]:
+                status = name
+        elif threshold[0] < value <= threshold[1]:
+            status = name
+    return status
+
+
+@pytest.fixture(params=['aat_metdata', 'met23', 'skymap'])
+def thresholds(request):
+    return load_config()['weather'][request.param]['thresholds']
+
+
+def test_matches_reference(thresholds):
+    classifier = ThresholdClassifier(thresholds)
+    values = np.concatenate([np.random.uniform(-60, 150, 500), np.arange(-2, 4),
+                             [np.nan, np.inf, -np.inf, 0., 14., 21., 50., 75.]])
+    for column, column_thresholds in thresholds.items():
+        statuses = classifier.classify(column, values)
+        assert list(statuses) == [reference_status(value, column_thresholds) for value in values]
+        # A single reading gives the same answer
+        for value, status in zip(values[:20], statuses):
+            assert classifier.classify(column, value) == status
+
+
+def test_single_values():
+    classifier = ThresholdClassifier({'rain_sensor': {'No data': [-1], 'No rain': [0], 'Rain': [1]}})
+    assert classifier.classify('rain_sensor', 0) == 'No rain'
+    assert classifier.classify('rain_sensor', 1.) == 'Rain'
+    assert classifier.classify('rain_sensor', 0.5) == 'Invalid'
+    assert classifier.classify('rain_sensor', 'RAINING') == 'Invalid'
+    assert classifier.classify('rain_sensor', None) == 'Invalid'
+
+
+def test_overlaps():
+    thresholds = {'wind': {'Calm': [0, 10], 'Windy': [5, 20], 'Stopped': [0]}}
+    classifier = ThresholdClassifier(thresholds)
+    assert list(classifier.classify('wind', [0, 3, 5, 7, 10, 20, 21])) == \
+        ['Stopped', 'Calm', 'Calm', 'Windy', 'Windy', 'Windy', 'Invalid']
+
+
+def test_bad_thresholds():
+    with pytest.raises(ValueError):
+        ThresholdClassifier({'wind': {'Calm': [0, 10, 20]}})
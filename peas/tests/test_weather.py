@@ -0,0 +1,199 @@
+import asyncio
+import datetime
+import pytest
+import time
+
+from peas import aag_raw
+from peas.acquisition import Acquisition
+from peas.aag_emulator import AAGEmulator
+from peas.weather import AAGCloudSensor
+from peas.weather_async import AsyncWeatherRunner
+
+
+@pytest.fixture(scope='module')
+def emulator():
+    with AAGEmulator(scenario='clear', latency=0.001) as emulator:
+        yield emulator
+
+
+@pytest.fixture(scope='module')
+def aag(emulator, tmpdir_factory):
+    # Never touch the real safety history or capability cache
+    data_dir = tmpdir_factory.mktemp('aag')
+    return AAGCloudSensor(serial_address=emulator.port, use_mongo=False,
+                          history_snapshot=str(data_dir.join('aag_history.npz')),
+                          capability_cache=str(data_dir.join('aag_capabilities.json')))
+
+
+def test_identity(aag):
+    assert aag.name == 'CloudWatcher'
+    assert aag.firmware_version == '5.88'
+    assert aag.serial_number == '1234'
+
+
+def test_capture(aag):
+    data = aag.capture()
+    assert data['sky_temp_C'] == pytest.approx(-22.)
+    assert data['ambient_temp_C'] == pytest.approx(12.)
+    assert data['rain_frequency'] == 2600
+    assert data['wind_speed_KPH'] == 8
+    assert isinstance(data['date'], datetime.datetime)
+    assert abs(data['timestamp'] - time.time()) < 5.
+    assert data['date'] == datetime.datetime.utcfromtimestamp(data['timestamp'])
+
+
+def test_safe(aag):
+    data = aag.capture()
+    assert data['sky_condition'] == 'Clear'
+    assert data['safe']
+
+
+def test_read_cycle_time(aag):
+    aag.capture()
+    assert all(t['tries'] == 1 for t in aag.last_cycle.timings)
+    # Rain frequency dominates: 5 x 280 ms
+    assert aag.last_cycle.elapsed < 3.
+
+
+def test_background_acquisition(aag):
+    aag.start_acquisition(history=5)
+    try:
+        data = aag.capture()
+        assert data['age_s'] >= 0
+        assert data['sky_temp_C'] == pytest.approx(-22.)
+        assert len(aag.acquisition.history) >= 1
+    finally:
+        aag.stop_acquisition()
+    assert 'age_s' not in aag.capture()
+
+
+def test_stale_acquisition(aag):
+    def unplugged():
+        raise IOError('port unplugged')
+
+    aag.acquisition = Acquisition(unplugged, name='unplugged')
+    aag.max_staleness = 0.2
+    aag.acquisition.start()
+    try:
+        # No first reading, capture gives up rather than hanging
+        start = time.monotonic()
+        data = aag.capture()
+        assert time.monotonic() - start < 1.
+        assert not data['safe']
+        assert data['sky_condition'] == 'Unknown'
+
+        aag.acquisition.publish({'safe': True, 'sky_condition': 'Clear'})
+        assert aag.capture()['safe']
+
+        # The link died after one good reading
+        time.sleep(0.3)
+        data = aag.capture()
+        assert data['age_s'] > 0.2
+        assert not data['safe']
+        assert data['rain_condition'] == 'Unknown'
+    finally:
+        aag.stop_acquisition()
+        aag.acquisition = None
+        aag.max_staleness = 60.
+
+
+def test_async_capture(aag):
+    runner = AsyncWeatherRunner()
+    runner.add('aag', aag)
+    readings = asyncio.run(runner.capture_all())
+    assert readings['aag']['sky_temp_C'] == pytest.approx(-22.)
+    assert runner.latest['aag'] is readings['aag']
+
+
+def test_async_capture_with_acquisition(aag):
+    aag.start_acquisition()
+    try:
+        runner = AsyncWeatherRunner()
+        runner.add('aag', aag)
+        readings = asyncio.run(runner.capture_all())
+        # Only the snapshot is read, the thread keeps the port to itself
+        assert readings['aag']['age_s'] >= 0
+        assert readings['aag']['sky_temp_C'] == pytest.approx(-22.)
+    finally:
+        aag.stop_acquisition()
+
+
+def test_runner_deadline(aag):
+    runner = AsyncWeatherRunner()
+    runner.add('aag', aag)
+    assert runner.sources['aag'][2] == aag.timeout == 10.
+    assert asyncio.run(runner.capture_all())['aag']['sky_temp_C'] == pytest.approx(-22.)
+    runner.shutdown()
+
+
+def test_adaptive_sampling(aag):
+    data = aag.capture()
+    assert data['samples'] == {'sky_temp': 3, 'ambient_temp': 3, 'values': 3, 'rain_frequency': 3}
+    assert data['rain_frequency'] == 2600
+
+
+def test_raw_mode(aag):
+    aag.raw_mode = True
+    try:
+        data = aag.capture()
+    finally:
+        aag.raw_mode = False
+
+    assert data['raw']['sky'] == [-2200] * data['samples']['sky_temp']
+    reprocessed = aag_raw.reprocess([data['raw']])
+    assert reprocessed['sky_temp_C'][0] == pytest.approx(data['sky_temp_C'])
+    assert reprocessed['rain_sensor_temp_C'][0] == pytest.approx(float(data['rain_sensor_temp_C']), abs=0.01)
+
+
+def test_capabilities(aag):
+    assert aag.anemometer
+    assert aag.constants['rain_beta'] == 3450.
+    assert aag.constants['ldr_pull_up'] == 56.
+
+
+def test_capability_cache(aag, emulator):
+    aag.probe_capabilities(emulator.port)
+    queries = dict(emulator.received)
+
+    aag.probe_capabilities(emulator.port)
+    assert emulator.received['!K'] == queries['!K'] + 1
+    assert emulator.received['!A'] == queries['!A']
+    assert emulator.received['M!'] == queries['M!']
+    assert aag.name == 'CloudWatcher'
+
+
+def test_request_PWM(aag, emulator):
+    aag.heater_dead_band = 2.
+    assert aag.request_PWM(50)
+    assert not aag.request_PWM(51)
+    assert emulator.pwm == int(1023 * 0.5)
+
+    aag.capture()
+    assert aag.PWM_verified
+    assert aag.PWM == pytest.approx(aag.PWM_target)
+
+
+def test_heater_interval(aag):
+    aag.heater_interval = 3600.
+    aag.last_heater_update = None
+    aag.capture()
+    last_update = aag.last_heater_update
+    aag.capture()
+    assert aag.last_heater_update == last_update
+
+
+def test_warm_start(aag):
+    aag.capture()
+    aag.save_history()
+    count = len(aag.weather_entries)
+
+    aag.weather_entries.clear()
+    assert aag.history_coverage() == 0.
+    assert aag.warm_start() == count
+
+    # The first decision after the restart already has a history
+    aag.weather_entries.clear()
+    aag.warm_start()
+    data = aag.capture()
+    assert data['sky_condition'] == 'Clear'
+    assert data['history_coverage'] > 0.
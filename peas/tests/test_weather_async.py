@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from peas.weather_async import AsyncWeatherRunner
+
+
+class SlowSource(object):
+
+    def __init__(self, delay, timeout=None, fail=False):
+        self.delay = delay
+        self.timeout = timeout
+        self.fail = fail
+        self.captures = 0
+
+    def capture(self, **kwargs):
+        self.captures += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise IOError('No data')
+        return {'delay': self.delay, 'kwargs': kwargs}
+
+
+def test_concurrent_capture():
+    runner = AsyncWeatherRunner()
+    for i in range(4):
+        runner.add('source{}'.format(i), SlowSource(0.3), use_mongo=False)
+
+    start = time.monotonic()
+    results = asyncio.run(runner.capture_all())
+    elapsed = time.monotonic() - start
+
+    # The slowest source, not the sum of all of them
+    assert elapsed < 0.6
+    assert all(data['kwargs'] == {'use_mongo': False} for data in results.values())
+    assert all(0.3 <= t < 0.6 for t in runner.elapsed.values())
+    runner.shutdown()
+
+
+def test_deadlines():
+    runner = AsyncWeatherRunner()
+    slow = SlowSource(0.5, timeout=0.1)
+    runner.add('slow', slow)
+    runner.add('fast', SlowSource(0.01))
+    runner.add('broken', SlowSource(0.01, fail=True))
+
+    start = time.monotonic()
+    results = asyncio.run(runner.capture_all())
+    assert time.monotonic() - start < 0.4
+    assert results['slow'] is None
+    assert results['broken'] is None
+    assert results['fast']['delay'] == 0.01
+    assert runner.missed['slow'] == 1
+
+    # The late capture is still running, so the source is skipped
+    results = asyncio.run(runner.capture_all())
+    assert results['slow'] is None
+    assert slow.captures == 1
+
+    time.sleep(0.5)
+    runner.add('slow', slow, deadline=1.)
+    assert asyncio.run(runner.capture_all())['slow']['delay'] == 0.5
+    assert slow.captures == 2
+    runner.shutdown()
@@ -0,0 +1,91 @@
+import datetime
+import os
+import pytest
+
+from peas.weather_cache import FetchCache
+from peas.weather_cache import timestamp
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+def test_expires_after_max_age():
+    clock = FakeClock()
+    cache = FetchCache(max_age=60., clock=clock)
+    assert cache.get() is None
+
+    assert cache.put('2017-06-21 12:00:00', {'wind_speed': 3.2})
+    assert cache.get() == {'wind_speed': 3.2}
+
+    clock.now += 61.
+    assert cache.get() is None
+    # Stale data is still there for when a refresh fails
+    assert cache.value == {'wind_speed': 3.2}
+
+    cache.touch()
+    assert cache.get() == {'wind_speed': 3.2}
+
+
+def test_same_record_is_not_added(tmpdir):
+    cache = FetchCache(max_age=60., keep=2, clock=FakeClock())
+    first = tmpdir.join('first.dat')
+    again = tmpdir.join('again.dat')
+    first.write('')
+    again.write('')
+
+    assert cache.put('12:00', 'parsed', files=[str(first)])
+    assert not cache.put('12:00', 'parsed again', files=[str(again)])
+    assert len(cache) == 1
+    assert cache.value == 'parsed'
+    assert os.path.exists(str(first))
+    assert not os.path.exists(str(again))
+
+
+def test_evicts_files(tmpdir):
+    cache = FetchCache(max_age=60., keep=2, clock=FakeClock())
+    files = [tmpdir.join('{}.dat'.format(i)) for i in range(3)]
+    for i, f in enumerate(files):
+        f.write('')
+        cache.put(i, i, files=[str(f)])
+
+    assert list(cache.entries) == [1, 2]
+    assert cache.record_time == 2
+    assert [os.path.exists(str(f)) for f in files] == [False, True, True]
+
+    cache.clear()
+    assert cache.value is None
+    assert not any(os.path.exists(str(f)) for f in files)
+
+
+def test_record_age(caplog):
+    clock = FakeClock()
+    cache = FetchCache(max_age=60., clock=clock)
+    assert cache.record_age() == float('inf')
+
+    now = timestamp('2017-06-21 12:00:00')
+    cache.put('2017-06-21 12:00:00', {'wind_speed': 3.2})
+    assert cache.record_age(now + 90.) == 90.
+
+    # Revalidating the same record doesn't make it younger
+    clock.now += 61.
+    cache.touch()
+    cache.put('2017-06-21 12:00:00', {'wind_speed': 3.2})
+    assert cache.record_age(now + 180.) == 180.
+
+    cache.put(datetime.datetime(2017, 6, 21, 12, 2), {'wind_speed': 3.3})
+    assert cache.record_age(now + 180.) == 60.
+
+    # Unknown formats are reported, and aged from when they were fetched
+    cache.put('21/06/2017 12:03', {})
+    clock.now += 30.
+    assert cache.record_age(now) == 30.
+    assert 'Unknown record time' in caplog.text
+
+    with pytest.raises(ValueError):
+        timestamp('21/06/2017 12:03')
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from peas.weather_history import WeatherHistory
+
+
+def brute_force(times, values, now, window):
+    keep = (times >= now - window) & ~np.isnan(values)
+    return values[keep]
+
+
+def test_window_statistics():
+    rng = np.random.RandomState(42)
+    history = WeatherHistory(['wind'], window=300., capacity=4)
+
+    times = np.cumsum(rng.uniform(1., 30., 2000))
+    values = rng.normal(20., 10., 2000)
+    values[rng.uniform(size=2000) < 0.1] = np.nan
+
+    for i, (t, value) in enumerate(zip(times, values)):
+        history.append({'wind': value}, timestamp=t)
+        expected = brute_force(times[:i + 1], values[:i + 1], t, 300.)
+        assert history.count('wind') == len(expected)
+        if len(expected):
+            assert history.max('wind') == expected.max()
+            assert history.min('wind') == expected.min()
+        else:
+            assert np.isnan(history.max('wind'))
+
+    assert history.capacity < 100
+    assert np.all(history.timestamps() >= times[-1] - 300.)
+
+
+def test_running_average():
+    history = WeatherHistory(['wind'], window=900., averages={'wind_mavg': ('wind', 120.)})
+    for t in range(0, 600, 30):
+        history.append({'wind': t / 30.}, timestamp=float(t))
+
+    # Readings at 450, 480, 510, 540 and 570 s
+    assert history.last('wind_mavg') == pytest.approx(17.)
+    assert history.max('wind_mavg') == pytest.approx(17.)
+    assert len(history.column('wind_mavg')) == 20
+
+
+def test_last_and_missing_fields():
+    history = WeatherHistory(['sky', 'rain'], window=60.)
+    assert history.last() == {}
+    assert history.count('sky') == 0
+
+    history.append({'sky': '-20.5', 'other': 1}, timestamp=0.)
+    assert history.last() == {'sky': -20.5}
+    assert np.isnan(history.last('rain'))
+    assert len(history.column('rain_safe')) == 0
+
+    history.append({'sky': -10.}, timestamp=100.)
+    assert len(history) == 1
+    assert history.max('sky') == -10.
+
+    history.clear()
+    assert len(history) == 0
+    assert np.isnan(history.min('sky'))
+
+
+def test_save_and_load(tmpdir):
+    history = WeatherHistory(['wind'], window=900., averages={'wind_mavg': ('wind', 120.)})
+    for t in range(0, 1200, 30):
+        history.append({'wind': t / 30.}, timestamp=float(t))
+
+    filename = str(tmpdir.join('history.npz'))
+    history.save(filename)
+
+    restored = WeatherHistory(['wind'], window=900., averages={'wind_mavg': ('wind', 120.)})
+    assert restored.load(filename, now=1170.) == len(history)
+    assert np.array_equal(restored.timestamps(), history.timestamps())
+    assert restored.max('wind') == history.max('wind')
+    assert restored.min('wind') == history.min('wind')
+    assert restored.last('wind_mavg') == pytest.approx(history.last('wind_mavg'))
+    assert restored.span == history.span
+
+    # Loading again adds nothing, a later time trims the window
+    assert restored.load(filename, now=1500.) == 0
+    assert restored.timestamps()[0] == 600.
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+
+import pytest
+import requests
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from peas.weather_http import ConditionalFetcher
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        etag = '"{}"'.format(hashlib.sha1(server.body).hexdigest())
+        if server.conditional and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if server.conditional:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def feed():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    server.daemon_threads = True
+    server.body = b'<metsys><date>2017-01-01</date></metsys>'
+    server.conditional = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_not_modified(feed):
+    url = 'http://127.0.0.1:{}/met23.xml'.format(feed.server_port)
+    fetcher = ConditionalFetcher(url, timeout=5., session=requests.Session())
+
+    content, changed = fetcher.fetch()
+    assert changed and content == feed.body
+
+    content, changed = fetcher.fetch()
+    assert not changed and content == feed.body
+    assert fetcher.stats['not_modified'] == 1
+
+    feed.body = b'<metsys><date>2017-01-02</date></metsys>'
+    content, changed = fetcher.fetch()
+    assert changed and content == feed.body
+
+    assert fetcher.stats['requests'] == 3
+    assert fetcher.stats['changed'] == 2
+    assert fetcher.stats['bytes'] == 2 * len(feed.body)
+    assert fetcher.stats['new_connections'] == 1
+    assert fetcher.stats['reused_connections'] == 2
+
+
+def test_unchanged_body(feed):
+    feed.conditional = False
+    url = 'http://127.0.0.1:{}/skymap.xml'.format(feed.server_port)
+    fetcher = ConditionalFetcher(url, timeout=5., session=requests.Session())
+
+    assert fetcher.fetch()[1]
+    content, changed = fetcher.fetch()
+    assert not changed and content == feed.body
+    assert fetcher.stats['unchanged'] == 1
+    assert fetcher.stats['not_modified'] == 0
@@ -0,0 +1,85 @@
+import pytest
+import time
+
+from peas.feed_server import FeedServer
+from peas.weather_cache import timestamp
+from peas.weather_met23 import Met23Weather
+
+# Time of the record in the met23.xml snapshot
+RECORD_TIME = timestamp('2017-06-21 12:30:00')
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def feeds():
+    with FeedServer(seed=1) as server:
+        yield server
+
+
+@pytest.fixture
+def met23(feeds):
+    source = Met23Weather(use_mongo=False)
+    source.http.url = feeds.links()['met23']
+    source.http.timeout = 0.5
+    source.clock = FakeClock(RECORD_TIME + 30.)
+    yield source
+    source.stop()
+
+
+def test_synchronous(met23):
+    data = met23.capture()
+    assert data['wind_speed'] == 3.2
+    assert data['age'] == pytest.approx(30.)
+    assert data['safe']
+
+
+def test_frozen_feed(met23):
+    met23.max_age = 0.
+    met23.max_staleness = 600.
+    assert met23.capture()['safe']
+
+    # The server still answers, with the same record, so the data gets older
+    met23.clock.now += 600.
+    data = met23.capture()
+    assert data['wind_speed'] == 3.2
+    assert data['age'] == pytest.approx(630.)
+    assert not data['safe']
+
+
+def test_stale_while_revalidate(feeds, met23):
+    met23.stale_while_revalidate = True
+    met23.max_age = 0.1
+    met23.max_staleness = 600.
+
+    # Nothing fetched yet
+    data = met23.capture()
+    assert not data['safe']
+
+    met23.refresher.wait(5.)
+    data = met23.capture()
+    assert data['wind_speed'] == 3.2
+    assert data['safe']
+
+    # A hung server doesn't hold up capture, the old data is used until it is too old
+    feeds.failure_rate = 1.
+    feeds.failure = 'hang'
+    feeds.hang = 5.
+    time.sleep(0.5)
+    start = time.monotonic()
+    data = met23.capture()
+    assert time.monotonic() - start < 0.1
+    assert data['wind_speed'] == 3.2
+    assert data['safe']
+
+    met23.clock.now += 600.
+    data = met23.capture()
+    assert data['age'] > 600.
+    assert not data['safe']
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+INVALID = 'Invalid'
+
+
+class ThresholdClassifier(object):
+
+    """
+    Turns weather values into statuses, e.g. 'Calm' or 'Very windy', with
+    the `thresholds` of a met data source.
+
+    The thresholds of each column map a status to either a range [low, high],
+    matching low < value <= high, or a single value matched exactly:
+
+        wind_speed:
+          Calm:        [0.0, 50.0]
+          Windy:       [50.0, 75.0]
+        rain_sensor:
+          No rain:     [0]
+          Rain:        [1]
+
+    Where statuses overlap the one listed last wins, anything matching none
+    of them, or that isn't a number, is 'Invalid'.
+
+    The ranges are compiled once into sorted bin edges with the status of
+    each bin, so values are classified with `np.searchsorted` and a live
+    reading and a whole array of stored readings go through the same code.
+
+    Attributes:
+        self.thresholds: The thresholds the classifier was compiled from.
+        self.statuses: Dict of column to the status names, 'Invalid' first.
+    """
+
+    def __init__(self, thresholds):
+        self.thresholds = thresholds
+        self.statuses = dict()
+        self._tables = dict()
+
+        for column, column_thresholds in thresholds.items():
+            self.statuses[column], self._tables[column] = self._compile(column, column_thresholds)
+
+    def __contains__(self, column):
+        return column in self._tables
+
+    def codes(self, column, values):
+        """
+        Status codes of `values` of `column`, indices into `self.statuses[column]`.
+
+        Returns:
+            Array of ints with the shape of `values`, 0 for 'Invalid'.
+        """
+        edges, bins, points, point_codes = self._tables[column]
+        values = _as_float(values)
+
+        codes = np.zeros(values.shape, dtype=int)
+        if len(edges):
+            i = np.searchsorted(edges, values, side='left')
+            inside = (i > 0) & (i < len(edges))
+            codes[inside] = bins[i[inside] - 1]
+        if len(points):
+            j = np.clip(np.searchsorted(points, values), 0, len(points) - 1)
+            exact = points[j] == values
+            codes[exact] = point_codes[j[exact]]
+        return codes
+
+    def classify(self, column, values):
+        """
+        Status of `values` of `column`, a string for a single value or an array
+        of strings for an array of values.
+        """
+        return np.array(self.statuses[column], dtype=object)[self.codes(column, values)]
+
+    def classify_all(self, entries):
+        """ Dict of column to status for every column with thresholds, 'Invalid' if missing """
+        return {column: self.classify(column, entries.get(column)) for column in self._tables}
+
+    def _compile(self, column, column_thresholds):
+        # Codes follow the order of the config, so the status listed last is
+        # the one with the highest code
+        statuses = [INVALID] + list(column_thresholds)
+        ranges = list()
+        points = list()
+        for code, threshold in enumerate(column_thresholds.values(), 1):
+            if len(threshold) == 1:
+                points.append((float(threshold[0]), code))
+            elif len(threshold) == 2:
+                ranges.append((float(threshold[0]), float(threshold[1]), code))
+            else:
+                raise ValueError("Should only have 1 or 2 threshold entries, got {} for {}!".format(
+                    len(threshold), column))
+
+        # Status of each bin (edges[i], edges[i + 1]]
+        edges = np.unique([edge for low, high, _ in ranges for edge in (low, high)])
+        bins = np.zeros(max(len(edges) - 1, 0), dtype=int)
+        for low, high, code in ranges:
+            inside = (edges[:-1] >= low) & (edges[1:] <= high)
+            bins[inside] = np.maximum(bins[inside], code)
+
+        # Status of each single value, which might also be inside a range
+        point_codes = dict()
+        for value, code in points:
+            in_ranges = [c for low, high, c in ranges if low < value <= high]
+            point_codes[value] = max([code, point_codes.get(value, 0)] + in_ranges)
+        values = sorted(point_codes)
+
+        return statuses, (edges, bins, np.array(values, dtype=float),
+                          np.array([point_codes[value] for value in values], dtype=int))
+
+
+def _as_float(values):
+    """ `values` as a float array, NaN for anything that isn't a number """
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        values = np.asarray(values, dtype=object)
+        converted = np.full(values.shape, np.nan)
+        for index, value in np.ndenumerate(values):
+            try:
+                converted[index] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return converted
@@ -1,21 +1,31 @@
 #!/usr/bin/env python3
 
+import calendar
+import json
 import logging
 import numpy as np
+import os
 import re
 import serial
 import sys
 import time
 
 from datetime import datetime as dt
-from dateutil.parser import parse as date_parser
+from datetime import timedelta
 
 import astropy.units as u
 
 from pocs.utils.messaging import PanMessaging
 
+from . import aag_raw
+from . import heater_sim
 from . import load_config
 from .PID import PID
+from .acquisition import Acquisition
+from .aag_serial import AAGReadCycle
+from .aag_serial import AdaptiveSampler
+from .aag_serial import AAGSerialTransport
+from .weather_history import WeatherHistory
 
 
 def get_mongodb():
@@ -23,12 +33,6 @@ def get_mongodb():
     return PanMongo()
 
 
-def movingaverage(interval, window_size):
-    """ A simple moving average function """
-    window = np.ones(int(window_size)) / float(window_size)
-    return np.convolve(interval, window, 'same')
-
-
 # -----------------------------------------------------------------------------
 # AAG Cloud Sensor Class
 # -----------------------------------------------------------------------------
@@ -92,7 +96,8 @@ class AAGCloudSensor(object):
         * get SWITCH Status
     """
 
-    def __init__(self, serial_address=None, use_mongo=True):
+    def __init__(self, serial_address=None, use_mongo=True, history_snapshot=None,
+                 warm_start=None, capability_cache=None):
         self.logger = logging.getLogger('aag-cloudsensor')
         self.logger.setLevel(logging.INFO)
 
@@ -102,6 +107,10 @@ class AAGCloudSensor(object):
 
         self.safety_delay = self.cfg.get('safety_delay', 15.)
 
+        # Deadline of a capture, a read cycle (just under 3 s) plus a heater
+        # update, used by AsyncWeatherRunner
+        self.timeout = float(self.cfg.get('timeout', 10.))
+
         self.db = None
         if use_mongo:
             self.db = get_mongodb()
@@ -130,6 +139,10 @@ class AAGCloudSensor(object):
         else:
             self.AAG = None
 
+        self.transport = None
+        if self.AAG:
+            self.transport = AAGSerialTransport(self.AAG, logger=self.logger)
+
         # Thresholds
 
         # Initialize Values
@@ -147,27 +160,36 @@ class AAGCloudSensor(object):
         self.safe_dict = None
         self.hibernate = 0.500  # time to wait after failed query
 
+        # Electrical constants used by get_values
+        self.constants = dict(aag_raw.DEFAULT_CONSTANTS)
+
+        # Keep the raw readings of every cycle in the weather data
+        self.raw_mode = self.cfg.get('raw_mode', False)
+        self.last_raw = None
+
         # Set Up Heater
         if 'heater' in self.cfg:
             self.heater_cfg = self.cfg['heater']
         else:
-            self.heater_cfg = {
-                'low_temp': 0,
-                'low_delta': 6,
-                'high_temp': 20,
-                'high_delta': 4,
-                'min_power': 10,
-                'impulse_temp': 10,
-                'impulse_duration': 60,
-                'impulse_cycle': 600,
-            }
-        self.heater_PID = PID(Kp=3.0, Ki=0.02, Kd=200.0,
+            self.heater_cfg = dict(heater_sim.DEFAULT_HEATER)
+        # Gains can be tuned offline with scripts/tune_heater.py
+        self.heater_PID = PID(Kp=float(self.heater_cfg.get('Kp', 3.0)),
+                              Ki=float(self.heater_cfg.get('Ki', 0.02)),
+                              Kd=float(self.heater_cfg.get('Kd', 200.0)),
                               max_age=300,
                               output_limits=[self.heater_cfg['min_power'], 100])
 
         self.impulse_heating = None
         self.impulse_start = None
 
+        # The heater runs on its own cadence and PWM writes are verified by the
+        # !Q read of the next cycle rather than by waiting on the device
+        self.heater_interval = float(self.heater_cfg.get('interval', 0.))
+        self.heater_dead_band = float(self.heater_cfg.get('dead_band', 0.))
+        self.last_heater_update = None
+        self.PWM_target = None
+        self.PWM_verified = True
+
         # Command Translation
         self.commands = {'!A': 'Get internal name',
                          '!B': 'Get firmware version',
@@ -177,7 +199,7 @@ class AAGCloudSensor(object):
                          '!F': 'Get switch status',
                          '!G': 'Set switch open',
                          '!H': 'Set switch closed',
-                         'P\d\d\d\d!': 'Set PWM value',
+                         r'P\d\d\d\d!': 'Set PWM value',
                          '!Q': 'Get PWM value',
                          '!S': 'Get sky IR temperature',
                          '!T': 'Get sensor temperature',
@@ -188,58 +210,247 @@ class AAGCloudSensor(object):
                          'M!': 'Get electrical constants',
                          '!Pxxxx': 'Set PWM value to xxxx',
                          }
-        self.expects = {'!A': '!N\s+(\w+)!',
-                        '!B': '!V\s+([\d\.\-]+)!',
-                        '!C': '!6\s+([\d\.\-]+)!4\s+([\d\.\-]+)!5\s+([\d\.\-]+)!',
-                        '!D': '!E1\s+([\d\.]+)!E2\s+([\d\.]+)!E3\s+([\d\.]+)!E4\s+([\d\.]+)!',
-                        '!E': '!R\s+([\d\.\-]+)!',
-                        '!F': '!Y\s+([\d\.\-]+)!',
-                        'P\d\d\d\d!': '!Q\s+([\d\.\-]+)!',
-                        '!Q': '!Q\s+([\d\.\-]+)!',
-                        '!S': '!1\s+([\d\.\-]+)!',
-                        '!T': '!2\s+([\d\.\-]+)!',
-                        '!K': '!K(\d+)\s*\\x00!',
-                        'v!': '!v\s+([\d\.\-]+)!',
-                        'V!': '!w\s+([\d\.\-]+)!',
-                        'M!': '!M(.{12})',
+        self.expects = {'!A': r'!N\s+(\w+)!',
+                        '!B': r'!V\s+([\d\.\-]+)!',
+                        '!C': r'!6\s+([\d\.\-]+)!4\s+([\d\.\-]+)!5\s+([\d\.\-]+)!',
+                        '!D': r'!E1\s+([\d\.]+)!E2\s+([\d\.]+)!E3\s+([\d\.]+)!E4\s+([\d\.]+)!',
+                        '!E': r'!R\s+([\d\.\-]+)!',
+                        '!F': r'!Y\s+([\d\.\-]+)!',
+                        r'P\d\d\d\d!': r'!Q\s+([\d\.\-]+)!',
+                        '!Q': r'!Q\s+([\d\.\-]+)!',
+                        '!S': r'!1\s+([\d\.\-]+)!',
+                        '!T': r'!2\s+([\d\.\-]+)!',
+                        '!K': r'!K(\d+)\s*\x00!',
+                        'v!': r'!v\s+([\d\.\-]+)!',
+                        'V!': r'!w\s+([\d\.\-]+)!',
+                        'M!': '(?s)!M(.{12})',
                         }
-        self.delays = {
-            '!E': 0.350,
-            'P\d\d\d\d!': 0.750,
+        # Maximum time to wait for the handshake block of each reply
+        self.deadlines = {
+            '!E': 1.000,
+            r'P\d\d\d\d!': 1.500,
         }
 
-        self.weather_entries = list()
+        # Full read cycle, compiled into a single command plan
+        self.cycle_counts = [('!S', 9), ('!T', 5), ('!C', 5), ('!E', 5), ('!Q', 1), ('!D', 1)]
+        self.wind_speed_count = 3
+        self.last_cycle = None
+        self.read_cycle = None
+        self.samplers = dict()
+        sampling_cfg = self.cfg.get('adaptive_sampling')
+        if sampling_cfg:
+            for cmd, tolerance in sampling_cfg.get('tolerance', {}).items():
+                self.samplers[cmd] = AdaptiveSampler(tolerance,
+                                                     min_samples=sampling_cfg.get('min_samples', 3),
+                                                     method=sampling_cfg.get('method', 'mad'))
+        self._plans = dict()
+        if self.transport:
+            self.read_cycle = AAGReadCycle(self.transport, self.expects,
+                                           deadlines=self.deadlines, logger=self.logger)
+
+        # Readings of the last safety_delay minutes used for the safety
+        # decision. Wind speed is averaged over two minutes.
+        self.weather_entries = WeatherHistory(
+            ['sky_temp_C', 'ambient_temp_C', 'sky_diff', 'wind_speed_KPH', 'rain_frequency',
+             'rain_sensor_temp_C', 'pwm_value'],
+            window=60. * float(self.safety_delay),
+            averages={'wind_mavg': ('wind_speed_KPH', 120.)})
+
+        # The history is saved now and then so a restart starts with a full
+        # window, see warm_start. The safety decision is trusted once the
+        # history covers trusted_coverage of the window. The arguments
+        # override the config, e.g. to keep tests away from the real snapshot.
+        if history_snapshot is None:
+            history_snapshot = self.cfg.get(
+                'history_snapshot',
+                os.path.join(self.config.get('directories', {}).get('data', '.'), 'aag_history.npz'))
+        self.history_snapshot = history_snapshot
+        self.snapshot_interval = float(self.cfg.get('snapshot_interval', 60.))
+        self.trusted_coverage = float(self.cfg.get('trusted_coverage', 0.9))
+        self.last_snapshot = None
+        self.start_time = time.monotonic()
+        self.time_to_trusted = None
+        if warm_start is None:
+            warm_start = self.cfg.get('warm_start', True)
+        if warm_start:
+            self.warm_start()
+
+        # Optional background acquisition, see start_acquisition. Snapshots
+        # older than max_staleness seconds are unsafe.
+        self.acquisition = None
+        self.max_staleness = float(self.cfg.get('max_staleness', 60.))
+
+        # Identity and capabilities, see probe_capabilities
+        self.name = ''
+        self.firmware_version = ''
+        self.serial_number = ''
+        self.anemometer = False
+        if capability_cache is None:
+            capability_cache = self.cfg.get(
+                'capability_cache',
+                os.path.join(self.config.get('directories', {}).get('data', '.'),
+                             'aag_capabilities.json'))
+        self.capability_cache = capability_cache
 
         if self.AAG:
-            # Query Device Name
-            result = self.query('!A')
-            if result:
-                self.name = result[0].strip()
-                self.logger.info('  Device Name is "{}"'.format(self.name))
-            else:
-                self.name = ''
-                self.logger.warning('  Failed to get Device Name')
-                sys.exit(1)
-
-            # Query Firmware Version
-            result = self.query('!B')
-            if result:
-                self.firmware_version = result[0].strip()
-                self.logger.info('  Firmware Version = {}'.format(self.firmware_version))
-            else:
-                self.firmware_version = ''
-                self.logger.warning('  Failed to get Firmware Version')
-                sys.exit(1)
-
-            # Query Serial Number
-            result = self.query('!K')
-            if result:
-                self.serial_number = result[0].strip()
-                self.logger.info('  Serial Number: {}'.format(self.serial_number))
+            self.probe_capabilities(serial_address)
+
+    def probe_capabilities(self, serial_address):
+        """
+        Reads the identity, anemometer support and electrical constants of the
+        device once. They are cached on disk per serial port, so a restart on
+        the same device only needs the !K query, and the read cycle does not
+        have to ask whether there is an anemometer every time.
+        """
+        # Query Serial Number
+        result = self.query('!K')
+        if result:
+            self.serial_number = result[0].strip()
+            self.logger.info('  Serial Number: {}'.format(self.serial_number))
+        else:
+            self.serial_number = ''
+            self.logger.warning('  Failed to get Serial Number')
+            sys.exit(1)
+
+        cache = self._load_capability_cache()
+        capabilities = cache.get(serial_address)
+        if capabilities and capabilities.get('serial_number') == self.serial_number:
+            self.logger.info('  Using cached capabilities from {}'.format(self.capability_cache))
+        else:
+            capabilities = self._query_capabilities()
+            capabilities['serial_number'] = self.serial_number
+            cache[serial_address] = capabilities
+            self._save_capability_cache(cache)
+
+        self.name = capabilities['name']
+        self.firmware_version = capabilities['firmware_version']
+        self.anemometer = capabilities['anemometer']
+        self.constants.update(capabilities['constants'])
+        self.logger.info('  Device Name is "{}"'.format(self.name))
+        self.logger.info('  Firmware Version = {}'.format(self.firmware_version))
+
+        return capabilities
+
+    def _query_capabilities(self):
+        capabilities = dict()
+
+        # Query Device Name
+        result = self.query('!A')
+        if result:
+            capabilities['name'] = result[0].strip()
+        else:
+            self.logger.warning('  Failed to get Device Name')
+            sys.exit(1)
+
+        # Query Firmware Version
+        result = self.query('!B')
+        if result:
+            capabilities['firmware_version'] = result[0].strip()
+        else:
+            self.logger.warning('  Failed to get Firmware Version')
+            sys.exit(1)
+
+        capabilities['anemometer'] = bool(self.wind_speed_enabled())
+
+        # Electrical constants, only known to newer firmware
+        result = self.query('M!')
+        if result:
+            capabilities['constants'] = aag_raw.constants_from_reply(result[0])
+            self.logger.info('  Electrical constants: {}'.format(capabilities['constants']))
+        else:
+            capabilities['constants'] = dict()
+            self.logger.warning('  Failed to get electrical constants, using defaults')
+
+        return capabilities
+
+    def _load_capability_cache(self):
+        try:
+            with open(self.capability_cache, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def _save_capability_cache(self, cache):
+        try:
+            with open(self.capability_cache, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except IOError as e:
+            self.logger.warning('  Unable to write capability cache: {}'.format(e))
+
+    def warm_start(self):
+        """
+        Fills the safety history after a restart, first from the snapshot
+        written by `save_history`, then, if that doesn't cover the window,
+        from the readings stored in the database in the last safety_delay
+        minutes.
+
+        Returns:
+            Number of readings restored.
+        """
+        entries = self.weather_entries
+        restored = 0
+        try:
+            restored = entries.load(self.history_snapshot)
+        except Exception as e:
+            self.logger.debug('No usable history snapshot: {}'.format(e))
+
+        if self.history_coverage() < self.trusted_coverage and self.db is not None:
+            try:
+                times, columns = self._history_from_db()
+            except Exception as e:
+                self.logger.warning('Unable to read weather history from database: {}'.format(e))
             else:
-                self.serial_number = ''
-                self.logger.warning('  Failed to get Serial Number')
-                sys.exit(1)
+                # Readings from the database first, the snapshot may hold newer ones
+                snapshot = entries.timestamps(), {f: entries.column(f) for f in entries.fields}
+                entries.clear()
+                restored = entries.restore(times, columns)
+                restored += entries.restore(*snapshot)
+
+        self.logger.info('Restored {} readings, history covers {:.0f}% of {:.0f} min'.format(
+            restored, 100. * self.history_coverage(), self.safety_delay))
+        return restored
+
+    def _history_from_db(self):
+        """ One bounded query for the stored readings of the safety window """
+        start = dt.utcnow() - timedelta(seconds=self.weather_entries.window)
+        docs = self.db.weather.find({'date': {'$gte': start}}).sort([('date', 1)])
+
+        times = list()
+        rows = list()
+        for doc in docs:
+            data = doc.get('data', {})
+            timestamp = data.get('timestamp')
+            if timestamp is None:
+                date = doc['date']
+                timestamp = calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+            times.append(timestamp)
+            rows.append(self._history_entry(data))
+
+        columns = {field: [row.get(field) for row in rows] for field in self.weather_entries.fields}
+        return np.array(times, dtype=float), columns
+
+    def _history_entry(self, data):
+        entry = dict(data)
+        if 'sky_temp_C' in data and 'ambient_temp_C' in data:
+            entry['sky_diff'] = data['sky_temp_C'] - data['ambient_temp_C']
+        return entry
+
+    def save_history(self):
+        """ Writes a snapshot of the safety history for `warm_start` """
+        self.last_snapshot = time.monotonic()
+        try:
+            self.weather_entries.save(self.history_snapshot)
+        except (IOError, OSError) as e:
+            self.logger.warning('Unable to write history snapshot: {}'.format(e))
+
+    def history_coverage(self, now=None):
+        """ Fraction of the safety window covered by the history """
+        entries = self.weather_entries
+        if not len(entries):
+            return 0.
+        if now is None:
+            now = time.time()
+        return min(1., (now - entries.timestamps()[0]) / entries.window)
 
     def get_reading(self):
         """ Calls commands to be performed each time through the loop """
@@ -248,12 +459,11 @@ class AAGCloudSensor(object):
         if self.db is None:
             self.db = get_mongodb()
         else:
-            weather_data = self.update_weather()
-            self.calculate_and_set_PWM()
+            weather_data = self.read_weather()
 
         return weather_data
 
-    def send(self, send, delay=0.100):
+    def send(self, send, deadline=0.500):
 
         found_command = False
         for cmd in self.commands.keys():
@@ -265,28 +475,7 @@ class AAGCloudSensor(object):
             self.logger.warning('Unknown command: "{}"'.format(send))
             return None
 
-        self.logger.debug('  Clearing buffer')
-        cleared = self.AAG.read(self.AAG.inWaiting())
-        if len(cleared) > 0:
-            self.logger.debug('  Cleared: "{}"'.format(cleared.decode('utf-8')))
-
-        self.AAG.write(send.encode('utf-8'))
-        time.sleep(delay)
-
-        result = None
-        try:
-            response = self.AAG.read(self.AAG.inWaiting()).decode('utf-8')
-        except UnicodeDecodeError:
-            self.logger.debug("Error reading from serial line")
-        else:
-            self.logger.debug('  Response: "{}"'.format(response))
-            ResponseMatch = re.match('(!.*)\\x11\s{12}0', response)
-            if ResponseMatch:
-                result = ResponseMatch.group(1)
-            else:
-                result = response
-
-        return result
+        return self.transport.transact(send, deadline=deadline)
 
     def query(self, send, maxtries=5):
         found_command = False
@@ -299,19 +488,19 @@ class AAGCloudSensor(object):
             self.logger.warning('Unknown command: "{}"'.format(send))
             return None
 
-        if cmd in self.delays.keys():
-            self.logger.debug('  Waiting delay time of {:.3f} s'.format(self.delays[cmd]))
-            delay = self.delays[cmd]
+        if cmd in self.deadlines.keys():
+            self.logger.debug('  Using deadline of {:.3f} s'.format(self.deadlines[cmd]))
+            deadline = self.deadlines[cmd]
         else:
-            delay = 0.200
+            deadline = 0.500
         expect = self.expects[cmd]
         count = 0
         result = None
         while not result and (count <= maxtries):
             count += 1
-            result = self.send(send, delay=delay)
+            result = self.send(send, deadline=deadline)
 
-            MatchExpect = re.match(expect, result)
+            MatchExpect = re.match(expect, result or '')
             if not MatchExpect:
                 self.logger.debug('Did not find {} in response "{}"'.format(expect, result))
                 result = None
@@ -321,18 +510,22 @@ class AAGCloudSensor(object):
                 result = MatchExpect.groups()
         return result
 
-    def get_ambient_temperature(self, n=5):
+    def get_ambient_temperature(self, n=5, replies=None):
         """
         Populates the self.ambient_temp property
         Calculation is taken from Rs232_Comms_v100.pdf section "Converting values
         sent by the device to meaningful units" item 5.
+        If `replies` from a read cycle are given the device is not queried.
         """
         self.logger.debug('Getting ambient temperature')
         values = []
 
-        for i in range(0, n):
+        if replies is None:
+            replies = [self.query('!T') for i in range(0, n)]
+
+        for reply in replies:
             try:
-                value = float(self.query('!T')[0])
+                value = float(reply[0])
                 ambient_temp = value / 100.
 
             except Exception:
@@ -342,7 +535,7 @@ class AAGCloudSensor(object):
                     '  Ambient Temperature Query = {:.1f}\t{:.1f}'.format(value, ambient_temp))
                 values.append(ambient_temp)
 
-        if len(values) >= n - 1:
+        if len(values) >= len(replies) - 1:
             self.ambient_temp = np.median(values) * u.Celsius
             self.logger.debug('  Ambient Temperature = {:.1f}'.format(self.ambient_temp))
         else:
@@ -351,25 +544,28 @@ class AAGCloudSensor(object):
 
         return self.ambient_temp
 
-    def get_sky_temperature(self, n=9):
+    def get_sky_temperature(self, n=9, replies=None):
         """
         Populates the self.sky_temp property
         Calculation is taken from Rs232_Comms_v100.pdf section "Converting values
         sent by the device to meaningful units" item 1.
         Does this n times as recommended by the "Communication operational
         recommendations" section in Rs232_Comms_v100.pdf
+        If `replies` from a read cycle are given the device is not queried.
         """
         self.logger.debug('Getting sky temperature')
         values = []
-        for i in range(0, n):
+        if replies is None:
+            replies = [self.query('!S') for i in range(0, n)]
+        for reply in replies:
             try:
-                value = float(self.query('!S')[0]) / 100.
+                value = float(reply[0]) / 100.
             except Exception:
                 pass
             else:
                 self.logger.debug('  Sky Temperature Query = {:.1f}'.format(value))
                 values.append(value)
-        if len(values) >= n - 1:
+        if len(values) >= len(replies) - 1:
             self.sky_temp = np.median(values) * u.Celsius
             self.logger.debug('  Sky Temperature = {:.1f}'.format(self.sky_temp))
         else:
@@ -377,53 +573,45 @@ class AAGCloudSensor(object):
             self.logger.debug('  Failed to Read Sky Temperature')
         return self.sky_temp
 
-    def get_values(self, n=5):
+    def get_values(self, n=5, replies=None):
         """
         Populates the self.internal_voltage, self.LDR_resistance, and
         self.rain_sensor_temp properties
         Calculation is taken from Rs232_Comms_v100.pdf section "Converting values
         sent by the device to meaningful units" items 4, 6, 7.
+        If `replies` from a read cycle are given the device is not queried.
         """
         self.logger.debug('Getting "values"')
-        ZenerConstant = 3
-        LDRPullupResistance = 56.
-        RainPullUpResistance = 1
-        RainResAt25 = 1
-        RainBeta = 3450.
-        ABSZERO = 273.15
-        internal_voltages = []
-        LDR_resistances = []
-        rain_sensor_temps = []
-        for i in range(0, n):
-            responses = self.query('!C')
-            try:
-                internal_voltage = 1023 * ZenerConstant / float(responses[0])
-                internal_voltages.append(internal_voltage)
-                LDR_resistance = LDRPullupResistance / ((1023. / float(responses[1])) - 1.)
-                LDR_resistances.append(LDR_resistance)
-                r = np.log((RainPullUpResistance /
-                            ((1023. / float(responses[2])) - 1.)) / RainResAt25)
-                rain_sensor_temp = 1. / ((r / RainBeta) + (1. / (ABSZERO + 25.))) - ABSZERO
-                rain_sensor_temps.append(rain_sensor_temp)
-            except Exception:
-                pass
+        if replies is None:
+            replies = [self.query('!C') for i in range(0, n)]
+
+        counts = aag_raw.parse_counts(replies, ncols=3)
+        converted = aag_raw.convert({'zener': counts[:, 0],
+                                     'ldr': counts[:, 1],
+                                     'rain_ntc': counts[:, 2]}, constants=self.constants)
+        internal_voltages = converted['internal_voltage_V']
+        internal_voltages = internal_voltages[np.isfinite(internal_voltages)]
+        LDR_resistances = converted['ldr_resistance_Ohm']
+        LDR_resistances = LDR_resistances[np.isfinite(LDR_resistances)]
+        rain_sensor_temps = converted['rain_sensor_temp_C']
+        rain_sensor_temps = rain_sensor_temps[np.isfinite(rain_sensor_temps)]
 
         # Median Results
-        if len(internal_voltages) >= n - 1:
+        if len(internal_voltages) >= len(replies) - 1:
             self.internal_voltage = np.median(internal_voltages) * u.volt
             self.logger.debug('  Internal Voltage = {:.2f}'.format(self.internal_voltage))
         else:
             self.internal_voltage = None
             self.logger.debug('  Failed to read Internal Voltage')
 
-        if len(LDR_resistances) >= n - 1:
+        if len(LDR_resistances) >= len(replies) - 1:
             self.LDR_resistance = np.median(LDR_resistances) * u.kohm
             self.logger.debug('  LDR Resistance = {:.0f}'.format(self.LDR_resistance))
         else:
             self.LDR_resistance = None
             self.logger.debug('  Failed to read LDR Resistance')
 
-        if len(rain_sensor_temps) >= n - 1:
+        if len(rain_sensor_temps) >= len(replies) - 1:
             self.rain_sensor_temp = np.median(rain_sensor_temps) * u.Celsius
             self.logger.debug('  Rain Sensor Temp = {:.1f}'.format(self.rain_sensor_temp))
         else:
@@ -432,20 +620,23 @@ class AAGCloudSensor(object):
 
         return (self.internal_voltage, self.LDR_resistance, self.rain_sensor_temp)
 
-    def get_rain_frequency(self, n=5):
+    def get_rain_frequency(self, n=5, replies=None):
         """
         Populates the self.rain_frequency property
+        If `replies` from a read cycle are given the device is not queried.
         """
         self.logger.debug('Getting rain frequency')
         values = []
-        for i in range(0, n):
+        if replies is None:
+            replies = [self.query('!E') for i in range(0, n)]
+        for reply in replies:
             try:
-                value = float(self.query('!E')[0])
+                value = float(reply[0])
                 self.logger.debug('  Rain Freq Query = {:.1f}'.format(value))
                 values.append(value)
             except Exception:
                 pass
-        if len(values) >= n - 1:
+        if len(values) >= len(replies) - 1:
             self.rain_frequency = np.median(values)
             self.logger.debug('  Rain Frequency = {:.1f}'.format(self.rain_frequency))
         else:
@@ -453,15 +644,18 @@ class AAGCloudSensor(object):
             self.logger.debug('  Failed to read Rain Frequency')
         return self.rain_frequency
 
-    def get_PWM(self):
+    def get_PWM(self, reply=None):
         """
         Populates the self.PWM property.
         Calculation is taken from Rs232_Comms_v100.pdf section "Converting values
         sent by the device to meaningful units" item 3.
+        If a `reply` from a read cycle is given the device is not queried.
         """
         self.logger.debug('Getting PWM value')
         try:
-            value = self.query('!Q')[0]
+            if reply is None:
+                reply = self.query('!Q')
+            value = reply[0]
             self.PWM = float(value) * 100. / 1023.
             self.logger.debug('  PWM Value = {:.1f}'.format(self.PWM))
         except Exception:
@@ -496,12 +690,65 @@ class AAGCloudSensor(object):
                     success = True
                 self.logger.debug('  PWM Value = {:.1f}'.format(self.PWM))
 
-    def get_errors(self):
+    def request_PWM(self, percent, force=False):
+        """
+        Sends a new PWM value without blocking on retries.
+        The write is skipped if the change is within self.heater_dead_band,
+        unless `force` is set. The value is checked against the !Q read of
+        the next cycle by verify_PWM.
+        """
+        percent = min(max(float(percent), 0.), 100.)
+
+        current = self.PWM_target if self.PWM_target is not None else self.PWM
+        if not force and current is not None and abs(percent - current) < self.heater_dead_band:
+            self.logger.debug('  PWM change to {:.1f} % within dead-band, not sent'.format(percent))
+            return False
+
+        self.logger.debug('Requesting PWM value of {:.1f} %'.format(percent))
+        send_digital = int(1023. * percent / 100.)
+        self.send('P{:04d}!'.format(send_digital), deadline=self.deadlines[r'P\d\d\d\d!'])
+
+        self.PWM_target = send_digital * 100. / 1023.
+        self.PWM_verified = False
+        return True
+
+    def verify_PWM(self):
+        """
+        Compares the last PWM read back from the device with the last value
+        requested. Returns whether they agree.
+        """
+        if self.PWM_target is None or self.PWM is None:
+            return self.PWM_verified
+
+        if abs(self.PWM - self.PWM_target) > 5.0:
+            self.logger.debug('  PWM is {:.1f} %, expected {:.1f} %'.format(self.PWM, self.PWM_target))
+            self.PWM_verified = False
+        else:
+            self.PWM_verified = True
+        return self.PWM_verified
+
+    def update_heater(self):
+        """
+        Runs the heater controller if its interval has passed since the last
+        update. In between only a PWM write that failed verification is
+        resent.
+        """
+        now = time.monotonic()
+        if self.last_heater_update is None or now - self.last_heater_update >= self.heater_interval:
+            self.last_heater_update = now
+            self.calculate_and_set_PWM()
+        elif not self.PWM_verified and self.PWM_target is not None:
+            self.logger.debug('  Resending PWM value of {:.1f} %'.format(self.PWM_target))
+            self.request_PWM(self.PWM_target, force=True)
+
+    def get_errors(self, response=None):
         """
         Populates the self.IR_errors property
+        If a `response` from a read cycle is given the device is not queried.
         """
         self.logger.debug('Getting errors')
-        response = self.query('!D')
+        if response is None:
+            response = self.query('!D')
         if response:
             self.errors = {'error_1': str(int(response[0])),
                            'error_2': str(int(response[1])),
@@ -547,14 +794,17 @@ class AAGCloudSensor(object):
         self.logger.debug('  Switch Status = {}'.format(self.switch))
         return self.switch
 
-    def wind_speed_enabled(self):
+    def wind_speed_enabled(self, reply=None):
         """
         Method returns true or false depending on whether the device supports
         wind speed measurements.
+        If a `reply` from a read cycle is given the device is not queried.
         """
         self.logger.debug('Checking if wind speed is enabled')
         try:
-            enabled = bool(self.query('v!')[0])
+            if reply is None:
+                reply = self.query('v!')
+            enabled = float(reply[0]) > 0
             if enabled:
                 self.logger.debug('  Anemometer enabled')
             else:
@@ -563,23 +813,25 @@ class AAGCloudSensor(object):
             enabled = None
         return enabled
 
-    def get_wind_speed(self, n=3):
+    def get_wind_speed(self, n=3, replies=None):
         """
         Populates the self.wind_speed property
         Based on the information in Rs232_Comms_v120.pdf document
         Medians n measurements.  This isn't mentioned specifically by the manual
         but I'm guessing it won't hurt.
+        If `replies` from a read cycle are given the device is not queried.
         """
         self.logger.debug('Getting wind speed')
-        if self.wind_speed_enabled():
+        if replies is not None or self.anemometer:
             values = []
-            for i in range(0, n):
-                result = self.query('V!')
+            if replies is None:
+                replies = [self.query('V!') for i in range(0, n)]
+            for result in replies:
                 if result:
                     value = float(result[0])
                     self.logger.debug('  Wind Speed Query = {:.1f}'.format(value))
                     values.append(value)
-            if len(values) >= 3:
+            if values and len(values) >= len(replies):
                 self.wind_speed = np.median(values) * u.km / u.hr
                 self.logger.debug('  Wind speed = {:.1f}'.format(self.wind_speed))
             else:
@@ -594,100 +846,177 @@ class AAGCloudSensor(object):
 
         self.messaging.send_message(channel, msg)
 
+    def run_read_cycle(self):
+        """
+        Runs the full read cycle as a single command plan.
+        The plan is compiled once for each anemometer state and the result,
+        including the timing of every command, is kept in self.last_cycle.
+        """
+        plan = self.cycle_plan(self.anemometer)
+
+        self.last_cycle = self.read_cycle.run(plan, samplers=self.samplers)
+        self.logger.debug('Read cycle took {:.2f} s'.format(self.last_cycle.elapsed))
+
+        return self.last_cycle
+
+    def cycle_plan(self, wind):
+        """ Returns the compiled read cycle, with or without the anemometer """
+        wind = bool(wind)
+        if wind not in self._plans:
+            counts = list(self.cycle_counts)
+            if wind:
+                counts.append(('V!', self.wind_speed_count))
+            self._plans[wind] = self.read_cycle.compile(counts)
+        return self._plans[wind]
+
+    def start_acquisition(self, interval=None, history=None):
+        """
+        Starts polling the CloudWatcher on a background thread.
+        While it runs capture() returns the most recent complete reading
+        instead of querying the device, so callers are never blocked by the
+        serial cycle or the heater. Nothing else should talk to the device
+        while the thread is running.
+        """
+        if self.acquisition is None:
+            if interval is None:
+                interval = self.cfg.get('acquisition_interval', 0.)
+            if history is None:
+                history = self.cfg.get('acquisition_history', 100)
+            self.acquisition = Acquisition(self.read_weather, interval=interval,
+                                           history=int(history), name='aag-acquisition',
+                                           logger=self.logger)
+        self.acquisition.start()
+
+    def stop_acquisition(self):
+        """ Stops the background thread, capture() queries the device again """
+        if self.acquisition is not None:
+            self.acquisition.stop()
+
     def capture(self, use_mongo=False, send_message=False, **kwargs):
-        """ Query the CloudWatcher """
+        """
+        Query the CloudWatcher
+        If background acquisition is running the most recent complete reading
+        is returned straight away, with its age in seconds as 'age_s'. A
+        reading older than max_staleness, e.g. because the serial link died,
+        is returned as unsafe, as is an empty one if the first reading
+        doesn't arrive within max_staleness.
+        """
+        if self.acquisition is not None and self.acquisition.running:
+            latest = self.acquisition.wait(self.max_staleness)
+            if latest is None:
+                self.logger.warning('UNSAFE: no reading from the background acquisition yet')
+                data = self._unsafe_reading({'weather_sensor_name': self.name}, float('inf'))
+            else:
+                timestamp, data = latest
+                data = dict(data)
+                data['age_s'] = time.monotonic() - timestamp
+                if data['age_s'] > self.max_staleness:
+                    self.logger.warning('UNSAFE: last reading is {:.0f} s old'.format(data['age_s']))
+                    data = self._unsafe_reading(data, data['age_s'])
+        else:
+            data = self.read_weather()
+
+        if send_message:
+            self.send_message({'data': data}, channel='weather')
+
+        if use_mongo:
+            self.db.insert_current('weather', data)
+
+        return data
+
+    def _unsafe_reading(self, data, age):
+        """ Marks a reading that can't be trusted as unsafe with unknown conditions """
+        data = dict(data, safe=False, age_s=age)
+        for condition in ('sky_condition', 'wind_condition', 'gust_condition', 'rain_condition'):
+            data[condition] = 'Unknown'
+        return data
+
+    def read_weather(self):
+        """ Runs a read cycle, makes the safety decision and updates the heater """
 
         self.logger.debug("Updating weather")
 
+        data = self.process_cycle(self.run_read_cycle())
+
+        self.update_heater()
+
+        return data
+
+    def process_cycle(self, cycle):
+        """
+        Converts the replies of a read cycle, makes the safety decision and
+        stores the reading in the weather history.
+        """
         data = {}
         data['weather_sensor_name'] = self.name
         data['weather_sensor_firmware_version'] = self.firmware_version
         data['weather_sensor_serial_number'] = self.serial_number
 
-        if self.get_sky_temperature():
+        self.last_raw = aag_raw.raw_from_cycle(cycle)
+        if self.raw_mode:
+            data['raw'] = {name: values.tolist() for name, values in self.last_raw.items()}
+
+        data['samples'] = {'sky_temp': cycle.count('!S'),
+                           'ambient_temp': cycle.count('!T'),
+                           'values': cycle.count('!C'),
+                           'rain_frequency': cycle.count('!E')}
+
+        if self.get_sky_temperature(replies=cycle['!S']):
             data['sky_temp_C'] = self.sky_temp.value
-        if self.get_ambient_temperature():
+        if self.get_ambient_temperature(replies=cycle['!T']):
             data['ambient_temp_C'] = self.ambient_temp.value
-        self.get_values()
+        self.get_values(replies=cycle['!C'])
         if self.internal_voltage:
             data['internal_voltage_V'] = self.internal_voltage.value
         if self.LDR_resistance:
             data['ldr_resistance_Ohm'] = self.LDR_resistance.value
         if self.rain_sensor_temp:
             data['rain_sensor_temp_C'] = "{:.02f}".format(self.rain_sensor_temp.value)
-        if self.get_rain_frequency():
+        if self.get_rain_frequency(replies=cycle['!E']):
             data['rain_frequency'] = self.rain_frequency
-        if self.get_PWM():
+        if self.get_PWM(reply=cycle['!Q'][0]):
             data['pwm_value'] = self.PWM
-        if self.get_errors():
+        self.verify_PWM()
+        if self.get_errors(response=cycle['!D'][0]):
             data['errors'] = self.errors
-        if self.get_wind_speed():
+        if self.get_wind_speed(n=self.wind_speed_count, replies=cycle['V!']):
             data['wind_speed_KPH'] = self.wind_speed.value
 
         # Make Safety Decision
         self.safe_dict = self.make_safety_decision(data)
 
+        data['history_coverage'] = self.history_coverage()
+        if self.time_to_trusted is None and data['history_coverage'] >= self.trusted_coverage:
+            self.time_to_trusted = time.monotonic() - self.start_time
+            self.logger.info('Safety decision trusted {:.1f} s after start'.format(
+                self.time_to_trusted))
+
         data['safe'] = self.safe_dict['Safe']
         data['sky_condition'] = self.safe_dict['Sky']
         data['wind_condition'] = self.safe_dict['Wind']
         data['gust_condition'] = self.safe_dict['Gust']
         data['rain_condition'] = self.safe_dict['Rain']
 
-        # Store current weather
-        data['date'] = dt.utcnow().strftime('%d-%m-%Y %H:%M:%S')
-        self.weather_entries.append(data)
-
-        # If we get over a certain amount of entries, trim the earliest
-        if len(self.weather_entries) > int(self.safety_delay):
-            del self.weather_entries[:1]
-
-        self.calculate_and_set_PWM()
-
-        if send_message:
-            self.send_message({'data': data}, channel='weather')
-
-        if use_mongo:
-            self.db.insert_current('weather', data)
+        # Store current weather, entries older than safety_delay are dropped.
+        # Readings carry the epoch time and a UTC datetime, formatting is
+        # left to whatever displays them.
+        data['timestamp'] = time.time()
+        data['date'] = dt.utcfromtimestamp(data['timestamp'])
+        self.weather_entries.append(self._history_entry(data), timestamp=data['timestamp'])
+        if self.last_snapshot is None or \
+                time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.save_history()
 
         return data
 
     def AAG_heater_algorithm(self, target, last_entry):
         """
         Uses the algorithm described in RainSensorHeaterAlgorithm.pdf to
-        determine PWM value.
+        determine the change of the PWM value.
         Values are for the default read cycle of 10 seconds.
         """
-        deltaT = last_entry['rain_sensor_temp_C'] - target
-        scaling = 0.5
-        if deltaT > 8.:
-            deltaPWM = -40 * scaling
-        elif deltaT > 4.:
-            deltaPWM = -20 * scaling
-        elif deltaT > 3.:
-            deltaPWM = -10 * scaling
-        elif deltaT > 2.:
-            deltaPWM = -6 * scaling
-        elif deltaT > 1.:
-            deltaPWM = -4 * scaling
-        elif deltaT > 0.5:
-            deltaPWM = -2 * scaling
-        elif deltaT > 0.3:
-            deltaPWM = -1 * scaling
-        elif deltaT < -0.3:
-            deltaPWM = 1 * scaling
-        elif deltaT < -0.5:
-            deltaPWM = 2 * scaling
-        elif deltaT < -1.:
-            deltaPWM = 4 * scaling
-        elif deltaT < -2.:
-            deltaPWM = 6 * scaling
-        elif deltaT < -3.:
-            deltaPWM = 10 * scaling
-        elif deltaT < -4.:
-            deltaPWM = 20 * scaling
-        elif deltaT < -8.:
-            deltaPWM = 40 * scaling
-        return int(deltaPWM)
+        deltaT = float(last_entry['rain_sensor_temp_C']) - target
+        return int(heater_sim.aag_delta_PWM(deltaT))
 
     def calculate_and_set_PWM(self):
         """
@@ -704,8 +1033,8 @@ class AAGCloudSensor(object):
         self.logger.debug('  Found {} entries in last {:d} seconds.'.format(
             len(entries), int(self.heater_cfg['impulse_cycle']), ))
 
-        last_entry = self.weather_entries[-1]
-        rain_history = [x['rain_safe'] for x in entries if 'rain_safe' in x.keys()]
+        last_entry = entries.last()
+        rain_history = entries.column('rain_safe')
 
         if 'ambient_temp_C' not in last_entry.keys():
             self.logger.warning(
@@ -740,25 +1069,20 @@ class AAGCloudSensor(object):
             if self.impulse_heating:
                 target_temp = float(last_entry['ambient_temp_C']) + \
                     float(self.heater_cfg['impulse_temp'])
-                if last_entry['rain_sensor_temp_C'] < target_temp:
+                if float(last_entry['rain_sensor_temp_C']) < target_temp:
                     self.logger.debug('  Rain sensor temp < target.  Setting heater to 100 %.')
-                    self.set_PWM(100)
+                    self.request_PWM(100)
                 else:
-                    new_PWM = self.AAG_heater_algorithm(target_temp, last_entry)
+                    # The table gives a step from the PWM read back this cycle
+                    current_PWM = self.PWM if self.PWM is not None else 0.
+                    new_PWM = int(current_PWM + self.AAG_heater_algorithm(target_temp, last_entry))
+                    new_PWM = min(max(new_PWM, 0), 100)
                     self.logger.debug(
                         '  Rain sensor temp > target.  Setting heater to {:d} %.'.format(new_PWM))
-                    self.set_PWM(new_PWM)
+                    self.request_PWM(new_PWM)
             else:
-                if last_entry['ambient_temp_C'] < self.heater_cfg['low_temp']:
-                    deltaT = self.heater_cfg['low_delta']
-                elif last_entry['ambient_temp_C'] > self.heater_cfg['high_temp']:
-                    deltaT = self.heater_cfg['high_delta']
-                else:
-                    frac = (last_entry['ambient_temp_C'] - self.heater_cfg['low_temp']) /\
-                           (self.heater_cfg['high_temp'] - self.heater_cfg['low_temp'])
-                    deltaT = self.heater_cfg['low_delta'] + frac * \
-                        (self.heater_cfg['high_delta'] - self.heater_cfg['low_delta'])
-                target_temp = last_entry['ambient_temp_C'] + deltaT
+                target_temp = float(heater_sim.target_temperature(
+                    float(last_entry['ambient_temp_C']), self.heater_cfg))
                 new_PWM = int(self.heater_PID.recalculate(float(last_entry['rain_sensor_temp_C']),
                                                           new_set_point=target_temp))
                 self.logger.debug('  last PID interval = {:.1f} s'.format(
@@ -770,7 +1094,7 @@ class AAGCloudSensor(object):
                     len(self.heater_PID.history),
                     self.heater_PID.Kd * self.heater_PID.Dval,
                 ))
-                self.set_PWM(new_PWM)
+                self.request_PWM(new_PWM)
 
     def make_safety_decision(self, current_values):
         """
@@ -810,18 +1134,15 @@ class AAGCloudSensor(object):
         threshold_cloudy = self.cfg.get('threshold_cloudy', -22.5)
         threshold_very_cloudy = self.cfg.get('threshold_very_cloudy', -15.)
 
-        sky_diff = [x['sky_temp_C'] - x['ambient_temp_C']
-                    for x in entries
-                    if ('ambient_temp_C' and 'sky_temp_C') in x.keys()]
-
-        if len(sky_diff) == 0:
+        if entries.count('sky_diff') == 0:
             self.logger.debug('  UNSAFE: no sky temperatures found')
             sky_safe = False
             cloud_condition = 'Unknown'
         else:
-            if max(sky_diff) > threshold_cloudy:
+            max_sky_diff = entries.max('sky_diff')
+            if max_sky_diff > threshold_cloudy:
                 self.logger.debug('UNSAFE: Cloudy in last {} min. Max sky diff {:.1f} C'.format(
-                                  safety_delay, max(sky_diff)))
+                                  safety_delay, max_sky_diff))
                 sky_safe = False
             else:
                 sky_safe = True
@@ -834,7 +1155,7 @@ class AAGCloudSensor(object):
             else:
                 cloud_condition = 'Clear'
             self.logger.debug(
-                'Cloud Condition: {} (Sky-Amb={:.1f} C)'.format(cloud_condition, sky_diff[-1]))
+                'Cloud Condition: {} (Sky-Amb={:.1f} C)'.format(cloud_condition, last_cloud))
 
         return cloud_condition, sky_safe
 
@@ -842,8 +1163,6 @@ class AAGCloudSensor(object):
         safety_delay = self.safety_delay
         entries = self.weather_entries
 
-        end_time = dt.utcnow()
-
         threshold_windy = self.cfg.get('threshold_windy', 20.)
         threshold_very_windy = self.cfg.get('threshold_very_windy', 30)
 
@@ -851,48 +1170,39 @@ class AAGCloudSensor(object):
         threshold_very_gusty = self.cfg.get('threshold_very_gusty', 50.)
 
         # Wind (average and gusts)
-        wind_speed = [x['wind_speed_KPH']
-                      for x in entries
-                      if 'wind_speed_KPH' in x.keys()]
-
-        if len(wind_speed) == 0:
+        if entries.count('wind_speed_KPH') == 0:
             self.logger.debug('  UNSAFE: no wind speed readings found')
             wind_safe = False
             gust_safe = False
             wind_condition = 'Unknown'
             gust_condition = 'Unknown'
         else:
-            start_time = entries[0]['date']
-            if type(start_time) == str:
-                start_time = date_parser(entries[0]['date'])
-
-            typical_data_interval = (end_time - start_time).total_seconds() / len(entries)
-
-            moving_avg_seconds = 120.
-            mavg_count = int(np.ceil(moving_avg_seconds / typical_data_interval))
-            wind_mavg = movingaverage(wind_speed, mavg_count)
+            # Two minute average of the wind speed
+            max_wind_mavg = entries.max('wind_mavg')
+            wind_mavg = entries.last('wind_mavg')
 
             # Windy?
-            if max(wind_mavg) > threshold_very_windy:
+            if max_wind_mavg > threshold_very_windy:
                 self.logger.debug('  UNSAFE:  Very windy in last {:.0f} min. Max wind speed {:.1f} kph'.format(
-                    safety_delay, max(wind_mavg)))
+                    safety_delay, max_wind_mavg))
                 wind_safe = False
             else:
                 wind_safe = True
 
-            if wind_mavg[-1] > threshold_very_windy:
+            if wind_mavg > threshold_very_windy:
                 wind_condition = 'Very Windy'
-            elif wind_mavg[-1] > threshold_windy:
+            elif wind_mavg > threshold_windy:
                 wind_condition = 'Windy'
             else:
                 wind_condition = 'Calm'
             self.logger.debug(
-                '  Wind Condition: {} ({:.1f} km/h)'.format(wind_condition, wind_mavg[-1]))
+                '  Wind Condition: {} ({:.1f} km/h)'.format(wind_condition, wind_mavg))
 
             # Gusty?
-            if max(wind_speed) > threshold_very_gusty:
+            max_wind_speed = entries.max('wind_speed_KPH')
+            if max_wind_speed > threshold_very_gusty:
                 self.logger.debug('  UNSAFE:  Very gusty in last {:.0f} min. Max gust speed {:.1f} kph'.format(
-                    safety_delay, max(wind_speed)))
+                    safety_delay, max_wind_speed))
                 gust_safe = False
             else:
                 gust_safe = True
@@ -906,7 +1216,7 @@ class AAGCloudSensor(object):
                 gust_condition = 'Calm'
 
             self.logger.debug(
-                '  Gust Condition: {} ({:.1f} km/h)'.format(gust_condition, wind_speed[-1]))
+                '  Gust Condition: {} ({:.1f} km/h)'.format(gust_condition, entries.last('wind_speed_KPH')))
 
         return (wind_condition, wind_safe), (gust_condition, gust_safe)
 
@@ -917,9 +1227,7 @@ class AAGCloudSensor(object):
         threshold_rain = self.cfg.get('threshold_rainy', 1700.)
 
         # Rain
-        rf_value = [x['rain_frequency'] for x in entries if 'rain_frequency' in x.keys()]
-
-        if len(rf_value) == 0:
+        if entries.count('rain_frequency') == 0:
             rain_safe = False
             rain_condition = 'Unknown'
         else:
@@ -936,10 +1244,11 @@ class AAGCloudSensor(object):
 
             # If safe now, check last 15 minutes
             if rain_safe:
-                if min(rf_value) <= threshold_rain:
+                min_rain_frequency = entries.min('rain_frequency')
+                if min_rain_frequency <= threshold_rain:
                     self.logger.debug('  UNSAFE:  Rain in last {:.0f} min.'.format(safety_delay))
                     rain_safe = False
-                elif min(rf_value) <= threshold_wet:
+                elif min_rain_frequency <= threshold_wet:
                     self.logger.debug('  UNSAFE:  Wet in last {:.0f} min.'.format(safety_delay))
                     rain_safe = False
                 else:
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import functools
 import logging
+import time
 from pocs.utils.messaging import PanMessaging
 
+from .acquisition import Acquisition
+from .thresholds import ThresholdClassifier
+from .weather_cache import FetchCache
+
 def get_mongodb():
     from pocs.utils.database import PanMongo
     return PanMongo()
@@ -21,9 +27,30 @@ class WeatherDataAbstract(object):
         self.db:
         self.messaging:
         self.weather_entries:
+        self.timeout: Seconds to wait for the remote data, used as the
+            deadline of the source by `AsyncWeatherRunner`.
+        self.max_age: Seconds before the remote data is fetched again.
+        self.cache: `FetchCache` of the remote data, keyed on the time of the
+            upstream record.
+        self.stale_while_revalidate: Whether `capture` uses the last data
+            straight away while it is refreshed in the background.
+        self.max_staleness: Seconds after the upstream record was taken
+            that its data is unsafe.
+        self.clock: Wall clock the age of the upstream record is measured by.
+        self.refresher: `Acquisition` refreshing the data in the background.
     """
 
-    def __init__(self, use_mongo=True):
+    def __init__(self, use_mongo=True, timeout=None, max_age=None,
+                 stale_while_revalidate=False, max_staleness=None):
+        self.timeout = timeout
+        self.max_age = max_age
+        self.cache = FetchCache(max_age, name=type(self).__name__)
+
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_staleness = max_staleness
+        self.clock = time.time
+        self.refresher = None
+
         self.db = None
         if use_mongo:
             self.db = get_mongodb()
@@ -31,6 +58,8 @@ class WeatherDataAbstract(object):
         self.messaging = None
         self.weather_entries = {}
 
+        self._classifier = None
+
     def send_message(self, msg, channel='weather'):
         # Sends weather data to POCS
         if self.messaging is None:
@@ -38,6 +67,49 @@ class WeatherDataAbstract(object):
 
         self.messaging.send_message(channel, msg)
 
+    def latest_values(self, fetch):
+        """Gets the values of the remote data for a capture
+
+        Normally `fetch` is called, which downloads the data again once it is
+        older than `max_age`. With `stale_while_revalidate` the last data is
+        returned straight away instead and `fetch` runs on a background
+        thread every `max_age` seconds, so a slow or hung server never holds
+        up the capture.
+
+        Args:
+            fetch: Returns a dict of the values, e.g. `fetch_met23_data`.
+
+        Returns:
+            Dict of the values plus their 'age', the seconds since the newest
+            record was taken upstream. A feed that is still served but no
+            longer updated keeps getting older. Empty apart from the age
+            until the first fetch completes.
+        """
+        if not self.stale_while_revalidate:
+            values = fetch()
+            return dict(values, age=self.cache.record_age(self.clock()))
+
+        if self.refresher is None:
+            self.refresher = Acquisition(functools.partial(self._revalidate, fetch),
+                                         interval=self.max_age or 0., history=1,
+                                         name='{}-refresh'.format(type(self).__name__))
+        self.refresher.start()
+
+        latest = self.refresher.latest
+        if latest is None:
+            return {'age': float('inf')}
+        return dict(latest[1], age=self.cache.record_age(self.clock()))
+
+    def stop(self):
+        """Stops the background refresh"""
+        if self.refresher is not None:
+            self.refresher.stop()
+
+    def _revalidate(self, fetch):
+        # The refresher already waited max_age, so always go to the server
+        self.cache.expire()
+        return fetch()
+
     def capture(self, use_mongo=False, send_message=False, **kwargs):
         """Gets result from safety conditions and stores the current data
 
@@ -77,6 +149,11 @@ class WeatherDataAbstract(object):
 
             self.weather_entries['safe'] = safe
 
+        age = self.weather_entries.get('age')
+        if self.max_staleness is not None and age is not None and age > self.max_staleness:
+            self.logger.warning('UNSAFE: weather data is {:.0f} s old'.format(age))
+            self.weather_entries['safe'] = False
+
         return self.weather_entries
 
     def _get_cloud_safety(self, statuses):
@@ -106,7 +183,7 @@ class WeatherDataAbstract(object):
             cloud_safe = False
 
         self.logger.debug('Cloud Condition: {} (Sky-ambient is {})'.format(
-                          cloud_condition, self.weather_entries['sky-ambient']))
+                          cloud_condition, self.weather_entries.get('sky-ambient')))
 
         return cloud_condition, cloud_safe
 
@@ -137,7 +214,7 @@ class WeatherDataAbstract(object):
             wind_safe = False
 
         self.logger.debug('Wind Condition: {} (Wind speed is {})'.format(
-                          wind_condition,  self.weather_entries['wind_speed']))
+                          wind_condition,  self.weather_entries.get('wind_speed')))
 
         return wind_condition, wind_safe
 
@@ -168,7 +245,7 @@ class WeatherDataAbstract(object):
             gust_safe = False
 
         self.logger.debug('Gust condition: {} (Gust speed is {})'.format(
-                          gust_condition,  self.weather_entries['wind_gust']))
+                          gust_condition,  self.weather_entries.get('wind_gust')))
 
         return gust_condition, gust_safe
 
@@ -193,21 +270,8 @@ class WeatherDataAbstract(object):
 
                 {'sky-ambient': 'Clear', 'wind_speed': 'Very windy', ... , etc.}
         """
-        current_statuses = {}
-
-        for col_name, thresholds in self.thresholds.items():
-            # gets the value of the specfic "col_name"
-            current_value = self.weather_entries[col_name]
-            current_statuses[col_name] = 'Invalid'
-
-            for status, threshold in thresholds.items():
-                if len(threshold) == 1:
-                    if current_value == threshold:
-                        current_statuses[col_name] = status
-                elif len(threshold) == 2:
-                    if current_value > threshold[0] and current_value <= threshold[1]:
-                        current_statuses[col_name] = status
-                else:
-                    raise ValueError("Should only have 1 or 2 threshold entries, got {} for {}!".format(len(threshold), col_name))
-
-        return current_statuses
+        # Compiled on first use, and again if the thresholds are replaced
+        if self._classifier is None or self._classifier.thresholds is not self.thresholds:
+            self._classifier = ThresholdClassifier(self.thresholds)
+
+        return self._classifier.classify_all(self.weather_entries)
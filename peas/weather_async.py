@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .aag_serial import AAGReadCycle
+from .aag_serial import HANDSHAKE
+from .weather import AAGCloudSensor
+
+
+class AsyncAAGSerialTransport(object):
+
+    """
+    asyncio version of `AAGSerialTransport`.
+
+    Waits for reply bytes with `loop.add_reader` on the serial port's file
+    descriptor, so a read cycle never blocks the event loop. Framing checks
+    and statistics are shared with the wrapped `AAGSerialTransport`, as is
+    its lock, so a heater update still running in the executor after a
+    capture was cancelled can't interleave with the next read cycle.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.port = transport.port
+
+    @property
+    def last_framed(self):
+        return self.transport.last_framed
+
+    async def transact(self, command, deadline=1.0):
+        """ Sends `command` and waits for the framed reply, see `AAGSerialTransport.transact` """
+        await self.acquire()
+        try:
+            return await self._transact(command, deadline)
+        finally:
+            self.transport.lock.release()
+
+    async def acquire(self):
+        """ Takes the lock of the port without blocking the event loop """
+        while not self.transport.lock.acquire(blocking=False):
+            await asyncio.sleep(self.transport.poll_interval)
+
+    async def _transact(self, command, deadline):
+        loop = asyncio.get_running_loop()
+        fd = self.port.fileno()
+        readable = asyncio.Event()
+
+        self.transport.clear()
+
+        start = loop.time()
+        self.port.write(command.encode('utf-8'))
+
+        raw = b''
+        loop.add_reader(fd, readable.set)
+        try:
+            while not raw.endswith(HANDSHAKE):
+                waiting = self.port.inWaiting()
+                if waiting:
+                    raw += self.port.read(waiting)
+                    continue
+
+                remaining = deadline - (loop.time() - start)
+                if remaining <= 0:
+                    break
+                readable.clear()
+                try:
+                    await asyncio.wait_for(readable.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            loop.remove_reader(fd)
+
+        return self.transport.unframe(command, raw, loop.time() - start)
+
+
+class AsyncAAGReadCycle(AAGReadCycle):
+
+    """ `AAGReadCycle` that runs its plan over an `AsyncAAGSerialTransport` """
+
+    async def run(self, plan, samplers=None):
+        """ Runs a compiled command plan, see `AAGReadCycle.run` """
+        steps = self.steps(plan, samplers=samplers)
+        try:
+            cmd, deadline = next(steps)
+            while True:
+                response = await self.transport.transact(cmd, deadline=deadline)
+                cmd, deadline = steps.send(response)
+        except StopIteration as stop:
+            return stop.value
+
+
+class AsyncAAGCloudSensor(object):
+
+    """
+    Runs the read cycle of an `AAGCloudSensor` on the event loop.
+
+    The serial conversation is fully asynchronous. Heater updates, which may
+    write a new PWM value, are handed to the executor.
+
+    A capture that misses its deadline is cancelled between two commands, so
+    it is never still `running` when the next one starts.
+    """
+
+    running = False
+
+    def __init__(self, sensor, executor=None):
+        self.sensor = sensor
+        self.logger = sensor.logger
+        self.executor = executor
+
+        self.transport = AsyncAAGSerialTransport(sensor.transport)
+        self.read_cycle = AsyncAAGReadCycle(self.transport, sensor.expects,
+                                            deadlines=sensor.deadlines, logger=sensor.logger)
+
+    async def capture(self, use_mongo=False, send_message=False, **kwargs):
+        """ Query the CloudWatcher, see `AAGCloudSensor.capture` """
+        sensor = self.sensor
+
+        plan = sensor.cycle_plan(sensor.anemometer)
+        sensor.last_cycle = await self.read_cycle.run(plan, samplers=sensor.samplers)
+        data = sensor.process_cycle(sensor.last_cycle)
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, sensor.update_heater)
+
+        if send_message:
+            sensor.send_message({'data': data}, channel='weather')
+
+        if use_mongo:
+            sensor.db.insert_current('weather', data)
+
+        return data
+
+
+class AsyncCapture(object):
+
+    """
+    Gives a blocking source, e.g. `Met23Weather` or `ArduinoSerialMonitor`, an
+    `async capture()` by running its `capture` on a shared executor.
+
+    A thread can't be cancelled, so when the caller stops waiting the
+    capture carries on, and `running` stays True until it finishes.
+    """
+
+    def __init__(self, source, executor=None):
+        self.source = source
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.future = None
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    async def capture(self, **kwargs):
+        self.future = self.executor.submit(functools.partial(self.source.capture, **kwargs))
+        # Shielded so a missed deadline leaves the capture to finish
+        return await asyncio.shield(asyncio.wrap_future(self.future))
+
+
+class AsyncWeatherRunner(object):
+
+    """
+    Drives several weather and environment sources from a single event loop,
+    each with its own deadline.
+
+    The AAG CloudWatcher is read natively on the loop, blocking sources share
+    one small thread pool, so the serial cycle, the Arduino reads and the
+    network fetches overlap without a thread or timer per sensor. A capture
+    round takes as long as the slowest source, or its deadline, rather than
+    the sum of all of them.
+
+    A source that misses its deadline gives None for that round. A blocking
+    capture keeps running in the background and the source is skipped until
+    it finishes, so a hung server never ties up more than one worker.
+
+    Attributes:
+        self.sources: Dict of name to (async source, interval, deadline,
+            capture kwargs).
+        self.latest: Dict of name to the most recent reading of each source.
+        self.elapsed: Dict of name to seconds taken by the last capture that
+            finished in time.
+        self.missed: Dict of name to number of missed deadlines.
+    """
+
+    def __init__(self, max_workers=4):
+        self.logger = logging.getLogger('weather-runner')
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.sources = dict()
+        self.latest = dict()
+        self.elapsed = dict()
+        self.missed = dict()
+        self._tasks = list()
+
+    def add(self, name, source, interval=60., deadline=None, **kwargs):
+        """
+        Adds a source with a `capture()` method.
+
+        Args:
+            name: Key for the source in `self.latest`.
+            source: An `AAGCloudSensor`, any object with a blocking or async
+                `capture()`. An `AAGCloudSensor` with background acquisition
+                running is left to its thread, only its snapshots are read.
+            interval: Seconds between captures when using `run`.
+            deadline: Seconds to wait for a capture, defaults to the `timeout`
+                of the source if it has one, otherwise no limit.
+            kwargs: Passed on to `capture()`, e.g. use_mongo=True.
+        """
+        if deadline is None:
+            deadline = getattr(source, 'timeout', None)
+        if deadline is None:
+            self.logger.warning('{} has no deadline and can hold up every round'.format(name))
+
+        if isinstance(source, AAGCloudSensor) and source.transport is not None and \
+                not (source.acquisition is not None and source.acquisition.running):
+            source = AsyncAAGCloudSensor(source, executor=self.executor)
+        elif not asyncio.iscoroutinefunction(source.capture):
+            source = AsyncCapture(source, executor=self.executor)
+
+        self.sources[name] = (source, interval, deadline, kwargs)
+        self.missed.setdefault(name, 0)
+
+    async def capture(self, name):
+        source, interval, deadline, kwargs = self.sources[name]
+        if getattr(source, 'running', False):
+            self.logger.warning('Still waiting for the last capture of {}'.format(name))
+            self.latest[name] = None
+            return None
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            data = await asyncio.wait_for(source.capture(**kwargs), deadline)
+        except asyncio.TimeoutError:
+            self.missed[name] += 1
+            self.logger.warning('{} missed its {:.1f} s deadline'.format(name, deadline))
+            data = None
+        except Exception as e:
+            self.logger.warning('Problem capturing {}: {}'.format(name, e))
+            data = None
+        else:
+            self.elapsed[name] = loop.time() - start
+        self.latest[name] = data
+        return data
+
+    async def capture_all(self):
+        """ Captures every source concurrently, returns a dict of the readings """
+        names = list(self.sources.keys())
+        results = await asyncio.gather(*[self.capture(name) for name in names])
+        return dict(zip(names, results))
+
+    async def run(self):
+        """ Captures each source on its own interval until `stop` is called """
+        self._tasks = [asyncio.ensure_future(self._loop(name)) for name in self.sources]
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def shutdown(self):
+        """ Stops the thread pool without waiting for late captures """
+        self.stop()
+        self.executor.shutdown(wait=False)
+
+    async def _loop(self, name):
+        interval = self.sources[name][1]
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await self.capture(name)
+            await asyncio.sleep(max(0., interval - (loop.time() - start)))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import collections
+import datetime
+import logging
+import os
+import time
+
+
+# Record times of the metsys feeds, their date and utc joined by
+# `metsys.Extractor`, e.g. '2017-06-21 12:30:00'
+METSYS_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M')
+
+
+def timestamp(record_time):
+    """
+    Epoch seconds of the time of an upstream record.
+
+    Understands the metsys record times of `METSYS_TIME_FORMATS` and the
+    `datetime` of the AAT metdata records, both UTC, as well as epoch
+    seconds.
+
+    Raises:
+        ValueError: If the time is in none of those forms.
+    """
+    if isinstance(record_time, datetime.datetime):
+        if record_time.tzinfo is None:
+            record_time = record_time.replace(tzinfo=datetime.timezone.utc)
+        return record_time.timestamp()
+    if isinstance(record_time, (int, float)) and not isinstance(record_time, bool):
+        return float(record_time)
+    if isinstance(record_time, str):
+        for time_format in METSYS_TIME_FORMATS:
+            try:
+                return timestamp(datetime.datetime.strptime(record_time.strip(), time_format))
+            except ValueError:
+                pass
+    raise ValueError('Unknown record time: {!r}'.format(record_time))
+
+
+class FetchCache(object):
+
+    """
+    Time to live cache of the data fetched by a remote met data source.
+
+    Entries are keyed on the time of the upstream record they were parsed
+    from, e.g. the date and utc of a metsys document, so fetching a record
+    the source hasn't replaced yet is recognised and doesn't add an entry.
+    The newest entry is fresh for `max_age` seconds after it was last
+    fetched, timed with the monotonic clock so changes to the system clock
+    don't expire it early or keep it forever.
+
+    Files downloaded for an entry belong to the cache and are deleted when
+    the entry is evicted, so repeated downloads don't pile up on disk.
+
+    Attributes:
+        self.max_age: Seconds the newest entry stays fresh, no caching if None.
+        self.keep: Number of records kept.
+        self.entries: OrderedDict of record time to (data, files), oldest first.
+        self.fetched: Monotonic time the newest entry was last fetched.
+    """
+
+    def __init__(self, max_age=None, keep=1, name=None, clock=time.monotonic):
+        self.logger = logging.getLogger(name or 'fetch-cache')
+
+        self.max_age = max_age
+        self.keep = max(int(keep), 1)
+        self.clock = clock
+
+        self.entries = collections.OrderedDict()
+        self.fetched = None
+        self._unparsed = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def record_time(self):
+        """ Upstream time of the newest record, None if nothing is cached """
+        if not self.entries:
+            return None
+        return next(reversed(self.entries))
+
+    @property
+    def value(self):
+        """ Data of the newest record whatever its age, None if nothing is cached """
+        if not self.entries:
+            return None
+        return self.entries[self.record_time][0]
+
+    def age(self):
+        """ Seconds since the newest entry was fetched, infinite if there is none """
+        if self.fetched is None:
+            return float('inf')
+        return self.clock() - self.fetched
+
+    def record_age(self, now=None):
+        """
+        Seconds since the newest record was taken upstream, by the wall clock
+        time `now`, default the current time. Refetching or revalidating a
+        record doesn't make it any younger, so this keeps growing when the
+        source stops updating. Infinite if there is no record.
+
+        If the time of the record can't be parsed a warning is logged and the
+        seconds since it was last fetched are used instead.
+        """
+        if not self.entries:
+            return float('inf')
+        try:
+            record_time = timestamp(self.record_time)
+        except ValueError as e:
+            if self.record_time != self._unparsed:
+                self._unparsed = self.record_time
+                self.logger.warning('{}, using the time since it was fetched'.format(e))
+            return self.age()
+        return (time.time() if now is None else now) - record_time
+
+    def expired(self):
+        return self.max_age is None or self.age() > self.max_age
+
+    def get(self):
+        """ Data of the newest record if it is still fresh, otherwise None """
+        if not self.entries or self.expired():
+            return None
+        return self.value
+
+    def put(self, record_time, data, files=()):
+        """
+        Stores the data of a fetched record.
+
+        Args:
+            record_time: Time of the record upstream, any hashable value.
+            data: The parsed record.
+            files: Paths of files downloaded for the record, owned by the
+                cache from now on.
+
+        Returns:
+            True if the record is new, False if it was already cached, in
+            which case the cached data is kept and `files` are deleted.
+        """
+        self.fetched = self.clock()
+
+        if record_time in self.entries:
+            self.logger.debug('Record of {} not updated upstream yet'.format(record_time))
+            self._remove(files)
+            self.entries.move_to_end(record_time)
+            return False
+
+        self.entries[record_time] = (data, list(files))
+        while len(self.entries) > self.keep:
+            _, (_, old_files) = self.entries.popitem(last=False)
+            self._remove(old_files)
+        return True
+
+    def expire(self):
+        """ Makes the newest entry stale, so the next `get` misses, keeping its data """
+        self.fetched = None
+
+    def touch(self):
+        """ Marks the newest entry as fetched now, e.g. on a 304 reply """
+        if self.entries:
+            self.fetched = self.clock()
+
+    def clear(self):
+        """ Evicts every entry, deleting their files """
+        while self.entries:
+            _, (_, files) = self.entries.popitem(last=False)
+            self._remove(files)
+        self.fetched = None
+
+    def _remove(self, files):
+        for filename in files:
+            try:
+                os.remove(filename)
+            except OSError as e:
+                self.logger.debug('Could not remove {}: {}'.format(filename, e))
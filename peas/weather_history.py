@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import collections
+import numpy as np
+import os
+import time
+
+from .stats import WindowedMean
+
+
+class WeatherHistory(object):
+
+    """
+    Time windowed history of weather readings.
+
+    Readings are kept in preallocated numpy columns, one per field plus an
+    epoch timestamp, used as a ring buffer. Entries older than `window`
+    seconds are dropped when a new one is added. The maximum and minimum of
+    every field over the window are kept with monotonic deques and running
+    means with `stats.WindowedMean`, so adding a reading and every query is
+    O(1) on average, however many readings the window holds.
+
+    Missing values are stored as NaN and ignored by every statistic.
+
+    Attributes:
+        self.fields: Names of the stored fields.
+        self.window: Length of the history in seconds.
+        self.averages: Dict of name to (field, seconds) of the running means
+            stored as extra fields, e.g. {'wind_mavg': ('wind_speed_KPH', 120.)}.
+        self.times: Epoch timestamps column.
+        self.columns: Dict of field to column.
+    """
+
+    def __init__(self, fields, window, averages=None, capacity=256):
+        self.averages = averages or dict()
+        self.fields = list(fields) + [name for name in self.averages if name not in fields]
+        self.window = float(window)
+
+        self.times = np.zeros(capacity)
+        self.columns = {field: np.full(capacity, np.nan) for field in self.fields}
+
+        # Sequence numbers of the oldest and the next entry
+        self._first = 0
+        self._next = 0
+
+        self._max = {field: collections.deque() for field in self.fields}
+        self._min = {field: collections.deque() for field in self.fields}
+        self._count = {field: 0 for field in self.fields}
+
+        self._means = {name: WindowedMean(seconds) for name, (_, seconds) in self.averages.items()}
+
+    def __len__(self):
+        return self._next - self._first
+
+    @property
+    def capacity(self):
+        return len(self.times)
+
+    def append(self, values, timestamp=None):
+        """
+        Adds a reading and drops those that fell out of the window.
+
+        Args:
+            values: Dict of field to value. Unknown keys and values that can't
+                be turned into a float are ignored.
+            timestamp: Epoch seconds of the reading, defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        if len(self) == self.capacity:
+            self._grow()
+
+        seq = self._next
+        pos = seq % self.capacity
+        self.times[pos] = timestamp
+        for field in self.fields:
+            if field in self.averages:
+                continue
+            try:
+                value = float(values[field])
+            except (KeyError, TypeError, ValueError):
+                value = np.nan
+            self.columns[field][pos] = value
+        self._next += 1
+
+        for name, (field, _) in self.averages.items():
+            self.columns[name][pos] = self._means[name].update(timestamp, self.columns[field][pos])
+
+        for field in self.fields:
+            self._push(field, seq)
+
+        self.expire(timestamp - self.window)
+
+    def expire(self, before):
+        """ Drops the entries older than the `before` epoch timestamp """
+        while len(self) and self.times[self._first % self.capacity] < before:
+            seq = self._first
+            pos = seq % self.capacity
+            for field in self.fields:
+                if not np.isnan(self.columns[field][pos]):
+                    self._count[field] -= 1
+                for extrema in (self._max[field], self._min[field]):
+                    if extrema and extrema[0] == seq:
+                        extrema.popleft()
+            self._first += 1
+
+    def clear(self):
+        self._first = self._next
+        for field in self.fields:
+            self._max[field].clear()
+            self._min[field].clear()
+            self._count[field] = 0
+        for mean in self._means.values():
+            mean.reset()
+
+    def count(self, field):
+        """ Number of values of `field` in the window """
+        return self._count.get(field, 0)
+
+    def max(self, field):
+        """ Largest value of `field` in the window, NaN if there is none """
+        extrema = self._max.get(field)
+        if not extrema:
+            return np.nan
+        return self.columns[field][extrema[0] % self.capacity]
+
+    def min(self, field):
+        """ Smallest value of `field` in the window, NaN if there is none """
+        extrema = self._min.get(field)
+        if not extrema:
+            return np.nan
+        return self.columns[field][extrema[0] % self.capacity]
+
+    def last(self, field=None):
+        """
+        The most recent value of `field`, or with no field a dict of every
+        field of the most recent entry that has a value.
+        """
+        if not len(self):
+            return np.nan if field is not None else dict()
+        pos = (self._next - 1) % self.capacity
+        if field is not None:
+            return self.columns[field][pos] if field in self.columns else np.nan
+        return {name: column[pos] for name, column in self.columns.items()
+                if not np.isnan(column[pos])}
+
+    def column(self, field):
+        """ Values of `field` in the window from oldest to newest, NaN included """
+        if field not in self.columns:
+            return np.array([])
+        return self._ordered(self.columns[field])
+
+    def timestamps(self):
+        return self._ordered(self.times)
+
+    def restore(self, times, columns, now=None):
+        """
+        Replays stored readings, e.g. from `load` or a database query, so the
+        window is full straight away after a restart.
+
+        Readings not newer than the last one already held are skipped, and
+        the window is then trimmed to `now`, which defaults to the current
+        time.
+
+        Returns:
+            Number of readings added.
+        """
+        order = np.argsort(times, kind='stable')
+        last = self.times[(self._next - 1) % self.capacity] if len(self) else -np.inf
+        added = 0
+        for i in order:
+            if times[i] <= last:
+                continue
+            self.append({field: values[i] for field, values in columns.items()},
+                        timestamp=times[i])
+            last = times[i]
+            added += 1
+        self.expire((time.time() if now is None else now) - self.window)
+        return added
+
+    def save(self, filename):
+        """ Writes the readings in the window as a compressed numpy snapshot """
+        stored = [field for field in self.fields if field not in self.averages]
+        tmp = '{}.tmp'.format(filename)
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, times=self.timestamps(),
+                                **{field: self.column(field) for field in stored})
+        # Replace in one step so a crash never leaves half a snapshot
+        os.replace(tmp, filename)
+
+    def load(self, filename, now=None):
+        """ Restores the readings of a snapshot written by `save` """
+        with np.load(filename) as snapshot:
+            columns = {field: snapshot[field] for field in snapshot.files
+                       if field != 'times' and field in self.columns}
+            return self.restore(snapshot['times'], columns, now=now)
+
+    @property
+    def span(self):
+        """ Seconds between the oldest and newest reading in the window """
+        if not len(self):
+            return 0.
+        return self.times[(self._next - 1) % self.capacity] - self.times[self._first % self.capacity]
+
+    def _ordered(self, column):
+        start = self._first % self.capacity
+        end = start + len(self)
+        if end <= self.capacity:
+            return column[start:end].copy()
+        return np.concatenate([column[start:], column[:end - self.capacity]])
+
+    def _push(self, field, seq):
+        value = self.columns[field][seq % self.capacity]
+        if np.isnan(value):
+            return
+        self._count[field] += 1
+
+        columns = self.columns[field]
+        largest = self._max[field]
+        while largest and columns[largest[-1] % self.capacity] <= value:
+            largest.pop()
+        largest.append(seq)
+
+        smallest = self._min[field]
+        while smallest and columns[smallest[-1] % self.capacity] >= value:
+            smallest.pop()
+        smallest.append(seq)
+
+    def _grow(self):
+        """ Doubles the capacity, keeping every entry at its sequence number """
+        old = self.capacity
+        new = 2 * old
+        seqs = np.arange(self._first, self._next)
+        old_pos = seqs % old
+        new_pos = seqs % new
+
+        times = np.zeros(new)
+        times[new_pos] = self.times[old_pos]
+        self.times = times
+        for field, column in self.columns.items():
+            grown = np.full(new, np.nan)
+            grown[new_pos] = column[old_pos]
+            self.columns[field] = grown
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import hashlib
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_maxsize=4):
+    """
+    The HTTP session shared by the met data sources.
+
+    Keep-alive connections are pooled per host, so sources polling the same
+    server, e.g. the met23 and SkyMapper feeds on mso.anu.edu.au, reuse
+    connections instead of opening a new one for every refresh.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+class ConditionalFetcher(object):
+
+    """
+    Fetches a document over the shared session, revalidating with the ETag
+    and Last-Modified of the previous reply.
+
+    The server answers 304 Not Modified when the document hasn't changed,
+    and servers that ignore conditional requests are caught by comparing a
+    hash of the body, so callers can skip parsing either way.
+
+    Attributes:
+        self.url: Address of the document.
+        self.timeout: Seconds to wait for the server.
+        self.content: Body of the last 200 reply.
+        self.stats: Dict of counters: 'requests', 'changed', 'not_modified'
+            (304 replies), 'unchanged' (200 replies with the same body),
+            'bytes' (body bytes received), 'new_connections' and
+            'reused_connections'.
+    """
+
+    def __init__(self, url, timeout=None, session=None, name=None):
+        self.logger = logging.getLogger(name or 'http-fetcher')
+
+        self.url = url
+        self.timeout = timeout
+        self.session = session or get_session()
+
+        self.content = None
+        self.etag = None
+        self.last_modified = None
+        self._digest = None
+
+        self.stats = {
+            'requests': 0,
+            'changed': 0,
+            'not_modified': 0,
+            'unchanged': 0,
+            'bytes': 0,
+            'new_connections': 0,
+            'reused_connections': 0,
+        }
+
+    def fetch(self):
+        """
+        Gets the document if it changed since the last fetch.
+
+        Returns:
+            Tuple of the body and whether it changed. On a 304 or an identical
+            body the cached body is returned with False.
+        """
+        headers = dict()
+        if self.content is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+
+        connections = self._connections()
+        response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        self._count_connection(connections)
+        self.stats['requests'] += 1
+
+        if response.status_code == 304 and self.content is not None:
+            self.stats['not_modified'] += 1
+            self.logger.debug('{} not modified'.format(self.url))
+            return self.content, False
+
+        response.raise_for_status()
+        self.stats['bytes'] += len(response.content)
+
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+
+        digest = hashlib.sha1(response.content).digest()
+        if digest == self._digest:
+            self.stats['unchanged'] += 1
+            self.logger.debug('{} unchanged'.format(self.url))
+            return self.content, False
+
+        self._digest = digest
+        self.content = response.content
+        self.stats['changed'] += 1
+        return self.content, True
+
+    def _connections(self):
+        """ Number of connections opened so far to the host of `self.url` """
+        try:
+            pools = self.session.get_adapter(self.url).poolmanager.pools
+            host = requests.utils.urlparse(self.url).hostname
+            return sum(pools[key].num_connections for key in pools.keys()
+                       if key.key_host == host)
+        except Exception:
+            return None
+
+    def _count_connection(self, before):
+        """ Counts whether the request opened a new connection to the host """
+        after = self._connections()
+        if before is None or after is None:
+            return
+        if after > before:
+            self.stats['new_connections'] += 1
+        else:
+            self.stats['reused_connections'] += 1
@@ -2,18 +2,39 @@
 
 import logging
 import re
-import requests
-import xmltodict
-
-import astropy.units as u
-from astropy.table import Table
-from astropy.time import Time, TimeDelta
 
 from datetime import datetime as dt
 
 from . import load_config
+from . import metsys
 from .weather_abstract import WeatherDataAbstract
 from .weather_abstract import get_mongodb
+from .weather_http import ConditionalFetcher
+
+# metsys tag of each column, can be overridden with a 'tags' entry in the config
+TAGS = {
+    'date': metsys.DATE,
+    'wind_speed': 'ws',
+    'wind_gust': 'wgust',
+    'wind_direction': 'wd',
+    'wind_wrt_telescope': 'wtt',
+    'dry-bulb_temp': 'tdb',
+    'dewpoint': 'dp',
+    'rel_humidity': 'rh',
+    'barometric_pressure': 'qfe',
+    'sea-level_pressure': 'qnh',
+    'rain_sensor': 'rsens',
+}
+
+
+def rain_status(text):
+    """ Turns the string of the rain condition into an integer number """
+    if text == 'RAINING':
+        return 1
+    elif text == 'NOT_RAINING':
+        return 0
+    return -1
+
 
 class Met23Weather(WeatherDataAbstract):
     """ Gets the weather information from the 2.3 m telescope and checks if the
@@ -30,6 +51,7 @@ class Met23Weather(WeatherDataAbstract):
         self.thresholds: An array of the thresholds for weather entries.
         self.logger: Used to create debugging messages.
         self.max_age: Maximum age of met data that is to be retrieved.
+        self.values: Dict of column name to the latest value of the met data.
     """
 
     def __init__(self, use_mongo=True):
@@ -38,18 +60,28 @@ class Met23Weather(WeatherDataAbstract):
         self.met23_cfg = self.config['weather']['met23']
         self.thresholds = self.met23_cfg['thresholds']
 
-        super().__init__(use_mongo=use_mongo)
+        super().__init__(use_mongo=use_mongo, timeout=self.met23_cfg.get('timeout', 10.),
+                         max_age=self.met23_cfg.get('max_age', 360.),
+                         stale_while_revalidate=self.met23_cfg.get('stale_while_revalidate', False),
+                         max_staleness=self.met23_cfg.get('max_staleness'))
 
         self.logger = logging.getLogger(name=self.met23_cfg.get('name'))
         self.logger.setLevel(logging.INFO)
 
-        self.max_age = TimeDelta(self.met23_cfg.get('max_age', 360.), format='sec')
-
         self._safety_methods = {'rain_condition':self._get_rain_safety,
                                 'wind_condition':self._get_wind_safety,
                                 'gust_condition':self._get_gust_safety}
 
-        self.table_data = None
+        # Worked out once, each poll only converts the wanted values
+        self.extractor = metsys.Extractor(self.met23_cfg.get('column_names'),
+                                          dict(TAGS, **self.met23_cfg.get('tags', {})),
+                                          converters={'rain_sensor': rain_status})
+        self.values = None
+        self._table = None
+
+        # Pooled connection, the feed is only parsed again when it changed
+        self.http = ConditionalFetcher(self.met23_cfg.get('link'), timeout=self.timeout,
+                                       name=self.met23_cfg.get('name'))
 
     def capture(self, use_mongo=False, send_message=False, **kwargs):
         """ Update weather data. """
@@ -58,12 +90,7 @@ class Met23Weather(WeatherDataAbstract):
         data = {}
 
         data['weather_data_name'] = self.met23_cfg.get('name')
-        self.table_data = self.fetch_met23_data()
-
-        col_names = self.met23_cfg.get('column_names')
-
-        for name in col_names.keys():
-            data[name] = self.table_data[name][0]
+        data.update(self.latest_values(self.fetch_met23_data))
 
         self.weather_entries = data
 
@@ -71,61 +98,31 @@ class Met23Weather(WeatherDataAbstract):
 
     def fetch_met23_data(self):
         """ get the weather data from the 2.3 m and then parse the entries
-        that are wanted into a table.
+        that are wanted.
 
         Returns:
-            Table of the 2.3m met data including the entries corresponding units.
+            Dict of column name to value of the 2.3m met data.
         """
-        try:
-            cache_age = Time.now() - self.time
-        except AttributeError:
-            cache_age = 360.1 * u.second
-
-        if cache_age > self.max_age:
-            met23_link = self.met23_cfg.get('link')
-            response = requests.get(met23_link)
-
-            with open('met23.xml', 'wb') as file:
-                file.write(response.content)
-
-            with open('met23.xml') as fd:
-                    doc = xmltodict.parse(fd.read())
-
-            # turns the string of the rain condition into an integer number
-            rain_stat = str(doc['metsys']['data']['rsens']['val'])
-
-            if rain_stat == 'RAINING':
-                rain_val = 1
-            elif rain_stat == 'NOT_RAINING':
-                rain_val = 0
+        if self.cache.get() is None:
+            content, changed = self.http.fetch()
+            if not changed and self.cache.value is not None:
+                # Same document as last time, nothing to parse
+                self.cache.touch()
             else:
-                rain_val = -1
-
-            # gets data from the xml file.
-            data_rows = [(doc['metsys']['date'] + ' ' + doc['metsys']['utc'],
-                          float(doc['metsys']['data']['ws']['val']),
-                          float(doc['metsys']['data']['wgust']['val']),
-                          float(doc['metsys']['data']['wd']['val']),
-                          float(doc['metsys']['data']['wtt']['val']),
-                          float(doc['metsys']['data']['tdb']['val']),
-                          float(doc['metsys']['data']['dp']['val']),
-                          float(doc['metsys']['data']['rh']['val']),
-                          float(doc['metsys']['data']['qfe']['val']),
-                          float(doc['metsys']['data']['qnh']['val']),
-                          rain_val
-                          )]
-
-            col_names = self.met23_cfg.get('column_names')
-
-            self.met23_table = Table(rows=data_rows, names=col_names.keys())
-
-            # Set units for items
-            for name, unit in col_names.items():
-                self.met23_table[name].unit = unit
-
-            self.time = Time.now()
-
-        return(self.met23_table)
+                # parses the response in memory, only keeping the wanted values
+                values = self.extractor.extract(content)
+                if self.cache.put(values['date'], values):
+                    self._table = None
+
+        self.values = self.cache.value
+        return(self.values)
+
+    @property
+    def met23_table(self):
+        """ Table of the latest 2.3m met data with units, built when first asked for """
+        if self._table is None and self.values is not None:
+            self._table = self.extractor.table(self.values)
+        return self._table
 
     def _get_rain_safety(self, statuses):
         """Gets the rain safety and weather conditions
@@ -2,35 +2,17 @@
 
 import logging
 
-import astropy.units as u
 from astropy.units import cds
-from astropy.table import Table
-from astropy.time import Time, TimeISO, TimeDelta
-from astropy.utils.data import download_file
 
 from datetime import datetime as dt
 
 from . import load_config
+from . import metdata
+from . import metsys
 from .weather_abstract import WeatherDataAbstract
 from .weather_abstract import get_mongodb
 
 
-class MixedUpTime(TimeISO):
-    """Subclass the astropy.time.TimeISO time format to handle the mixed up
-    American style time format that the AAT met system uses.
-    """
-
-    name= 'mixed_up_time'
-    subfmts = (('date_hms',
-                '%m-%d-%Y %H:%M:%S',
-                '{mon:02d}-{day:02d}-{year:d} {hour:02d}:{min:02d}:{sec:02d}'),
-               ('date_hm',
-                '%m-%d-%Y %H:%M',
-                '{mon:02d}-{day:02d}-{year:d} {hour:02d}:{min:02d}'),
-               ('date',
-                '%m-%d-%Y',
-                '{mon:02d}-{day:02d}-{year:d}'))
-
 # -----------------------------------------------------------------------------
 #   AAT metdata Weather Data Class
 # -----------------------------------------------------------------------------
@@ -48,6 +30,7 @@ class AATMetData(WeatherDataAbstract):
         self.thresholds: An array of the thresholds for weather entries.
         self.logger: Used to create debugging messages.
         self.max_age: Maximum age of met data that is to be retrieved.
+        self.values: Dict of column name to the values of the newest record.
     """
 
     def __init__(self, use_mongo=True):
@@ -56,20 +39,21 @@ class AATMetData(WeatherDataAbstract):
         self.metdata_cfg = self.config['weather']['aat_metdata']
         self.thresholds = self.metdata_cfg['thresholds']
 
-        super().__init__(use_mongo=use_mongo)
+        super().__init__(use_mongo=use_mongo, timeout=self.metdata_cfg.get('timeout', 10.),
+                         max_age=self.metdata_cfg.get('max_age', 60.),
+                         stale_while_revalidate=self.metdata_cfg.get('stale_while_revalidate', False),
+                         max_staleness=self.metdata_cfg.get('max_staleness'))
 
         self.logger = logging.getLogger(name=self.metdata_cfg.get('name'))
         self.logger.setLevel(logging.INFO)
 
-        self.max_age = TimeDelta(self.metdata_cfg.get('max_age', 60.), format='sec')
-
         self._safety_methods = {'rain_condition':self._get_rain_safety,
                                 'wetness_condition':self._get_wetness_safety,
                                 'wind_condition':self._get_wind_safety,
                                 'gust_condition':self._get_gust_safety,
                                 'sky_condition':self._get_cloud_safety}
 
-        self.table_data = None
+        self.values = None
 
     def capture(self, use_mongo=False, send_message=False, **kwargs):
         """ Update weather data. """
@@ -78,58 +62,48 @@ class AATMetData(WeatherDataAbstract):
         data = {}
 
         data['weather_data_name'] = self.metdata_cfg.get('name')
-        self.table_data = self.fetch_met_data()
-
-        col_names = self.metdata_cfg.get('column_names')
-
-        for name in col_names.keys():
-            data[name] = self.table_data[name][0]
+        data.update(self.latest_values(self.fetch_met_data))
 
         self.weather_entries = data
 
         return super().capture(use_mongo=False, send_message=False, **kwargs)
 
     def fetch_met_data(self):
-        """Fetches the AAT met data and parses it through a table
+        """Fetches the newest record of the AAT met data
+
+        Only the start of the file, where the newest record is, is
+        transferred and parsed.
 
         Returns:
-            Table of the AAT met data including the entries corresponding units.
+            Dict of column name to value of the newest AAT met data, the
+            'time_UTC' is a UTC datetime.
         """
-        try:
-            time_factor = 84600 * u.seconds
-            cache_age = Time.now() - self._met_data['time_UTC'][0] * time_factor
-        except AttributeError:
-            cache_age = 61. * u.second
-
-        if cache_age > self.max_age:
-            # Download met data file
-            metdata_link = self.metdata_cfg.get('link')
-            metdata_file = download_file(metdata_link)
-            m = open(metdata_file).read()
+        if self.cache.get() is None:
+            record = metdata.read_newest(self.metdata_cfg.get('link'),
+                                         self.metdata_cfg.get('column_names').keys(),
+                                         timeout=self.timeout)
+            self.cache.put(record['time_UTC'], record)
 
-            met = m.replace('."\n',' ')
-            met = met.replace('" ', '')
+        self.values = self.cache.value
+        return self.values
 
-            col_names = self.metdata_cfg.get('column_names')
+    def fetch_met_table(self):
+        """Fetches every record of the AAT met data, e.g. to backfill the database
 
-            # Parse the tab delimited met data into a Table
-            t = Table.read(met, format='ascii.no_header', delimiter='\t',
-                                names=col_names.keys())
-
-            # Convert time strings to Time
-            t['time_UTC'] = Time(t['time_UTC'], format='mixed_up_time')
-            # Change string format to ISO
-            t['time_UTC'].format = 'iso'
-            # Convert from AAT standard time to UTC
-            t['time_UTC'] = t['time_UTC'] - 10 * u.hour
+        Returns:
+            Table of the AAT met data including the entries corresponding units.
+        """
+        col_names = self.metdata_cfg.get('column_names')
 
-            # Set units for items that have them
-            for name, unit in col_names.items():
-                t[name].unit = unit
+        t = metdata.read_table(metdata.fetch(self.metdata_cfg.get('link'), timeout=self.timeout),
+                               col_names.keys())
 
-            self._met_data = t
+        # Set units for items that have them
+        for name, unit in col_names.items():
+            if name != 'time_UTC':
+                t[name].unit = metsys.parse_unit(unit)
 
-        return self._met_data
+        return t
 
     def _get_rain_safety(self, statuses):
         """Gets the rain safety and weather conditions
@@ -2,18 +2,36 @@
 
 import logging
 import re
-import requests
-import xmltodict
-
-import astropy.units as u
-from astropy.table import Table
-from astropy.time import Time, TimeDelta
 
 from datetime import datetime as dt
 
 from . import load_config
+from . import metsys
 from .weather_abstract import WeatherDataAbstract
 from .weather_abstract import get_mongodb
+from .weather_http import ConditionalFetcher
+
+# metsys tag of each column, can be overridden with a 'tags' entry in the config
+TAGS = {
+    'date': metsys.DATE,
+    'int_rain_sensor': 'irs',
+    'ext_rain_sensor': 'ers',
+    'wind_speed': 'ws',
+    'wind_gust': 'wsx',
+    'wind_direction': 'wd',
+    'external_temp': 'tdb',
+    'dewpoint': 'dp',
+    'rel_humidity': 'rh',
+    'barometric_pressure': 'qfe',
+    'internal_temp': 'it',
+    'rain_intensity': 'rain',
+    'rain_duration': 'rdur',
+    'rain_accumulation': 'racc',
+    'hail_intensity': 'hail',
+    'hail_accumulation': 'hacc',
+    'hail_duration': 'hdur',
+    'sky-ambient': 'skyt',
+}
 
 class SkyMapWeather(WeatherDataAbstract):
     """ Gets the weather information from the SkyMapper telescope and checks if
@@ -30,6 +48,7 @@ class SkyMapWeather(WeatherDataAbstract):
         self.thresholds: An array of the thresholds for weather entries.
         self.logger: Used to create debugging messages.
         self.max_age: Maximum age of met data that is to be retrieved.
+        self.values: Dict of column name to the latest value of the met data.
     """
 
     def __init__(self, use_mongo=True):
@@ -38,19 +57,30 @@ class SkyMapWeather(WeatherDataAbstract):
         self.skymap_cfg = self.config['weather']['skymap']
         self.thresholds = self.skymap_cfg['thresholds']
 
-        super().__init__(use_mongo=use_mongo)
+        super().__init__(use_mongo=use_mongo, timeout=self.skymap_cfg.get('timeout', 10.),
+                         max_age=self.skymap_cfg.get('max_age', 360.),
+                         stale_while_revalidate=self.skymap_cfg.get('stale_while_revalidate', False),
+                         max_staleness=self.skymap_cfg.get('max_staleness'))
 
         self.logger = logging.getLogger(name=self.skymap_cfg.get('name'))
         self.logger.setLevel(logging.INFO)
 
-        self.max_age = TimeDelta(self.skymap_cfg.get('max_age', 360.), format='sec')
-
         self._safety_methods = {'rain_condition':self._get_rain_safety,
                                 'sky_condition':self._get_cloud_safety,
                                 'wind_condition':self._get_wind_safety,
                                 'gust_condition':self._get_gust_safety}
 
-        self.table_data = None
+        # Worked out once, each poll only converts the wanted values
+        self.extractor = metsys.Extractor(self.skymap_cfg.get('column_names'),
+                                          dict(TAGS, **self.skymap_cfg.get('tags', {})),
+                                          converters={'int_rain_sensor': int,
+                                                      'ext_rain_sensor': int})
+        self.values = None
+        self._table = None
+
+        # Pooled connection, the feed is only parsed again when it changed
+        self.http = ConditionalFetcher(self.skymap_cfg.get('link'), timeout=self.timeout,
+                                       name=self.skymap_cfg.get('name'))
 
     def capture(self, use_mongo=False, send_message=False, **kwargs):
         """ Update weather data. """
@@ -59,12 +89,7 @@ class SkyMapWeather(WeatherDataAbstract):
         data = {}
 
         data['weather_data_name'] = self.skymap_cfg.get('name')
-        self.table_data = self.fetch_skymap_data()
-
-        col_names = self.skymap_cfg.get('column_names')
-        
-        for name in col_names.keys():
-            data[name] = self.table_data[name][0]
+        data.update(self.latest_values(self.fetch_skymap_data))
 
         self.weather_entries = data
 
@@ -72,59 +97,31 @@ class SkyMapWeather(WeatherDataAbstract):
 
     def fetch_skymap_data(self):
         """ get the weather data from SkyMapper and then parse the entries
-        that are wanted into a table
+        that are wanted
 
         Returns:
-            Table of the SkyMapper met data including the entries corresponding
-            units.
+            Dict of column name to value of the SkyMapper met data.
         """
-        try:
-            cache_age = Time.now() - self.time
-        except AttributeError:
-            cache_age = 360.1 * u.second
-
-        if cache_age > self.max_age:
-            skymap_link = self.skymap_cfg.get('link')
-            response = requests.get(skymap_link)
-
-            with open('skymap.xml', 'wb') as file:
-                file.write(response.content)
-
-            with open('skymap.xml') as fd:
-                    doc = xmltodict.parse(fd.read())
-
-            # gets the values of the data from the xml file
-            data_rows = [(doc['metsys']['date'] + ' ' + doc['metsys']['utc'],
-                          int(doc['metsys']['data']['irs']['val']),
-                          int(doc['metsys']['data']['ers']['val']),
-                          float(doc['metsys']['data']['ws']['val']),
-                          float(doc['metsys']['data']['wsx']['val']),
-                          float(doc['metsys']['data']['wd']['val']),
-                          float(doc['metsys']['data']['tdb']['val']),
-                          float(doc['metsys']['data']['dp']['val']),
-                          float(doc['metsys']['data']['rh']['val']),
-                          float(doc['metsys']['data']['qfe']['val']),
-                          float(doc['metsys']['data']['it']['val']),
-                          float(doc['metsys']['data']['rain']['val']),
-                          float(doc['metsys']['data']['rdur']['val']),
-                          float(doc['metsys']['data']['racc']['val']),
-                          float(doc['metsys']['data']['hail']['val']),
-                          float(doc['metsys']['data']['hacc']['val']),
-                          float(doc['metsys']['data']['hdur']['val']),
-                          float(doc['metsys']['data']['skyt']['val']),
-                         )]
-
-            col_names = self.skymap_cfg.get('column_names')
-
-            self.skymap_table = Table(rows=data_rows, names=col_names.keys())
-
-            # Set units for items
-            for name, unit in col_names.items():
-                self.skymap_table[name].unit = unit
-
-            self.time = Time.now()
-
-        return(self.skymap_table)
+        if self.cache.get() is None:
+            content, changed = self.http.fetch()
+            if not changed and self.cache.value is not None:
+                # Same document as last time, nothing to parse
+                self.cache.touch()
+            else:
+                # parses the response in memory, only keeping the wanted values
+                values = self.extractor.extract(content)
+                if self.cache.put(values['date'], values):
+                    self._table = None
+
+        self.values = self.cache.value
+        return(self.values)
+
+    @property
+    def skymap_table(self):
+        """ Table of the latest SkyMapper met data with units, built when first asked for """
+        if self._table is None and self.values is not None:
+            self._table = self.extractor.table(self.values)
+        return self._table
 
     def _get_rain_safety(self, statuses):
         """Gets the rain safety and weather conditions
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import calendar
+import copy
+import numpy as np
+import time
+import yaml
+
+from datetime import datetime as dt
+
+from peas import backtest
+from peas import load_config
+
+
+def load_history(db, source, cfg, start, end):
+    """
+    Reads the stored readings of a source between two datetimes.
+
+    Returns:
+        Tuple of the epoch times and a dict of column to array.
+    """
+    if source == 'aag':
+        docs = db.weather.find({'date': {'$gte': start, '$lt': end}})
+        names = ['sky_temp_C', 'ambient_temp_C', 'wind_speed_KPH', 'rain_frequency']
+    else:
+        docs = db.Weather.find({'date': {'$gte': start, '$lt': end},
+                                'data.weather_data_name': cfg.get('name')})
+        names = list(cfg['thresholds'])
+
+    times = list()
+    rows = list()
+    for doc in docs:
+        data = doc.get('data', {})
+        timestamp = data.get('timestamp')
+        if timestamp is None:
+            date = doc['date']
+            timestamp = calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+        times.append(timestamp)
+        rows.append(data)
+
+    columns = {name: np.array([row.get(name) for row in rows], dtype=object) for name in names}
+    return np.array(times, dtype=float), columns
+
+
+def threshold_sets(source, cfg, vary=None, thresholds_file=None):
+    """ The configured thresholds, then every variation asked for """
+    if source == 'aag':
+        settings = [cfg]
+        for key, *values in vary or []:
+            settings += [dict(cfg, **{key: float(value)}) for value in values]
+    else:
+        settings = [cfg['thresholds']]
+        if thresholds_file:
+            with open(thresholds_file) as f:
+                for thresholds in yaml.safe_load(f):
+                    merged = copy.deepcopy(cfg['thresholds'])
+                    merged.update(thresholds)
+                    settings.append(merged)
+    return settings
+
+
+def describe(settings, base):
+    """ The entries of a threshold set that differ from the configured ones """
+    changed = {key: value for key, value in settings.items() if base.get(key) != value}
+    return ', '.join('{}={}'.format(key, value) for key, value in changed.items()) or 'config'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from pocs.utils.database import PanMongo
+
+    parser = argparse.ArgumentParser(
+        description="Replay stored weather through alternative safety thresholds.")
+    parser.add_argument('start', help="UTC start date, YYYY-MM-DD")
+    parser.add_argument('end', help="UTC end date, YYYY-MM-DD")
+    parser.add_argument('-s', '--source', default='aag',
+                        choices=['aag', 'aat_metdata', 'met23', 'skymap'])
+    parser.add_argument('--vary', nargs='+', action='append', metavar=('KEY', 'VALUE'),
+                        help="AAG setting and the values to try, e.g. --vary threshold_cloudy -30 -20")
+    parser.add_argument('--thresholds', help="yaml list of threshold sets to try for the "
+                        "other sources, each overriding the configured thresholds by column")
+    parser.add_argument('--shard-days', type=float, default=1., help="Days per worker task")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes")
+    args = parser.parse_args()
+
+    weather_cfg = load_config()['weather']
+    cfg = weather_cfg['aag_cloud' if args.source == 'aag' else args.source]
+
+    start = dt.strptime(args.start, '%Y-%m-%d')
+    end = dt.strptime(args.end, '%Y-%m-%d')
+    times, columns = load_history(PanMongo(), args.source, cfg, start, end)
+    print("Loaded {} readings from {} to {}".format(len(times), args.start, args.end))
+
+    settings = threshold_sets(args.source, cfg, vary=args.vary, thresholds_file=args.thresholds)
+    base = settings[0]
+
+    t0 = time.time()
+    results = backtest.backtest(times, columns, settings, source=args.source,
+                                processes=args.processes, shard_seconds=86400. * args.shard_days)
+    print("Replayed {} threshold sets in {:.1f} s".format(len(settings), time.time() - t0))
+
+    print("{:>10s} {:>8s} {:>10s}  {}".format('Unsafe (%)', 'Flips', 'To unsafe', 'Thresholds'))
+    for result, s in zip(results, settings):
+        print("{:10.2f} {:8d} {:10d}  {}".format(
+            100. * result['unsafe_fraction'], result['flips'], result['to_unsafe'],
+            describe(s, base)))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import time
+
+from peas.feed_server import FeedServer
+from peas.feed_server import SNAPSHOT_DIR
+from peas.weather_met23 import Met23Weather
+from peas.weather_metdata import AATMetData
+from peas.weather_skymap import SkyMapWeather
+
+SOURCES = {
+    'aat_metdata': AATMetData,
+    'met23': Met23Weather,
+    'skymap': SkyMapWeather,
+}
+
+
+def point_at(source, link):
+    """ Makes a source fetch from `link` instead of its configured feed """
+    if hasattr(source, 'http'):
+        source.http.url = link
+    else:
+        source.metdata_cfg['link'] = link
+
+
+def run(source, n):
+    """ Captures `n` times, returns the seconds taken by each """
+    times = list()
+    for _ in range(n):
+        start = time.perf_counter()
+        source.capture()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Time the met data sources against local snapshots of their feeds.")
+    parser.add_argument('-n', '--number', type=int, default=200, help="Captures per source")
+    parser.add_argument('--snapshots', default=SNAPSHOT_DIR)
+    parser.add_argument('--latency', type=float, default=0., help="Seconds before each reply")
+    parser.add_argument('--cadence', type=float, default=None,
+                        help="Seconds between versions of the snapshots")
+    parser.add_argument('--no-304', action='store_true', default=False)
+    parser.add_argument('--max-age', type=float, default=0.,
+                        help="Cache lifetime of the sources, 0 to fetch on every capture")
+    args = parser.parse_args()
+
+    with FeedServer(args.snapshots, latency=args.latency, cadence=args.cadence,
+                    conditional=not args.no_304) as server:
+        for section, link in sorted(server.links().items()):
+            source = SOURCES[section](use_mongo=False)
+            point_at(source, link)
+            source.cache.max_age = args.max_age
+
+            requests_before = server.stats['requests']
+            times = sorted(run(source, args.number))
+            print("{:12s} {:8.2f} ms median {:8.2f} ms 95th percentile, {} requests".format(
+                section, 1e3 * times[len(times) // 2], 1e3 * times[int(0.95 * (len(times) - 1))],
+                server.stats['requests'] - requests_before))
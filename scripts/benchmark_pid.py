@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+import timeit
+
+from peas.PID import PID
+
+
+def run(n, max_age, interval=1.):
+    pid = PID(Kp=3.0, Ki=0.02, Kd=200.0, set_point=10., max_age=max_age,
+              output_limits=[10, 100])
+    for i in range(n):
+        pid.recalculate(10. + (i % 5) - 2., interval=interval)
+    return pid
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time PID.recalculate for long histories.")
+    parser.add_argument('-n', '--number', default=100000, type=int,
+                        help="Number of recalculations per run")
+    parser.add_argument('-r', '--repeat', default=3, type=int, help="Number of runs")
+    args = parser.parse_args()
+
+    for max_age in [10, 300, 3000, 30000]:
+        times = timeit.repeat(lambda: run(args.number, max_age), number=1, repeat=args.repeat)
+        print("max_age={:>6d} s: {:8.2f} us per recalculation".format(
+            max_age, 1e6 * min(times) / args.number))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import calendar
+
+from datetime import datetime as dt
+
+from astropy.utils import console
+from pymongo import UpdateOne
+
+from pocs.utils.database import PanMongo
+
+# Format of the dates stored by AAGCloudSensor before they became datetimes
+LEGACY_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+
+def convert(date_string):
+    """ Returns the UTC datetime and epoch time of a legacy date string """
+    date = dt.strptime(date_string, LEGACY_FORMAT)
+    return date, calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+
+
+def migrate(collection, batch_size=1000, dry_run=False):
+    """
+    Rewrites the string 'data.date' of weather documents as a datetime and
+    adds the matching 'data.timestamp', in bulk writes of `batch_size`.
+
+    Returns:
+        Tuple of the number of documents updated and skipped.
+    """
+    updated = 0
+    skipped = 0
+    requests = list()
+
+    query = {'data.date': {'$type': 'string'}}
+    for doc in collection.find(query, {'data.date': 1}, no_cursor_timeout=True):
+        try:
+            date, timestamp = convert(doc['data']['date'])
+        except ValueError:
+            skipped += 1
+            continue
+
+        requests.append(UpdateOne({'_id': doc['_id']},
+                                  {'$set': {'data.date': date, 'data.timestamp': timestamp}}))
+        if len(requests) >= batch_size:
+            updated += write(collection, requests, dry_run)
+            requests = list()
+
+    if requests:
+        updated += write(collection, requests, dry_run)
+
+    return updated, skipped
+
+
+def write(collection, requests, dry_run=False):
+    if dry_run:
+        return len(requests)
+    result = collection.bulk_write(requests, ordered=False)
+    return result.modified_count
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert the string dates of stored AAG weather readings to datetimes.")
+    parser.add_argument('-c', '--collections', nargs='+', default=['weather', 'current'],
+                        help="Collections to migrate, defaults to weather and current")
+    parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                        help="Documents per bulk write, defaults to 1000")
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+                        help="Count the documents to convert without writing")
+    args = parser.parse_args()
+
+    db = PanMongo()
+    for name in args.collections:
+        console.color_print('Migrating {}'.format(name))
+        updated, skipped = migrate(getattr(db, name), batch_size=args.batch_size,
+                                   dry_run=args.dry_run)
+        console.color_print("\t{:8d} converted".format(updated), 'green',
+                            "\t{:8d} skipped".format(skipped), 'red')
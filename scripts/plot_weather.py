@@ -18,6 +18,8 @@ from astropy.time import Time
 from astroplan import Observer
 from astropy.coordinates import EarthLocation
 
+from peas import stats
+
 import matplotlib as mpl
 mpl.use('Agg')
 from matplotlib import pyplot as plt
@@ -389,8 +391,10 @@ class WeatherPlotter(object):
         w_axes = plt.axes(self.plot_positions[2][0])
 
         wind_speed = self.table['wind_speed_KPH']
-        wind_mavg = moving_average(wind_speed, 9)
-        matime, wind_mavg = moving_averagexy(self.time, wind_speed, 9)
+        # Ten minute trailing average, over the real sample times
+        seconds = self.time.values.astype('datetime64[ns]').astype(float) / 1e9
+        matime = self.time
+        wind_mavg = stats.WindowedMean(600.).batch(seconds, np.asarray(wind_speed, dtype=float))
         wind_condition = self.table['wind_condition']
 
         w_axes.plot_date(self.time, wind_speed, 'ko', alpha=0.5,
@@ -714,27 +718,6 @@ class WeatherPlotter(object):
         self.fig.savefig(plot_filename, dpi=self.dpi, bbox_inches='tight', pad_inches=0.10)
 
 
-def moving_average(interval, window_size):
-    """ A simple moving average function """
-    if window_size > len(interval):
-        window_size = len(interval)
-    window = np.ones(int(window_size)) / float(window_size)
-    return np.convolve(interval, window, 'same')
-
-
-def moving_averagexy(x, y, window_size):
-    if window_size > len(y):
-        window_size = len(y)
-    if window_size % 2 == 0:
-        window_size += 1
-    nxtrim = int((window_size - 1) / 2)
-    window = np.ones(int(window_size)) / float(window_size)
-    yma = np.convolve(y, window, 'valid')
-    xma = x[2 * nxtrim:]
-    assert len(xma) == len(yma)
-    return xma, yma
-
-
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import time
+import yaml
+
+from peas.feed_server import FeedServer
+from peas.feed_server import SNAPSHOT_DIR
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Serve snapshots of the AAT, 2.3 m and SkyMapper met feeds locally.")
+    parser.add_argument('--snapshots', default=SNAPSHOT_DIR,
+                        help="Directory of metdata1.dat, met23.xml and skymap.xml snapshots, "
+                        "extra versions named e.g. met23.xml.1")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8080)
+    parser.add_argument('--ftp-port', type=int, default=2121)
+    parser.add_argument('--latency', type=float, default=0., help="Seconds before each reply")
+    parser.add_argument('--cadence', type=float, default=None,
+                        help="Seconds between versions of the snapshots")
+    parser.add_argument('--no-304', action='store_true', default=False,
+                        help="Ignore conditional requests, always send the whole document")
+    parser.add_argument('--failure-rate', type=float, default=0.,
+                        help="Fraction of requests that fail")
+    parser.add_argument('--failure', choices=['error', 'hang'], default='error')
+    parser.add_argument('--hang', type=float, default=60., help="Seconds a hung request takes")
+    args = parser.parse_args()
+
+    server = FeedServer(args.snapshots, host=args.host, http_port=args.http_port,
+                        ftp_port=args.ftp_port, latency=args.latency, cadence=args.cadence,
+                        conditional=not args.no_304, failure_rate=args.failure_rate,
+                        failure=args.failure, hang=args.hang)
+    server.start()
+
+    print("Point the sources at this server in config_local.yaml:\n")
+    print(yaml.safe_dump({'weather': {section: {'link': link}
+                                      for section, link in server.links().items()}},
+                         default_flow_style=False))
+
+    try:
+        while True:
+            time.sleep(60)
+            print("{requests} requests, {not_modified} not modified, {failures} failed, "
+                  "{bytes} bytes sent".format(**server.stats))
+    except KeyboardInterrupt:
+        server.stop()
@@ -5,6 +5,7 @@ import sys
 sys.path.append("C:\\Users\\tiger.JERMAINE\\Documents\\HWM\\PEAS")
 sys.path.append("C:\\Users\\tiger.JERMAINE\\Documents\\HWM\\POCS")
 
+import asyncio
 import datetime
 import pandas
 import time
@@ -19,6 +20,7 @@ from peas import weather
 from peas import weather_metdata
 from peas import weather_met23
 from peas import weather_skymap
+from peas import weather_async
 
 
 def get_plot(filename=None):
@@ -172,10 +174,14 @@ if __name__ == '__main__':
     parser.add_argument('--plotly-stream', action='store_true', default=False, help="Stream to plotly")
     parser.add_argument('--store-mongo', action='store_true', default=True, help="Save to mongo")
     parser.add_argument('--send-message', action='store_true', default=True, help="Send message")
+    parser.add_argument('--background', action='store_true', default=False,
+                        help="Poll the AAG on a background thread")
     args = parser.parse_args()
 
     # Weather objects
     aag = weather.AAGCloudSensor(serial_address=args.serial_port, use_mongo=args.store_mongo)
+    if args.background:
+        aag.start_acquisition()
     aat = weather_metdata.AATMetData(use_mongo=args.store_mongo)
     met23 = weather_met23.Met23Weather(use_mongo=args.store_mongo)
     skymap = weather_skymap.SkyMapWeather(use_mongo=args.store_mongo)
@@ -184,21 +190,30 @@ if __name__ == '__main__':
         streams = None
         streams = get_plot(filename=args.filename)
 
+    # The AAG serial cycle overlaps with the network fetches
+    sources = [('aag', aag), ('aat', aat), ('skymap', skymap), ('met23', met23)]
+    runner = weather_async.AsyncWeatherRunner()
+    for name, source in sources:
+        runner.add(name, source, use_mongo=args.store_mongo, send_message=args.send_message)
+    loop = asyncio.get_event_loop()
+
     while True:
-        aag_data = aag.capture(use_mongo=args.store_mongo, send_message=args.send_message)
-        aat_data = aat.capture(use_mongo=args.store_mongo, send_message=args.send_message)
-        skymap_data = skymap.capture(use_mongo=args.store_mongo, send_message=args.send_message)
-        met23_data = met23.capture(use_mongo=args.store_mongo, send_message=args.send_message)
+        readings = loop.run_until_complete(runner.capture_all())
+        aag_data = readings['aag']
+        aat_data = readings['aat']
+        skymap_data = readings['skymap']
+        met23_data = readings['met23']
 
-        # Save data to file
+        # Save data to file, sources that missed their deadline give None
         if args.filename is not None:
-            write_capture_aag(filename=args.filename, data=aag_data)
-            write_capture_aat(filename=args.filename, data=aat_data)
-            write_capture_skymap(filename=args.filename, data=skymap_data)
-            write_capture_met23(filename=args.filename, data=met23_data)
+            for write, data in [(write_capture_aag, aag_data), (write_capture_aat, aat_data),
+                                (write_capture_skymap, skymap_data),
+                                (write_capture_met23, met23_data)]:
+                if data is not None:
+                    write(filename=args.filename, data=data)
 
         # Plot the weather data from the AAG sensor
-        if args.plotly_stream:
+        if args.plotly_stream and aag_data is not None:
             now = datetime.datetime.now()
             streams['temp'].write({'x': now, 'y': aag_data['Ambient temperature']})
             streams['cloudiness'].write({'x': now, 'y': aag_data['Sky temperature']})
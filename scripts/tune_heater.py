@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+import time
+
+from peas import heater_sim
+from peas import load_config
+
+
+def load_series(data_file, threshold_wet=2200.):
+    """ Reads times, ambient and rain sensor temperatures from an exported csv """
+    data = pd.read_csv(data_file, parse_dates=['date']).sort_values('date')
+    data = data.dropna(subset=['ambient_temp_C'])
+    times = (data['date'] - data['date'].iloc[0]).dt.total_seconds().values
+    series = {
+        'times': times,
+        'ambient': data['ambient_temp_C'].values.astype(float),
+        'sensor_temp': data['rain_sensor_temp_C'].values.astype(float),
+        'pwm': data['pwm_value'].values.astype(float) if 'pwm_value' in data else None,
+        'wet': None,
+    }
+    if 'rain_frequency' in data:
+        series['wet'] = data['rain_frequency'].values <= threshold_wet
+    return series
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune the AAG heater PID gains on recorded weather.")
+    parser.add_argument('data_file', help="csv with date, ambient_temp_C, rain_sensor_temp_C, "
+                        "pwm_value and rain_frequency columns, as used by plot_weather.py")
+    parser.add_argument('--Kp', nargs=3, type=float, default=[0.5, 10., 20], metavar=('MIN', 'MAX', 'N'))
+    parser.add_argument('--Ki', nargs=3, type=float, default=[0., 0.1, 11], metavar=('MIN', 'MAX', 'N'))
+    parser.add_argument('--Kd', nargs=3, type=float, default=[0., 500., 11], metavar=('MIN', 'MAX', 'N'))
+    parser.add_argument('--tau', type=float, default=None,
+                        help="Sensor time constant in seconds, fitted to the data by default")
+    parser.add_argument('--heating', type=float, default=None,
+                        help="Deg C per percent of PWM, fitted to the data by default")
+    parser.add_argument('--power-weight', type=float, default=0.,
+                        help="Deg C of tracking error worth one percent of mean power")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes")
+    parser.add_argument('--top', type=int, default=10, help="Number of gains to list")
+    args = parser.parse_args()
+
+    aag_cfg = load_config()['weather']['aag_cloud']
+    heater_cfg = aag_cfg.get('heater', heater_sim.DEFAULT_HEATER)
+    series = load_series(args.data_file, threshold_wet=aag_cfg.get('threshold_wet', 2000.))
+
+    tau, heating = args.tau, args.heating
+    if (tau is None or heating is None) and series['pwm'] is not None:
+        fit_tau, fit_heating = heater_sim.fit_plant(series['times'], series['ambient'],
+                                                    series['sensor_temp'], series['pwm'])
+        tau = fit_tau if tau is None else tau
+        heating = fit_heating if heating is None else heating
+    tau = 120. if tau is None else tau
+    heating = 0.15 if heating is None else heating
+    print("Plant: tau = {:.1f} s, heating = {:.3f} C/%".format(tau, heating))
+
+    gains = heater_sim.gain_grid(*[np.linspace(lo, hi, int(n)) for lo, hi, n in
+                                   (args.Kp, args.Ki, args.Kd)])
+
+    start = time.time()
+    results = heater_sim.sweep(series['times'], series['ambient'], gains,
+                               processes=args.processes,
+                               heater_cfg=heater_cfg,
+                               wet=series['wet'],
+                               sensor_temp0=series['sensor_temp'][0],
+                               tau=tau, heating=heating,
+                               dead_band=float(heater_cfg.get('dead_band', 0.)),
+                               heater_interval=float(heater_cfg.get('interval', 0.)))
+    print("Simulated {} gains over {} readings in {:.1f} s".format(
+        len(gains), len(series['times']), time.time() - start))
+
+    print("{:>8s} {:>8s} {:>8s} {:>10s} {:>10s} {:>8s}".format(
+        'Kp', 'Ki', 'Kd', 'RMS (C)', 'Power (%)', 'Changes'))
+    for i in heater_sim.rank(results, power_weight=args.power_weight)[:args.top]:
+        print("{:8.3f} {:8.4f} {:8.1f} {:10.3f} {:10.1f} {:8d}".format(
+            *results['gains'][i], results['rms_error'][i], results['mean_power'][i],
+            results['changes'][i]))